@@ -0,0 +1,178 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# preparsed store of the arrival data files (data/*.dat)
+# the day files ("2022-6-10 0:14:38" per line) are converted once into integer
+# second offsets relative to 00:00:00 of the day, the 48 bin distribution file into
+# its probabilities. All offsets are saved in one int32 .npy file that is memory
+# mapped, the index (file -> slice, distributions, mtime/size of the sources) is a
+# json file beside it. The store is cached in the process and compiled again as
+# soon as a source file changed (mtime or size).
+###################################################################################
+import os
+import json
+import time
+import glob
+import logging
+import numpy as np
+
+logger = logging.getLogger('main.arrival_store')
+
+STORE_VERSION = 1
+STORE_DIR = ".arrival_store"                                    # folder of the compiled store inside the data folder
+DISTRIBUTION_FILES = ["user_random_dist.dat"]                   # 48 bin distributions [%], all other *.dat files are day files
+
+stores = {}                                                     # in process cache: data folder -> Arrival_Store
+
+def get_time_stamp(time_str):
+    '''
+    seconds since 1970.1.1 00:00:00 of the local time string "%Y-%m-%d %H:%M:%S" (same as users.get_time_stamp)
+    '''
+    return int(time.mktime(time.strptime(time_str, "%Y-%m-%d %H:%M:%S")))
+
+def parse_day_file(path : str):
+    '''
+    return the arrival times of a day file as seconds after 00:00:00 of its first date
+    '''
+    with open(path) as f:
+        lines = f.read().splitlines()
+    if len(lines) == 0:
+        return []
+    basic = get_time_stamp(lines[0].split(" ")[0] + " 00:00:00")
+    return [get_time_stamp(line) - basic for line in lines]
+
+def parse_distribution_file(path : str):
+    '''
+    return the 48 probabilities of a distribution file (values in %), None if the format is wrong
+    '''
+    with open(path) as f:
+        lines = f.read().splitlines()
+    if len(lines) != 48:
+        logger.error('%s is not a correct distribution data format(should be 48 float)', path)
+        return None
+    return [float(line) / 100.0 for line in lines]
+
+def get_source_state(path : str):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+class Arrival_Store():
+    '''
+    compiled arrival data of one data folder
+    arrivals:   int32 array of the offsets of all day files (memory map if the store is on disk)
+    index:      {"version", "days": name -> [start, stop], "distributions": name -> 48 probabilities,
+                 "sources": name -> [mtime_ns, size]}
+    '''
+    def __init__(self, data_dir : str, arrivals, index : dict):
+        self.data_dir = data_dir
+        self.arrivals = arrivals
+        self.index = index
+
+    def is_valid(self, name : str):
+        '''
+        check that the source file name is part of the store and was not changed since the compilation
+        '''
+        if name not in self.index["sources"]:
+            return False
+        try:
+            return get_source_state(os.path.join(self.data_dir, name)) == self.index["sources"][name]
+        except FileNotFoundError:
+            return False
+
+    def get_day(self, name : str):
+        start, stop = self.index["days"][name]
+        return self.arrivals[start:stop]
+
+    def get_distribution(self, name : str):
+        return self.index["distributions"][name]
+
+def compile_store(data_dir : str):
+    '''
+    parse all *.dat files of data_dir and save the store under data_dir/STORE_DIR,
+    if the folder is not writable the store is only kept in memory
+    return Arrival_Store
+    '''
+    days = {}
+    distributions = {}
+    sources = {}
+    offsets = []
+    position = 0
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.dat"))):
+        name = os.path.basename(path)
+        sources[name] = get_source_state(path)
+        if name in DISTRIBUTION_FILES:
+            distributions[name] = parse_distribution_file(path)
+            continue
+        seq = parse_day_file(path)
+        days[name] = [position, position + len(seq)]
+        offsets.extend(seq)
+        position += len(seq)
+    arrivals = np.array(offsets, dtype=np.int32)
+    index = {"version": STORE_VERSION, "days": days, "distributions": distributions, "sources": sources}
+
+    store_dir = os.path.join(data_dir, STORE_DIR)
+    try:
+        os.makedirs(store_dir, exist_ok=True)
+        temp_suffix = ".%d.tmp" % os.getpid()
+        with open(os.path.join(store_dir, "arrivals.npy" + temp_suffix), "wb") as f:
+            np.save(f, arrivals)
+        with open(os.path.join(store_dir, "index.json" + temp_suffix), "w") as f:
+            json.dump(index, f)
+        os.replace(os.path.join(store_dir, "arrivals.npy" + temp_suffix), os.path.join(store_dir, "arrivals.npy"))
+        os.replace(os.path.join(store_dir, "index.json" + temp_suffix), os.path.join(store_dir, "index.json"))
+        logger.info('arrival store compiled: %d day files, %d arrivals', len(days), len(arrivals))
+    except OSError as e:
+        logger.info('arrival store can not be saved in %s (%s), kept in memory', store_dir, e)
+    return Arrival_Store(data_dir, arrivals, index)
+
+def load_store(data_dir : str):
+    '''
+    load the compiled store of data_dir (memory mapped), None if not available or of another version
+    '''
+    store_dir = os.path.join(data_dir, STORE_DIR)
+    try:
+        with open(os.path.join(store_dir, "index.json")) as f:
+            index = json.load(f)
+        arrivals = np.load(os.path.join(store_dir, "arrivals.npy"), mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != STORE_VERSION:
+        return None
+    return Arrival_Store(data_dir, arrivals, index)
+
+def get_store(name : str, data_dir = None):
+    '''
+    return the store that contains the unchanged source file name, from the process cache, from disk
+    or compiled again
+    data_dir: data folder, None -> "data" in the working directory (same as the file access of users.py)
+    '''
+    if data_dir is None:
+        data_dir = os.path.join(os.getcwd(), "data")
+    data_dir = os.path.abspath(data_dir)
+    store = stores.get(data_dir)
+    if store is None or not store.is_valid(name):
+        store = load_store(data_dir)
+        if store is None or not store.is_valid(name):
+            store = compile_store(data_dir)
+        stores[data_dir] = store
+    return store
+
+def get_day_arrivals(name : str, data_dir = None):
+    '''
+    return the arrival times of the day file name (e.g. "urban_day10_118.dat") as int list [sec after 00:00:00]
+    '''
+    store = get_store(name, data_dir)
+    if name not in store.index["days"]:
+        logger.error('day file %s not found', name)
+        return None
+    return store.get_day(name).tolist()
+
+def get_distribution(name : str, data_dir = None):
+    '''
+    return the 48 probabilities of the distribution file name (e.g. "user_random_dist.dat")
+    '''
+    store = get_store(name, data_dir)
+    if name not in store.index["distributions"]:
+        logger.error('distribution file %s not found', name)
+        return None
+    return store.get_distribution(name)
@@ -0,0 +1,304 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# benchmark of the simulation core
+# runs fixed seed scenarios (station types x user area x user preference, stations with
+# PSC also x power distribution option), measures
+# ticks/sec, time per phase, peak RSS and python allocations, appends the results
+# to a json history file and flags regressions against a stored baseline
+# usage:
+#   python benchmark.py                         run all scenarios, compare with the baseline
+#   python benchmark.py --save-baseline         run all scenarios and store them as new baseline
+#   python benchmark.py --filter GEN3 --repeat 3
+#   python benchmark.py --filter Optimal
+###################################################################################
+import os
+import sys
+import copy
+import json
+import time
+import hashlib
+import argparse
+import platform
+import datetime
+import subprocess
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import resource                                             # not available on windows
+except ImportError:
+    resource = None
+import numpy as np
+import main
+import swap
+import users
+import global_param
+
+GC = global_param.Global_Constant()
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATION_TYPES = ["GEN2_530kW", "GEN3_600kW", "GEN3_1200kW", "FY_TypeA", "FY_TypeB", "FY_TypeC", "FY_TypeD"]
+AREAS = ["urban", "highway"]
+PREFERENCES = ["markov", "fixed_value"]
+POWER_DIST_OPTIONS = ["PSS preferred", "PSC preferred", "Optimal"]     # without PSC all options give the same distribution
+# timed functions: phase name -> (owner, attribute), the phase times are inclusive (do_charge contains the power distribution)
+PHASES = {
+    "user_queue": (users, "create_user_queue_statistical"),
+    "add_users": (main, "add_users"),
+    "do_swap": (swap.SwapStation, "do_swap"),
+    "do_charge": (swap.SwapStation, "do_charge"),
+    "power_dist_pss": (swap.Swap_Rack, "power_distribution_pss_preferred"),
+    "power_dist_psc": (swap.Swap_Rack, "power_distribution_psc_preferred"),
+    "power_dist_optimal": (swap.Swap_Rack, "power_distribution_optimal"),
+}
+
+def create_param(station_name : str, area : str, preference : str, seed = 1, sim_engine = "tick", power_dist_option = "PSS preferred"):
+    '''
+    param dict of one benchmark scenario (see main.do_simulation)
+    stations without PSC only support the preference "full_swap" (same as the web app)
+    '''
+    station_type = copy.deepcopy(getattr(GC, station_name))
+    if station_name.startswith("FY"):
+        battery_config = {"FY62kWh": station_type["max_battery_number"], "FY41kWh": 0}
+    else:
+        battery_config = {"100kWh": station_type["max_battery_number"], "75kWh": 0}
+    psc_num = station_type["max_charge_terminal"]
+    param = {
+        "station_type": station_type,
+        "psc_num": psc_num,
+        "battery_config": battery_config,
+        "init_battery_soc_in_PSS": 0.95,
+        "target_soc": 0.9,
+        "select_soc": 0.95,
+        "nio_user_num": 0,
+        "non_nio_user_num": 40 if psc_num > 0 else 0,
+        "sim_days": 1,
+        "sim_interval": 10,
+        "sim_ticks": 8640,
+        "swap_rack_temperature": 25,
+        "user_sequence_mode": "statistical",
+        "user_area": area,
+        "user_preference": preference if psc_num > 0 else "full_swap",
+        "charge_power_redist": False,
+        "enable_me_switch": 1,
+        "power_dist_option": power_dist_option,
+        "service_ratio": 70,
+        "grid_interaction_idx": -1,
+        "interaction_num": 0,
+        "swap_time": 6.5 if station_name == "GEN2_530kW" else (3.0 if station_name.startswith("FY") else 4.5),
+        "seed": seed,
+        "sim_engine": sim_engine,
+    }
+    return param
+
+def get_scenarios(name_filter = None, sim_engine = "tick"):
+    '''
+    return dict scenario name -> param, name = "<station type>/<area>/<preference>" for "PSS preferred",
+    "<station type>/<area>/<preference>/<power dist option>" for the other options of the stations with PSC
+    '''
+    scenarios = {}
+    for station_name in STATION_TYPES:
+        options = POWER_DIST_OPTIONS if getattr(GC, station_name)["max_charge_terminal"] > 0 else POWER_DIST_OPTIONS[:1]
+        for area in AREAS:
+            for preference in PREFERENCES:
+                for option in options:
+                    param = create_param(station_name, area, preference, sim_engine=sim_engine, power_dist_option=option)
+                    name = "%s/%s/%s" % (station_name, area, param["user_preference"])
+                    if option != "PSS preferred":
+                        name += "/" + option
+                    if name in scenarios:
+                        continue
+                    if name_filter is not None and name_filter not in name:
+                        continue
+                    scenarios[name] = param
+    return scenarios
+
+class Phase_Timer():
+    '''
+    wrap the functions of PHASES with a timer while active (context manager)
+    '''
+    def __init__(self):
+        self.phase_time = {name: 0.0 for name in PHASES}
+        self.phase_calls = {name: 0 for name in PHASES}
+        self.original = {}
+
+    def wrap(self, name, function):
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.phase_time[name] += time.perf_counter() - start
+                self.phase_calls[name] += 1
+        return timed_function
+
+    def __enter__(self):
+        for name, (owner, attribute) in PHASES.items():
+            function = owner.__dict__[attribute] if isinstance(owner, type) else getattr(owner, attribute)
+            self.original[name] = function
+            setattr(owner, attribute, self.wrap(name, function))
+        return self
+
+    def __exit__(self, *args):
+        for name, (owner, attribute) in PHASES.items():
+            setattr(owner, attribute, self.original[name])
+
+def get_peak_rss():
+    '''
+    peak resident set size of this process [MB], None if not available
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":                                # bytes on mac os, kB on linux
+        return peak / 1024 / 1024
+    return peak / 1024
+
+def get_result_digest(result : tuple, sim_interval : int):
+    '''
+    sha256 of the KPIs, a performance change must not change it
+    '''
+    kpis = main.get_kpis(result, sim_interval)
+    text = json.dumps(kpis, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def run_scenario(param : dict, repeat = 1, trace_alloc = True):
+    '''
+    benchmark one scenario, executed in a fresh worker process (clean peak RSS)
+    the fastest of the repeats is reported, the allocations are measured in an extra run with tracemalloc
+    '''
+    os.chdir(BASE_DIR)                                          # the data files are read relative to the working directory
+    best = None
+    for i in range(repeat):
+        with Phase_Timer() as timer:
+            start = time.perf_counter()
+            result = main.do_simulation(copy.deepcopy(param))
+            wall_time = time.perf_counter() - start
+        if best is None or wall_time < best["wall_time"]:
+            best = {
+                "wall_time": wall_time,
+                "ticks_per_sec": param["sim_ticks"] / wall_time,
+                "phase_time": {name: round(value, 6) for name, value in timer.phase_time.items()},
+                "phase_calls": timer.phase_calls,
+            }
+    best["peak_rss_mb"] = get_peak_rss()
+    best["result_digest"] = get_result_digest(result, param["sim_interval"])
+    best["swap_num"] = len(result[8])
+
+    if trace_alloc:
+        tracemalloc.start()
+        main.do_simulation(copy.deepcopy(param))
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        best["alloc_peak_mb"] = peak / 1024 / 1024
+    return best
+
+def get_git_commit():
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if output.returncode != 0:
+        return None
+    return output.stdout.strip()
+
+def run_benchmark(scenarios : dict, repeat = 1, trace_alloc = True, callback = None):
+    '''
+    benchmark all scenarios, every scenario runs in its own spawned worker process
+    return the history record {"date", "commit", "python", "numpy", "platform", "scenarios": name -> result}
+    '''
+    record = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "scenarios": {},
+    }
+    context = multiprocessing.get_context("spawn")
+    for name, param in scenarios.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            record["scenarios"][name] = executor.submit(run_scenario, param, repeat, trace_alloc).result()
+        if callback is not None:
+            callback(name, record["scenarios"][name])
+    return record
+
+def compare(record : dict, baseline : dict, tolerance = 0.1):
+    '''
+    compare a history record with the baseline record
+    return list of regression messages: ticks/sec below (1 - tolerance) * baseline, peak RSS or allocation
+    above (1 + tolerance) * baseline, or changed simulation results
+    '''
+    regressions = []
+    for name, result in record["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        base = baseline["scenarios"][name]
+        if result["ticks_per_sec"] < base["ticks_per_sec"] * (1 - tolerance):
+            regressions.append("%s: ticks/sec %.0f < baseline %.0f" % (name, result["ticks_per_sec"], base["ticks_per_sec"]))
+        for key in ["peak_rss_mb", "alloc_peak_mb"]:
+            if result.get(key) is not None and base.get(key) is not None and result[key] > base[key] * (1 + tolerance):
+                regressions.append("%s: %s %.1f > baseline %.1f" % (name, key, result[key], base[key]))
+        if result["result_digest"] != base["result_digest"]:
+            regressions.append("%s: simulation result changed (digest %s != baseline %s)" % (name, result["result_digest"], base["result_digest"]))
+    return regressions
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_json(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(temp_path, path)
+
+def print_result(name : str, result : dict):
+    phases = ", ".join("%s %.2fs" % (phase, value) for phase, value in result["phase_time"].items() if value > 0)
+    print("%-48s %7.2fs %8.0f ticks/s  rss %s MB  alloc %s MB  [%s]" % (name, result["wall_time"], result["ticks_per_sec"],
+          "%.0f" % result["peak_rss_mb"] if result["peak_rss_mb"] is not None else "-",
+          "%.1f" % result["alloc_peak_mb"] if "alloc_peak_mb" in result else "-", phases))
+
+def main_benchmark(argv = None):
+    parser = argparse.ArgumentParser(description="benchmark of the PSS simulation core")
+    parser.add_argument("--filter", default=None, help="only run scenarios whose name contains this string")
+    parser.add_argument("--engine", default="tick", choices=["tick", "event"], help="simulation engine")
+    parser.add_argument("--repeat", type=int, default=1, help="repeats per scenario, the fastest is reported")
+    parser.add_argument("--no-alloc", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--history", default=os.path.join(BASE_DIR, "benchmark_history.json"), help="json history file")
+    parser.add_argument("--baseline", default=os.path.join(BASE_DIR, "benchmark_baseline.json"), help="json baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative tolerance of the regression check")
+    args = parser.parse_args(argv)
+
+    scenarios = get_scenarios(args.filter, args.engine)
+    if len(scenarios) == 0:
+        print("no scenario matches the filter %s" % args.filter)
+        return 2
+    record = run_benchmark(scenarios, repeat=args.repeat, trace_alloc=not args.no_alloc, callback=print_result)
+    record["engine"] = args.engine
+
+    history = load_json(args.history, [])
+    history.append(record)
+    save_json(args.history, history)
+
+    if args.save_baseline:
+        save_json(args.baseline, record)
+        print("baseline saved to %s" % args.baseline)
+        return 0
+    baseline = load_json(args.baseline, None)
+    if baseline is None:
+        print("no baseline available, create one with --save-baseline")
+        return 0
+    regressions = compare(record, baseline, args.tolerance)
+    for message in regressions:
+        print("REGRESSION " + message)
+    if len(regressions) > 0:
+        return 1
+    print("no regression against baseline %s (%s)" % (baseline["date"], baseline["commit"]))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -0,0 +1,186 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# capacity search: cheapest station configuration that meets a service level
+# a configuration is (station type, psc_num, battery number, power level), the
+# power level limits the module output (transformer power, grid_power_cap). Every
+# evaluated configuration is simulated with replicas (common seeds, see sweep) and
+# is feasible if the replica mean of all target KPIs is met.
+# The search uses that more batteries and more power never hurt the service level:
+# per station type and psc_num the power levels are checked in ascending order and
+# the minimal battery number of a level is found by bisection, it can only shrink
+# with more power. Configurations dominated by a known result are not simulated
+# again, station types whose cheapest configuration is not cheaper than the best
+# result are skipped.
+###################################################################################
+import logging
+import cli
+import sweep
+
+logger = logging.getLogger('main.capacity')
+
+DEFAULT_STATIONS = ["GEN2_530kW", "GEN3_600kW", "GEN3_1200kW"]
+POWER_LEVELS = [100, 200, 300, 550, 630, 1250]                  # transformer power levels [kVA] of the PSS Power Assistant
+DEFAULT_COST = {"rack": 0.2, "battery": 1.0, "power": 0.004, "psc": 0.3}   # relative cost (1.0 = one battery), per rack / battery / kW / psc
+
+def get_cost(station_type : dict, battery_num : int, power : int, psc_num : int, cost = None):
+    '''
+    relative investment of a configuration: racks of the station type + batteries + power [kW] + charge piles
+    '''
+    if cost is None:
+        cost = DEFAULT_COST
+    return cost["rack"] * station_type["max_battery_number"] + cost["battery"] * battery_num + cost["power"] * power + cost["psc"] * psc_num
+
+def check_targets(summary : dict, targets : list):
+    '''
+    targets: list of (KPI name, ">=" or "<=", value), e.g. [("swap_ratio_in_15_min", ">=", 0.9)]
+    return True if the replica mean of every target KPI is met
+    '''
+    for name, operator, value in targets:
+        mean = summary[name]["mean"]
+        if operator == ">=" and mean < value:
+            return False
+        if operator == "<=" and mean > value:
+            return False
+    return True
+
+class Capacity_Search():
+    '''
+    search of the cheapest station configuration
+    demand:         param overrides of the demand (see cli.create_param), e.g. {"nio_user_num": 120, "user_preference": "full_swap"}
+    targets:        service level, see check_targets
+    station_names:  station types in Global_Constant to consider, None -> DEFAULT_STATIONS
+    psc_options:    psc_num values to consider (limited to the charge terminals of the station type), None -> [0]
+    power_levels:   power levels [kW], levels above the max_power of a station type are replaced by its max_power
+    cost:           unit costs, see get_cost
+    replicas:       simulations per configuration, seed: base seed of the replicas (same for all configurations)
+    max_workers, cache: see sweep.run_sweep
+    '''
+    def __init__(self, demand : dict, targets : list, station_names = None, psc_options = None, power_levels = None, cost = None,
+                 replicas = 3, seed = 1, max_workers = None, cache = None):
+        self.demand = demand
+        self.targets = targets
+        self.station_names = station_names if station_names is not None else DEFAULT_STATIONS
+        self.psc_options = psc_options if psc_options is not None else [0]
+        self.power_levels = power_levels if power_levels is not None else POWER_LEVELS
+        self.cost = cost if cost is not None else DEFAULT_COST
+        self.replicas = replicas
+        self.seed = seed
+        self.max_workers = max_workers
+        self.cache = cache
+        self.evaluated = {}                                     # (station name, psc_num, battery num, power) -> (feasible, summary)
+        self.simulations = 0
+
+    def get_levels(self, station_type : dict):
+        return sorted(set([level for level in self.power_levels if level < station_type["max_power"]] + [station_type["max_power"]]))
+
+    def get_param(self, station_name : str, psc_num : int, battery_num : int, power : int):
+        '''
+        simulation param of a configuration, the power level below max_power is set as grid_power_cap
+        '''
+        param = cli.create_param(station_name, **self.demand)
+        param["psc_num"] = psc_num
+        if station_name.startswith("FY"):
+            param["battery_config"] = {"FY62kWh": battery_num, "FY41kWh": 0}
+        else:
+            param["battery_config"] = {"100kWh": battery_num, "75kWh": 0}
+        if power < param["station_type"]["max_power"]:
+            param["grid_power_cap"] = [[0, 24, power]]
+        return param
+
+    def infer(self, station_name : str, psc_num : int, battery_num : int, power : int):
+        '''
+        result implied by an evaluated configuration of the same station type and psc_num:
+        feasible if a configuration with less batteries and power is feasible,
+        infeasible if a configuration with more batteries and power is infeasible, None if unknown
+        '''
+        for (name, psc, battery, level), (feasible, summary) in self.evaluated.items():
+            if name != station_name or psc != psc_num:
+                continue
+            if feasible and battery <= battery_num and level <= power:
+                return True
+            if not feasible and battery >= battery_num and level >= power:
+                return False
+        return None
+
+    def is_feasible(self, station_name : str, psc_num : int, battery_num : int, power : int):
+        key = (station_name, psc_num, battery_num, power)
+        if key in self.evaluated:
+            return self.evaluated[key][0]
+        feasible = self.infer(*key)
+        if feasible is not None:
+            return feasible
+        record = sweep.run_sweep(self.get_param(*key), [{}], replicas=self.replicas, seed=self.seed, max_workers=self.max_workers,
+                                 cache=self.cache)[0]
+        self.simulations += self.replicas
+        if len(record["errors"]) > 0:
+            logger.error('capacity search: %s failed (%s)', key, record["errors"][0])
+            feasible = False
+        else:
+            feasible = check_targets(record["summary"], self.targets)
+        self.evaluated[key] = (feasible, record["summary"])
+        logger.info('capacity search: %s feasible = %s', key, feasible)
+        return feasible
+
+    def min_batteries(self, station_name : str, psc_num : int, power : int, high : int):
+        '''
+        bisection of the minimal feasible battery number in [1, high], high has to be feasible
+        '''
+        low = 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.is_feasible(station_name, psc_num, middle, power):
+                high = middle
+            else:
+                low = middle + 1
+        return high
+
+    def search(self, callback = None):
+        '''
+        callback: function(number of simulations, best result) called after every station type and psc_num
+        return dict {"station_name", "psc_num", "battery_num", "power", "cost", "summary"} of the cheapest feasible
+        configuration (None if no configuration meets the targets), extended by "simulations" and "evaluations"
+        '''
+        candidates = []
+        for station_name in self.station_names:
+            station_type = getattr(cli.GC, station_name)
+            for psc_num in self.psc_options:
+                if psc_num <= station_type["max_charge_terminal"]:
+                    levels = self.get_levels(station_type)
+                    candidates.append((get_cost(station_type, 1, levels[0], psc_num, self.cost), station_name, psc_num, levels))
+        candidates.sort(key=lambda candidate: candidate[0])
+
+        best = None
+        for lower_bound, station_name, psc_num, levels in candidates:
+            if best is not None and lower_bound >= best["cost"]:
+                continue
+            station_type = getattr(cli.GC, station_name)
+            high = station_type["max_battery_number"]
+            if not self.is_feasible(station_name, psc_num, high, levels[-1]):
+                continue
+            for power in levels:
+                if best is not None and get_cost(station_type, 1, power, psc_num, self.cost) >= best["cost"]:
+                    break
+                if not self.is_feasible(station_name, psc_num, high, power):
+                    continue
+                high = self.min_batteries(station_name, psc_num, power, high)
+                cost = get_cost(station_type, high, power, psc_num, self.cost)
+                if best is None or cost < best["cost"]:
+                    best = {"station_name": station_name, "psc_num": psc_num, "battery_num": high, "power": power, "cost": cost,
+                            "summary": self.evaluated[(station_name, psc_num, high, power)][1]}
+                if high == 1:
+                    break
+            if callback is not None:
+                callback(self.simulations, best)
+
+        logger.info('capacity search finished after %d simulations', self.simulations)
+        if best is not None:
+            best["simulations"] = self.simulations
+            best["evaluations"] = len(self.evaluated)
+        return best
+
+def search_capacity(demand : dict, targets : list, **kwargs):
+    '''
+    return the cheapest station configuration that meets the targets, see Capacity_Search
+    '''
+    return Capacity_Search(demand, targets, **kwargs).search()
@@ -0,0 +1,309 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# headless batch runner of do_simulation (no streamlit)
+# the scenario file (json or yaml) holds a base param dict, a list of scenarios and/or
+# a sweep grid, every scenario is simulated in a worker process. The KPIs of all
+# scenarios are written into one table, the time series (power, queue length per tick,
+# KPIs per day for multi day runs) into one table per scenario, as csv or parquet.
+# Progress is reported as json lines on stderr, the exit code is
+#   0 all scenarios finished, 1 at least one scenario failed, 2 invalid arguments or scenario file
+# usage:
+#   python cli.py scenarios.yaml --out results --workers 4 --seed 1
+# scenario file:
+#   {"base": {"station_type": "GEN3_600kW", "nio_user_num": 120},          overrides of the default param
+#    "scenarios": [{"name": "peak", "nio_user_num": 200}, ...],            one param dict per scenario
+#    "sweep": {"psc_num": [0, 4], "select_soc": [0.9, 0.95]},              cartesian grid over the scenarios
+#    "lhs": {"samples": 50, "seed": 1, "ranges": {"nio_user_num": [50, 300]}}}   latin hypercube over the scenarios
+#   a file with a plain list is read as the scenario list
+###################################################################################
+import os
+import sys
+import copy
+import json
+import time
+import random
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+try:
+    import yaml                                                 # optional, only needed for yaml scenario files
+except ImportError:
+    yaml = None
+import pandas as pd
+import main
+import horizon
+import sweep
+import global_param
+
+GC = global_param.Global_Constant()
+logger = logging.getLogger('main.cli')
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+class Scenario_Error(Exception):
+    '''
+    invalid scenario file or scenario param
+    '''
+    pass
+
+def create_param(station_name = "GEN3_600kW", **overrides):
+    '''
+    default param dict of the station type (same defaults as the web app), updated with overrides
+    station_name: name of the station type in Global_Constant, e.g. "GEN3_600kW", "FY_TypeA"
+    '''
+    if not hasattr(GC, station_name) or not isinstance(getattr(GC, station_name), dict):
+        raise Scenario_Error("unknown station type %s" % station_name)
+    station_type = copy.deepcopy(getattr(GC, station_name))
+    if station_name.startswith("FY"):
+        battery_config = {"FY62kWh": station_type["max_battery_number"], "FY41kWh": 0}
+    else:
+        battery_config = {"100kWh": station_type["max_battery_number"], "75kWh": 0}
+    psc_num = station_type["max_charge_terminal"]
+    sim_interval = overrides.get("sim_interval", 10)
+    param = {
+        "station_type": station_type,
+        "psc_num": psc_num,
+        "battery_config": battery_config,
+        "init_battery_soc_in_PSS": 0.95,
+        "target_soc": 0.9,
+        "select_soc": 0.95,
+        "nio_user_num": 100,
+        "non_nio_user_num": 0,
+        "sim_days": 1,
+        "sim_interval": sim_interval,
+        "sim_ticks": int(24 * 60 * 60 / sim_interval),
+        "swap_rack_temperature": 25,
+        "user_sequence_mode": "random",
+        "user_area": "urban",
+        "user_preference": "fixed_value" if psc_num > 0 else "full_swap",
+        "charge_power_redist": False,
+        "enable_me_switch": 1,
+        "power_dist_option": "PSS preferred",
+        "service_ratio": 70,
+        "grid_interaction_idx": -1,
+        "interaction_num": 0,
+        "swap_time": 6.5 if station_name == "GEN2_530kW" else (3.0 if station_name.startswith("FY") else 4.5),
+        "sim_engine": "tick",
+    }
+    param.update(overrides)
+    return param
+
+def load_scenario_file(path : str):
+    '''
+    read the json or yaml scenario file (by file extension), return its content
+    '''
+    with open(path, "r") as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise Scenario_Error("PyYAML is not installed, use a json scenario file")
+            try:
+                return yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise Scenario_Error("invalid yaml file: %s" % e)
+        return json.load(f)
+
+def expand_design(content : dict):
+    '''
+    points of the "sweep" grid and/or the "lhs" design of the scenario file (see sweep.grid_design, sweep.lhs_design),
+    return list of dicts, [{}] without design
+    '''
+    points = []
+    try:
+        if content.get("sweep"):
+            points.extend(sweep.grid_design(content["sweep"]))
+        if content.get("lhs"):
+            lhs = content["lhs"]
+            points.extend(sweep.lhs_design(lhs["ranges"], lhs["samples"], seed=lhs.get("seed")))
+    except (KeyError, TypeError, ValueError) as e:
+        raise Scenario_Error("invalid design: %s" % e)
+    return points if len(points) > 0 else [{}]
+
+def get_point_name(point : dict):
+    return ",".join("%s=%s" % (name, value) for name, value in point.items())
+
+def build_scenarios(content):
+    '''
+    expand the scenario file content into a list of (name, overrides, param)
+    '''
+    if isinstance(content, list):
+        content = {"scenarios": content}
+    if not isinstance(content, dict):
+        raise Scenario_Error("scenario file must contain a dict or a list")
+    base = content.get("base", {})
+    scenarios = content.get("scenarios") or [{}]
+    grid = expand_design(content)
+    result = []
+    for index, scenario in enumerate(scenarios):
+        if not isinstance(scenario, dict):
+            raise Scenario_Error("scenario %d is not a dict" % index)
+        for point in grid:
+            overrides = dict(base)
+            overrides.update(scenario)
+            overrides.update(point)
+            name = overrides.pop("name", None) or "scenario_%03d" % index
+            if len(point) > 0:
+                name = "%s[%s]" % (name, get_point_name(point))
+            station_name = overrides.pop("station_type", "GEN3_600kW")
+            if isinstance(station_name, dict):                  # complete station type dict (e.g. User_Defined)
+                param = create_param("GEN3_600kW", station_type=station_name, **overrides)
+            else:
+                param = create_param(station_name, **overrides)
+            overrides["station_type"] = station_name if not isinstance(station_name, dict) else station_name.get("station_type")
+            result.append((name, overrides, param))
+    names = [name for name, overrides, param in result]
+    if len(set(names)) != len(names):
+        raise Scenario_Error("scenario names are not unique")
+    return result
+
+def get_series(result : tuple):
+    '''
+    time series of one do_simulation result as DataFrame: power, curtailed power and queue lengths per tick
+    '''
+    power_history = result[6]
+    return pd.DataFrame({
+        "tick": [pw[0] for pw in power_history],
+        "power": [pw[1] for pw in power_history],
+        "curtailed_power": [pw[2] for pw in power_history],
+        "queue_length_swap": result[2][:len(power_history)],
+        "queue_length_charge": result[3][:len(power_history)],
+    })
+
+def init_worker():
+    '''
+    working directory of a worker process, the data files are read relative to the working directory
+    '''
+    os.chdir(BASE_DIR)
+
+def run_scenario(index : int, param : dict):
+    '''
+    simulate one scenario (in a worker process or in this process, working directory BASE_DIR),
+    errors are returned instead of raised
+    return dict {"index", "kpis", "series" (DataFrame), "wall_time", "error"}
+    '''
+    start = time.perf_counter()
+    try:
+        if param.get("sim_days", 1) > 1:
+            day_kpis, kpis = horizon.do_horizon_simulation(param)
+            series = pd.DataFrame(day_kpis)
+        else:
+            result = main.do_simulation(param)
+            kpis = main.get_kpis(result, param["sim_interval"])
+            series = get_series(result)
+    except Exception as e:
+        return {"index": index, "kpis": None, "series": None, "wall_time": time.perf_counter() - start, "error": "%s: %s" % (type(e).__name__, e)}
+    return {"index": index, "kpis": kpis, "series": series, "wall_time": time.perf_counter() - start, "error": None}
+
+def report(stream, **record):
+    '''
+    write one machine readable progress record (json line)
+    '''
+    stream.write(json.dumps(record, default=str) + "\n")
+    stream.flush()
+
+def write_table(data : pd.DataFrame, path : str, output_format : str):
+    if output_format == "parquet":
+        data.to_parquet(path + ".parquet", index=False)
+    else:
+        data.to_csv(path + ".csv", index=False)
+
+def check_output_format(output_format : str):
+    '''
+    parquet needs pyarrow or fastparquet, checked before the simulations start
+    '''
+    if output_format != "parquet":
+        return True
+    for module in ["pyarrow", "fastparquet"]:
+        try:
+            __import__(module)
+            return True
+        except ImportError:
+            pass
+    return False
+
+def run_batch(scenarios : list, out_dir : str, seed = None, max_workers = None, output_format = "csv", series = True, stream = None):
+    '''
+    simulate all scenarios [(name, overrides, param)] and write the result tables into out_dir
+    scenarios without own seed are simulated with seed [seed, index] (see main.do_multi_simulation)
+    stream: progress records (json lines), None -> sys.stderr
+    return number of failed scenarios
+    '''
+    if stream is None:
+        stream = sys.stderr
+    if seed is None:
+        seed = random.randrange(2**32)
+    out_dir = os.path.abspath(out_dir)                          # relative to the working directory of the caller
+    os.makedirs(out_dir, exist_ok=True)
+    if series:
+        os.makedirs(os.path.join(out_dir, "series"), exist_ok=True)
+    param_list = [param if param.get("seed") is not None else dict(param, seed=[seed, index]) for index, (name, overrides, param) in enumerate(scenarios)]
+    report(stream, event="start", total=len(scenarios), seed=seed, out_dir=out_dir)
+
+    rows = [None] * len(scenarios)
+    failed = 0
+    done = 0
+    def collect(outcome):
+        nonlocal failed, done
+        index = outcome["index"]
+        name, overrides, param = scenarios[index]
+        done += 1
+        row = {"name": name, "status": "ok" if outcome["error"] is None else "error", "seed": json.dumps(param_list[index]["seed"]),
+               "wall_time": outcome["wall_time"]}
+        row.update({key: value for key, value in overrides.items() if not isinstance(value, (dict, list))})
+        if outcome["error"] is None:
+            row.update(outcome["kpis"])
+            if series:
+                write_table(outcome["series"], os.path.join(out_dir, "series", name.replace("/", "_")), output_format)
+        else:
+            failed += 1
+            row["error"] = outcome["error"]
+        rows[index] = row
+        report(stream, event="progress", done=done, total=len(scenarios), name=name, status=row["status"],
+               wall_time=round(outcome["wall_time"], 3), error=outcome["error"])
+
+    if max_workers == 1 or len(scenarios) <= 1:
+        cwd = os.getcwd()
+        os.chdir(BASE_DIR)
+        try:
+            for index in range(len(scenarios)):
+                collect(run_scenario(index, param_list[index]))
+        finally:
+            os.chdir(cwd)                                       # the caller keeps its working directory
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker) as executor:
+            futures = [executor.submit(run_scenario, index, param_list[index]) for index in sweep.order_by_cost(param_list)]
+            for future in as_completed(futures):
+                collect(future.result())
+
+    write_table(pd.DataFrame(rows), os.path.join(out_dir, "kpis"), output_format)
+    report(stream, event="finish", total=len(scenarios), failed=failed)
+    return failed
+
+def main_cli(argv = None):
+    parser = argparse.ArgumentParser(description="headless batch runner of the PSS simulation")
+    parser.add_argument("scenario_file", help="json or yaml scenario file")
+    parser.add_argument("--out", default="results", help="output folder of the result tables")
+    parser.add_argument("--seed", type=int, default=None, help="base seed of the scenarios without own seed, missing -> random")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes, 1 -> run in this process")
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet"], help="format of the result tables")
+    parser.add_argument("--no-series", action="store_true", help="only write the KPI table")
+    args = parser.parse_args(argv)
+
+    try:
+        scenarios = build_scenarios(load_scenario_file(args.scenario_file))
+    except (OSError, ValueError, Scenario_Error) as e:
+        report(sys.stderr, event="error", error="%s: %s" % (type(e).__name__, e))
+        return EXIT_USAGE
+    if not check_output_format(args.format):
+        report(sys.stderr, event="error", error="parquet output needs pyarrow or fastparquet")
+        return EXIT_USAGE
+    failed = run_batch(scenarios, args.out, seed=args.seed, max_workers=args.workers, output_format=args.format, series=not args.no_series)
+    if failed > 0:
+        return EXIT_FAILED
+    return EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
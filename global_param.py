@@ -1,5 +1,49 @@
 import numpy as np
 
+def compile_charge_limit(charge_limit : dict, limit_axis : list, resolution = 100):
+    '''
+    compile a charge limit table {temperature: current list at limit_axis} into a lookup table per temperature
+    cell:       list with resolution + 1 entries, cell[int(soc * resolution)] = index of the segment [limit_axis[k], limit_axis[k+1])
+                that contains soc (may be one segment off due to float rounding, corrected by the caller)
+    value:      current at the breakpoints (original table row)
+    delta_c:    current difference of segment k = value[k+1] - value[k]
+    delta_soc:  soc difference of segment k = limit_axis[k+1] - limit_axis[k]
+    the interpolation with these values is the same operation sequence as Battery.calc_current_limit
+    '''
+    cell = []
+    k = 0
+    for g in range(resolution + 1):
+        while k + 1 < len(limit_axis) and limit_axis[k + 1] <= g / resolution:
+            k += 1
+        cell.append(k)
+    lut = {}
+    for temperature, value in charge_limit.items():
+        delta_c = [value[k + 1] - value[k] for k in range(len(limit_axis) - 1)]
+        delta_soc = [limit_axis[k + 1] - limit_axis[k] for k in range(len(limit_axis) - 1)]
+        lut[temperature] = (cell, list(value), delta_c, delta_soc)
+    return lut
+
+def add_charge_limit_bucket(charge_limit : dict, charge_limit_lut : dict, temperature : int, limit_axis : list, resolution = 100):
+    '''
+    add the lookup table of a temperature bucket that is not measured in charge_limit to charge_limit_lut (see compile_charge_limit),
+    the current row is interpolated linearly between the neighbouring measured temperatures (constant outside the measured range),
+    every (table, temperature) row is computed once and then read from charge_limit_lut
+    '''
+    measured = sorted(charge_limit)
+    if temperature <= measured[0]:
+        row = list(charge_limit[measured[0]])
+    elif temperature >= measured[-1]:
+        row = list(charge_limit[measured[-1]])
+    else:
+        k = 0
+        while measured[k + 1] <= temperature:
+            k += 1
+        low = charge_limit[measured[k]]
+        high = charge_limit[measured[k + 1]]
+        weight = (temperature - measured[k]) / (measured[k + 1] - measured[k])
+        row = [low[j] + (high[j] - low[j]) * weight for j in range(len(low))]
+    charge_limit_lut.update(compile_charge_limit({temperature: row}, limit_axis, resolution))
+
 class Global_Constant:
     def __init__(self) -> None:
         ####换电站基本参数设置####
@@ -79,6 +123,12 @@ class Global_Constant:
             30:[240,240,240,240,240,240,160,160,160,67,67,67,67],
             45:[240,240,240,240,240,240,160,160,160,67,67,67,67]
             }
+        #### charge limit lookup tables (see compile_charge_limit) ####
+        self.limit_axis = [0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95,] # soc limit values
+        self.limit_resolution = 100
+        self.charge_limit_lut_100 = compile_charge_limit(self.charge_limit_100, self.limit_axis, self.limit_resolution)
+        self.charge_limit_lut_75 = compile_charge_limit(self.charge_limit_75, self.limit_axis, self.limit_resolution)
+        self.charge_limit_lut_70 = compile_charge_limit(self.charge_limit_70, self.limit_axis, self.limit_resolution)
         ### Annual Temperature statistics (Monthly) ###
         # with first row max Temp in the month, second row min Temp in the month
         self.temp = np.array([[5, 8, 10, 15, 20, 23, 24, 27, 20, 10, 4, 3], # max Temp
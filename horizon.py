@@ -0,0 +1,252 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# multi day simulation with streaming aggregation
+# one station is simulated day after day: the arrivals are generated per day (day
+# files cycled or sampled), the station keeps its batteries, queues and connected
+# vehicles over midnight. At the end of every day the serviced users, the waiting
+# times, the queue lengths and the power history are reduced into day KPIs and
+# released, so the memory of a run does not grow with the number of days.
+###################################################################################
+import os
+import logging
+import main
+import users
+import sim_trace
+import temperature
+import snapshot
+import warmup
+from swap import Charge_History
+
+logger = logging.getLogger('main.horizon')
+
+DAY_SECONDS = 24 * 60 * 60
+SUM_KEYS = ["user_num", "swap_num", "nio_charge_num", "non_nio_charge_num", "swap_time", "nio_charge_time", "non_nio_charge_time",
+            "swap_15_min_num", "swap_ratio_num", "swap_wait_time", "swap_wait_num", "energy", "grid_energy", "curtailed_energy"]
+
+def init_day_sums():
+    '''
+    raw sums of one day (or of the whole run), converted into KPIs by get_day_kpis
+    '''
+    sums = {key: 0 for key in SUM_KEYS}
+    sums["peak_power"] = 0
+    sums["queue_overflow"] = 0
+    sums["swap_overflow"] = 0
+    sums["max_queue_length"] = 0
+    return sums
+
+def add_day_sums(total : dict, sums : dict):
+    '''
+    add the sums of one day to the sums of the run, the overflow is the one of the last day
+    '''
+    for key in SUM_KEYS:
+        total[key] += sums[key]
+    total["peak_power"] = max(total["peak_power"], sums["peak_power"])
+    total["max_queue_length"] = max(total["max_queue_length"], sums["max_queue_length"])
+    total["queue_overflow"] = sums["queue_overflow"]
+    total["swap_overflow"] = sums["swap_overflow"]
+
+def get_day_kpis(sums : dict, interval : int):
+    '''
+    convert the raw sums into the KPIs of main.get_kpis (average times in minutes), extended by
+    user_num (arrived users) and max_queue_length (swap + charge)
+    '''
+    def average_minutes(time_sum, num):
+        if num > 0:
+            return (time_sum / num) * interval / 60.0
+        return 0
+    swap_ratio_base = sums["swap_ratio_num"] + sums["swap_overflow"]
+    kpis = {
+        "user_num": sums["user_num"],
+        "swap_num": sums["swap_num"],
+        "nio_charge_num": sums["nio_charge_num"],
+        "non_nio_charge_num": sums["non_nio_charge_num"],
+        "average_time_swap": average_minutes(sums["swap_time"], sums["swap_num"]),
+        "nio_average_time_charge": average_minutes(sums["nio_charge_time"], sums["nio_charge_num"]),
+        "non_nio_average_time_charge": average_minutes(sums["non_nio_charge_time"], sums["non_nio_charge_num"]),
+        "swap_ratio_in_15_min": sums["swap_15_min_num"] / swap_ratio_base if sums["swap_ratio_num"] > 0 else 0,
+        "average_swap_wait_time": sums["swap_wait_time"] / sums["swap_wait_num"] if sums["swap_wait_num"] > 0 else 0,
+        "queue_overflow": sums["queue_overflow"],
+        "max_queue_length": sums["max_queue_length"],
+        "energy": sums["energy"],
+        "grid_energy": sums["grid_energy"],
+        "peak_power": sums["peak_power"],
+        "curtailed_energy": sums["curtailed_energy"],
+    }
+    return kpis
+
+def get_connected_batteries(station):
+    '''
+    return the ids of the vehicle batteries connected to a charge pile
+    '''
+    connected = set()
+    for swap_rack in station.swap_rack_list:
+        if swap_rack.charge_pile_list is None:
+            continue
+        for pile in swap_rack.charge_pile_list:
+            if pile.vehicle_battery is not None:
+                connected.add(id(pile.vehicle_battery))
+    return connected
+
+def get_charge_service_time(user):
+    '''
+    charge + wait time of a charge user [ticks], a vehicle that arrives at its target soc is never charged
+    (charge_start_time = -1) and only counts its wait time, User.charge_service_time would return the
+    absolute arrival tick, which grows with every simulated day
+    '''
+    if user.battery.charge_start_time == -1:
+        return user.charge_connect_time - user.sequence
+    return abs(user.charge_service_time())
+
+def collect_day(station, sim_state : dict, interval : int, last_day = False):
+    '''
+    reduce the records of the finished day into raw sums and release them
+    charge users are booked on the day their vehicle leaves the charge pile (all remaining on the last day),
+    the rack batteries keep their state but drop their charge history
+    '''
+    sums = init_day_sums()
+
+    # swap users, the ratio within 15 minutes counts the first user per arrival tick (same as main.do_simulation)
+    arrival_ticks = set()
+    for user in sim_state["swap_list"]:
+        sums["swap_num"] += 1
+        sums["swap_time"] += user.swap_service_time
+        if user.sequence not in arrival_ticks:
+            arrival_ticks.add(user.sequence)
+            sums["swap_ratio_num"] += 1
+            if user.swap_service_time * interval / 60.0 <= 15:
+                sums["swap_15_min_num"] += 1
+    sim_state["swap_list"].clear()
+
+    # charge users
+    connected = set() if last_day else get_connected_batteries(station)
+    for name, prefix in [("nio_charge_list", "nio_charge"), ("non_nio_charge_list", "non_nio_charge")]:
+        pending = []
+        for user in sim_state[name]:
+            if id(user.battery) in connected:
+                pending.append(user)
+                continue
+            sums[prefix + "_num"] += 1
+            sums[prefix + "_time"] += get_charge_service_time(user)
+        sim_state[name][:] = pending
+
+    # waiting times and queue lengths
+    swap_user_wait_time = [s * interval / 60 for s in sim_state["swap_user_wait_time"]]
+    sums["swap_wait_time"] = sum(swap_user_wait_time)
+    sums["swap_wait_num"] = len(swap_user_wait_time)
+    sim_state["swap_user_wait_time"].clear()
+    sim_state["charge_user_wait_time"].clear()
+    if len(sim_state["queue_length_swap"]) > 0:
+        sums["swap_overflow"] = sim_state["queue_length_swap"][-1]
+        sums["queue_overflow"] = sim_state["queue_length_swap"][-1] + sim_state["queue_length_charge"][-1]
+        sums["max_queue_length"] = max(s + c for s, c in zip(sim_state["queue_length_swap"], sim_state["queue_length_charge"]))
+    sim_state["queue_length_swap"].clear()
+    sim_state["queue_length_charge"].clear()
+
+    # power history
+    for pw in station.power_history:
+        if pw[1] >= 0:
+            sums["energy"] += interval * pw[1] / 3600
+        else:
+            sums["grid_energy"] += interval * abs(pw[1]) / 3600
+        sums["peak_power"] = max(sums["peak_power"], pw[1])
+        sums["curtailed_energy"] += interval * pw[2] / 3600
+    station.power_history.clear()
+    del station.trigger[:-1]                                    # only the trigger of the last tick is read
+
+    for swap_rack in station.swap_rack_list:
+        for battery_rack in swap_rack.battery_rack_list:
+            if battery_rack.battery is not None and len(battery_rack.battery.charge_history) > 0:
+                battery_rack.battery.charge_history = Charge_History()
+    return sums
+
+def load_checkpoint(path : str, param : dict):
+    '''
+    return the restored run of the checkpoint file (see snapshot.Sim_Snapshot.restore), None if there is no
+    readable checkpoint of the same param
+    '''
+    if not os.path.exists(path):
+        return None
+    try:
+        run = snapshot.load_snapshot(path).restore()
+    except (OSError, snapshot.Snapshot_Error) as e:
+        logger.error('checkpoint %s can not be read (%s), simulation starts at day 1', path, e)
+        return None
+    if run["param"] != param:
+        logger.error('checkpoint %s belongs to another param, simulation starts at day 1', path)
+        return None
+    return run
+
+def do_horizon_simulation(param : dict, day_callback = None):
+    '''
+    simulate param["sim_days"] consecutive days of one station (param see main.do_simulation, param["sim_ticks"] is
+    ignored, every day has 24 hours), the first day gives the KPIs of do_simulation of the same param
+    (except the charge time of vehicles that arrive at their target soc, see get_charge_service_time)
+    param["day_file_mode"]: "sample" (default) or "cycle", selection of the day files in statistical mode
+    day_callback: called with (day, day KPIs) after every day, e.g. for a progress bar
+    param["checkpoint_file"]: snapshot of the run after every day (see snapshot), a run of the same param resumes from it
+                   after a crash, the file is removed when the run is complete
+    return (list of the day KPIs, KPIs of the whole run), see get_day_kpis
+    '''
+    sim_days = param["sim_days"]
+    interval = param["sim_interval"]
+    day_ticks = int(DAY_SECONDS / interval)
+    checkpoint_file = param.get("checkpoint_file")
+    run = load_checkpoint(checkpoint_file, param) if checkpoint_file is not None else None
+    if run is not None:
+        station = run["station"]
+        sim_state = run["sim_state"]
+        rng_streams = sim_state["rng_streams"]
+        first_day = run["extra"]["day"]
+        first_file = run["extra"]["first_file"]
+        day_kpis = run["extra"]["day_kpis"]
+        total = run["extra"]["total"]
+        logger.info('resume from checkpoint %s after day %d', checkpoint_file, first_day)
+    else:
+        if param.get("warm_start"):
+            station, sim_state = warmup.get_warm_state(param)
+        else:
+            station = main.create_station(param)
+            sim_state = main.init_sim_state()
+        rng_streams = users.create_rng_streams(param.get("seed"))
+        sim_state["rng_streams"] = rng_streams
+        sim_state["temperature"] = temperature.create_profile(param)
+        first_day = 0
+        first_file = None                                       # "cycle": day files run from a random first file on
+        if param.get("day_file_mode", "sample") == "cycle" and param["user_sequence_mode"] != "random":
+            first_file = users.select_day_file(param["user_area"], main.get_stream(rng_streams, "arrival"))
+        day_kpis = []
+        total = init_day_sums()
+    sim_state["trace"] = sim_trace.create_trace(param)
+    sim_state["state_trace"] = sim_trace.create_state_recorder(param, station)
+
+    logger.info('start_simulatin of %d days', sim_days)
+    for day in range(first_day, sim_days):
+        start_tick = day * day_ticks
+        file_index = first_file + day if first_file is not None else None
+        user_dist_lst, user_label = main.create_user_queue(param, rng_streams, file_index)
+        user_dist_lst = [t + day * DAY_SECONDS for t in user_dist_lst]
+        sim_state["arrival_index"] = users.create_arrival_index(user_dist_lst, user_label, day_ticks, interval, start_tick)
+        if day > 0:
+            station.set_grid_interaction(param["grid_interaction_idx"], interval, start_tick)
+
+        main.do_simulation_loop(param, station, sim_state, user_dist_lst, user_label, day_ticks, interval, start_tick)
+
+        sums = collect_day(station, sim_state, interval, last_day=day == sim_days - 1)
+        sums["user_num"] = len(user_dist_lst)
+        add_day_sums(total, sums)
+        kpis = dict(day=day + 1, **get_day_kpis(sums, interval))
+        day_kpis.append(kpis)
+        if checkpoint_file is not None and day < sim_days - 1:
+            extra = {"day": day + 1, "first_file": first_file, "day_kpis": day_kpis, "total": total}
+            snapshot.take_snapshot(param, station, sim_state, [], [], start_tick + day_ticks, extra).save(checkpoint_file)
+        if day_callback is not None:
+            day_callback(day, kpis)
+
+    if sim_state["trace"] is not None:
+        sim_state["trace"].close()
+    if sim_state["state_trace"] is not None:
+        sim_state["state_trace"].close()
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)                              # the run is complete
+    return day_kpis, get_day_kpis(total, interval)
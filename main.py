@@ -15,8 +15,13 @@
 
 import logging
 import logging.config
+import heapq
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import swap
 import users
+import sim_trace
+import temperature
 import queue
 from swap import Battery, SwapStation
 import global_param
@@ -30,30 +35,14 @@ logger = logging.getLogger('main')
 data_logger=logging.getLogger('data')
 
 
-def log_data(station : swap.SwapStation, t_timer : int):
+def log_data(station : swap.SwapStation, t_timer : int, trace_sink : sim_trace.Trace_Sink):
     '''
-    log the simulation data in form of [time, power]
+    log the simulation data in form of [time, power] into the trace (see sim_trace.create_trace),
+    only called for traced runs
     '''
-    data = ""
-    data = data + 'timer<%d>, ' %t_timer
-    for sr in station.swap_rack_list:
-        for br in sr.battery_rack_list:
-            if br.battery is not None:
-                pass
+    trace_sink.record(t_timer, sim_trace.TRACE_POWER, value=station.power)
 
-        if sr.power_cabinet is not None:
-            for module in sr.power_cabinet.module_list:
-                if module.status == "in_use":
-                    pass
-
-    data = data + '%d' %station.power
-
-    if len(data) > 0:
-        # data = data +'%d' %t_timer
-        data_logger.debug(data)    
-        pass
-
-def simulation_action_callback(station : swap.SwapStation, t_timer : int, interval : int, current_user : users.User):
+def simulation_action_callback(station : swap.SwapStation, t_timer : int, interval : int, current_user : users.User, trace_sink : sim_trace.Trace_Sink = None):
     '''
     这个函数包含了每一个仿真周期PSS要做的共同的事情，一般在仿真循环结尾使用
     参数说明：
@@ -61,6 +50,7 @@ def simulation_action_callback(station : swap.SwapStation, t_timer : int, interv
     t_timer:        整形，为当前仿真周期区块，一般为计数器i                                -> from range(sim_ticks)
     interval:       整形，为当前仿真周期，单位为秒，interval = 10 表明10秒一个仿真步长      -> sim_interval
     current_user:   current user object in the PSS
+    trace_sink:     trace of the run (sim_trace.create_trace), None -> no logging
     '''
     swap_result = station.do_swap(current_user, t_timer, interval)               # operate the swap behaviour, return True or False
     if station.trigger[-1] == 0:                                                                  # if grid interaction not activated -> do normal charge
@@ -68,11 +58,12 @@ def simulation_action_callback(station : swap.SwapStation, t_timer : int, interv
     else:                                                                                 # if grid interaction activated -> do discharge
         station.do_grid_interaction_discharge(t_timer, interval)
     
-    log_data(station, t_timer)                                                            # logging the data
+    if trace_sink is not None:
+        log_data(station, t_timer, trace_sink)                                            # logging the data
     
     return swap_result
 
-def add_users(param: dict, station : swap.SwapStation, user_dist_list : list, user_label : list, swap_queue, charge_queue, nio_charge_list : list, non_nio_charge_list : list, t_timer : int, interval : int):
+def add_users(param: dict, station : swap.SwapStation, user_dist_list : list, user_label : list, swap_queue, charge_queue, nio_charge_list : list, non_nio_charge_list : list, t_timer : int, interval : int, arrival_index : dict = None, rng_streams : dict = None, trace_sink : sim_trace.Trace_Sink = None, ambient_temperature = None):
     '''
     该函数在一个simulation cycle里使用，函数检查预设的用户到达序列，如果
     在当前的仿真周期内有用户到达，则生成一个用户并增加到换电站排队序列中
@@ -86,17 +77,26 @@ def add_users(param: dict, station : swap.SwapStation, user_dist_list : list, us
     non_nio_charge_list:    充电排队列表（非NIO用户），列表形式，主程序定义，作为参数传入
     t_timer:                整形，为当前仿真周期时间点，一般为计数器i（=用户到达时间）
     interval:               整形，为仿真周期步长，单位为秒，interval=10 表明10秒一个仿真步长
+    arrival_index:          users.create_arrival_index()生成的到达索引，给定时直接按tick取出到达用户，None时使用users.check_seq()逐秒扫描
+    rng_streams:            users.create_rng_streams()生成的随机数流，用于用户电池SOC和偏好的抽样，None时使用全局random
+    trace_sink:             仿真记录 sim_trace.create_trace()，None时不记录
+    ambient_temperature:    当前tick的环境温度 (temperature profile)，None时使用param["swap_rack_temperature"]
     '''
     
     # 检查当前时间间隔内是否有需要服务的用户，service_n 返回当前iteration内用户到达的时间戳列表，label_n返回用户的类别
     # 表明在一个仿真周期内有多少个用户到达，注意在一个仿真周期内可能有超过一个用户到达
-    service_n, label_n = users.check_seq(t_timer, interval, user_dist_list, user_label)
+    if arrival_index is not None:
+        service_n, label_n = users.get_arrivals(arrival_index, t_timer)
+    else:
+        service_n, label_n = users.check_seq(t_timer, interval, user_dist_list, user_label)
     
     if len(service_n) > 0: #如果有超过一个用户到达
         for i in range(len(service_n)):
             user_id = service_n[i]
             user_label = label_n[i]
-            user = users.User(user_label=user_label)                                    # 创建一个用户
+            user = users.User(user_label=user_label, rng_streams=rng_streams)           # 创建一个用户
+            if ambient_temperature is not None:
+                user.temp = ambient_temperature                                         # markov preference depends on the ambient temperature
             
             user.sequence = t_timer                                                     # 将用户到达的timer赋给sequence，做为用户进入队列的时间点
             user.user_id = user_id
@@ -119,131 +119,373 @@ def add_users(param: dict, station : swap.SwapStation, user_dist_list : list, us
                     user.markov_preference(queue_length)
 
             # set up the temperature
-            user.battery.temperature = param["swap_rack_temperature"]
+            if ambient_temperature is None:
+                user.battery.temperature = param["swap_rack_temperature"]
+            else:
+                user.battery.set_temperature(ambient_temperature, interpolate=True)
 
             # put user into different queue according to their selection preference
             if user.charge_preference == "swap":
                 swap_queue.put(user)
-                logger.debug('timer<%d>: push user %d into swap queue', t_timer , user_id)
+                if trace_sink is not None:
+                    trace_sink.record(t_timer, sim_trace.TRACE_PUSH_SWAP, user_id)
 
             if user.charge_preference == "charge":
                 charge_queue.put(user)
 
-            if user.charge_preference == "leave":
-                logger.info("timer<%d>: User %d abandons the service and chooses to leave" ,t_timer, user.user_id)
+            if user.charge_preference == "leave" and trace_sink is not None:
+                trace_sink.record(t_timer, sim_trace.TRACE_LEAVE, user.user_id)
+
+def get_stream(rng_streams : dict, stream : str):
+    '''
+    return the numpy Generator of the stream, None if no streams are used (global random state)
+    '''
+    if rng_streams is None:
+        return None
+    return rng_streams[stream]
+
+def init_sim_state():
+    '''
+    create the container of the dynamic simulation objects (queues, serviced users and KPI records),
+    it is handed over between the single simulation steps
+    '''
+    sim_state = {
+        "swap_queue": queue.Queue(),                            # define a FIFO queue object used for manage waiting clients, command: ".put()", ".get()"
+        "charge_queue": queue.Queue(),                          # define a FIFO queue for charging service
+        "nio_charge_list": [],                                  # save for nio charged clients (PSC)
+        "non_nio_charge_list": [],                              # save for non_nio charged clients (PSC)
+        "swap_list": [],                                        # save for swap serviced clients (PSS)
+        "swap_user": None,                                      # save for swap user object in the queue
+        "charge_user": None,                                    # save for charge user object
+        "queue_length_swap": [],                                # save for queue length notation of swap
+        "queue_length_charge": [],                              # save for queue length notation of charge
+        "swap_user_wait_time": [],
+        "charge_user_wait_time": [],
+        "arrival_index": None,                                  # tick -> arriving users, see users.create_arrival_index()
+        "rng_streams": None,                                    # random streams of the users, see users.create_rng_streams()
+        "trace": None,                                          # trace of the run, see sim_trace.create_trace(), None -> no logging
+        "state_trace": None,                                    # recorder of the station state, see sim_trace.create_state_recorder()
+        "temperature": None,                                    # rack & ambient temperature per tick, see temperature.create_profile(), None -> constant
+    }
+    return sim_state
+
+def finish_swap(sim_state : dict, t_timer : int):
+    '''
+    book the current swap user as serviced once the swap is completed
+    '''
+    swap_user = sim_state["swap_user"]
+    if sim_state["trace"] is not None:
+        sim_state["trace"].record(t_timer, sim_trace.TRACE_SWAP_COMPLETE, swap_user.user_id)
+    swap_user.swap_complete_time = t_timer
+    swap_user.swap_service_time = t_timer - swap_user.sequence
+    sim_state["swap_list"].append(swap_user)
+    sim_state["swap_user"] = None
+
+def simulation_step(param : dict, station : swap.SwapStation, sim_state : dict, user_dist_lst : list, user_label : list, t_timer : int, interval : int):
+    '''
+    execute one simulation tick: user arrival, queue management, swap and charge service
+    '''
+    swap_queue = sim_state["swap_queue"]
+    charge_queue = sim_state["charge_queue"]
+    trace_sink = sim_state["trace"]
+    ambient_temperature = None
+    if sim_state["temperature"] is not None:
+        _, ambient_temperature = sim_state["temperature"].update(station, t_timer, len(sim_state["swap_list"]))
+
+    #检查在当前仿真周期内是否有用户到达，如果有，将用户添加到service_queue里面去
+    add_users(param, station, user_dist_lst, user_label, swap_queue, charge_queue, sim_state["nio_charge_list"], sim_state["non_nio_charge_list"], t_timer, interval, sim_state["arrival_index"], sim_state["rng_streams"], trace_sink, ambient_temperature)
+    # calculate the queue length for two group
+    sim_state["queue_length_swap"].append(swap_queue.qsize())
+    sim_state["queue_length_charge"].append(charge_queue.qsize())
+
+    # process 1: No current servicing client, but there exists clients in the waiting queue
+    if sim_state["swap_user"] is None and swap_queue.qsize() > 0:
+        sim_state["swap_user"] = swap_queue.get()
+        if trace_sink is not None:
+            trace_sink.record(t_timer, sim_trace.TRACE_SWAP_USER, sim_state["swap_user"].user_id, swap_queue.qsize())
+
+    if sim_state["charge_user"] is None and charge_queue.qsize()> 0:
+        sim_state["charge_user"] = charge_queue.get()
+
+    # process 2: there exists client in the service
+    swap_user = sim_state["swap_user"]
+    if swap_user is not None:
+        if station.start_swap(swap_user.battery, swap_targetsoc = param["select_soc"]):
+            if trace_sink is not None:
+                trace_sink.record(t_timer, sim_trace.TRACE_SWAP_START, swap_user.user_id)
+            swap_user.swap_start_time = t_timer
+            sim_state["swap_user_wait_time"].append(swap_user.swap_waiting_time())
+
+    charge_user = sim_state["charge_user"]
+    if charge_user is not None:
+        charge_user.battery.target_max_soc = param["target_soc"]   #定义了用户希望达到的最大SOC
+        pile_id = station.vehicle_charge(charge_user.battery)      #试图将该用户连接到某一个充电桩
+        # case 1: successful connect to a charge pile
+        if pile_id >= 0:
+            charge_user.charge_connect_time = t_timer
+            charge_user.connect_pile = pile_id
+            sim_state["charge_user_wait_time"].append(charge_user.charge_waiting_time())
+            # devide the charge list into nio and non_nio user list
+            if charge_user.user_type == "nio":
+                sim_state["nio_charge_list"].append(charge_user)
+            else:
+                sim_state["non_nio_charge_list"].append(charge_user)
+            if trace_sink is not None:
+                trace_sink.record(t_timer, sim_trace.TRACE_CONNECT_PILE, charge_user.user_id, pile_id)
+            sim_state["charge_user"] = None
+        # case 2: failed to connect to a charge pile
+        else:
+            # charge user waiting for a place
+            pass
+            # logger.info('timer<%d>: User %d can not find free charger,user left', i , user.id)
+
+    # process 3: clients who select swap
+    swaptrigger = simulation_action_callback(station, t_timer, interval, swap_user, trace_sink) # user -> do_swap & batteries in hotel charge
+    if swaptrigger == True: #执行仿真周期内需要完成的动作 do_swap, do_charge
+        finish_swap(sim_state, t_timer)
+    if sim_state["state_trace"] is not None:
+        sim_state["state_trace"].record(station, t_timer, sim_state["queue_length_swap"][-1], sim_state["queue_length_charge"][-1])
+
+def do_tick_loop(param : dict, station : swap.SwapStation, sim_state : dict, user_dist_lst : list, user_label : list, sim_ticks : int, interval : int, start_tick = 0):
+    '''
+    fixed tick simulation loop, every tick in [start_tick, start_tick + sim_ticks) is simulated completely
+    '''
+    # interation every 10 sec for 24hrs (8640 interation steps)
+    for i in range(start_tick, start_tick + sim_ticks):
+        simulation_step(param, station, sim_state, user_dist_lst, user_label, i, interval)
 
     ###################################################################################
-    ############################## Simulation Loop ####################################
+    ########################## Event Driven Simulation ################################
     ###################################################################################
-def do_simulation(param):
+EVENT_ARRIVAL = 0                   # user arrives at the station
+EVENT_SWAP_COMPLETE = 1             # swap platform finishes the current swap
+EVENT_SOC_THRESHOLD = 2             # rack battery reaches select_soc or changes its module demand
+EVENT_PILE_DEPARTURE = 3            # vehicle at a charge pile reaches target_soc or changes its module demand
+EVENT_GRID_INTERACTION = 4          # grid interaction interval begins or ends
+EVENT_TEMPERATURE = 5               # rack or ambient temperature bucket changes (charge limits change)
+
+def is_station_idle(station : swap.SwapStation, sim_state : dict, t_timer : int):
     '''
-    excute the simulation loop of the PSS
+    check whether the next tick can only charge batteries: nobody waits for a free swap platform
+    or a free charge pile, no battery switch is in operation and grid interaction can not be triggered
+    '''
+    if station.status == "switch":
+        return False
+    if sim_state["charge_user"] is None:
+        if sim_state["charge_queue"].qsize() > 0:
+            return False
+    elif station.has_free_pile():                               # waiting charge user can be connected
+        return False
+    if sim_state["swap_user"] is None and sim_state["swap_queue"].qsize() > 0:
+        return False
+    if station.status == "in_use" and station.grid_interaction_timeStamp is not None:
+        if t_timer >= station.grid_interaction_timeStamp and station.grid_interaction_counter < station.interaction_num:
+            return False
+    return True
+
+def fast_forward_step(station : swap.SwapStation, sim_state : dict, t_timer : int, interval : int):
+    '''
+    simulate one tick of an idle station: no arrival and no change of the power distribution,
+    only the swap timer runs and the connected batteries are charged
+    '''
+    sim_state["queue_length_swap"].append(sim_state["swap_queue"].qsize())
+    sim_state["queue_length_charge"].append(sim_state["charge_queue"].qsize())
+    swaptrigger = station.do_swap(sim_state["swap_user"], t_timer, interval, rearrange=False)
+    station.do_charge(t_timer, interval, redistribute=False)
+    if sim_state["trace"] is not None:
+        log_data(station, t_timer, sim_state["trace"])
+    if swaptrigger == True:
+        finish_swap(sim_state, t_timer)
+    if sim_state["state_trace"] is not None:
+        sim_state["state_trace"].record(station, t_timer, sim_state["queue_length_swap"][-1], sim_state["queue_length_charge"][-1])
+
+def do_event_loop(param : dict, station : swap.SwapStation, sim_state : dict, user_dist_lst : list, user_label : list, sim_ticks : int, interval : int, start_tick = 0):
+    '''
+    discrete event simulation loop of the ticks [start_tick, start_tick + sim_ticks)
+    user arrivals, swap completions, SOC threshold crossings and pile departures are kept as events in
+    a priority queue, at every event the complete simulation step is executed. Once the station reached
+    a fixed point (same plan signature in two consecutive ticks and nobody waiting), the ticks until
+    the next event only run the swap timer and charge the batteries with the unchanged connection_map.
+    The skipped work provably leaves the station state untouched, therefore the results are identical
+    to the tick loop (tolerance 0) for the same random state.
     '''
+    events = []                                                 # heap of (tick, event type)
+    arrival_index = sim_state["arrival_index"]
+    if arrival_index is None:
+        arrival_index = users.create_arrival_index(user_dist_lst, user_label, sim_ticks, interval, start_tick)
+    for t in users.get_arrival_ticks(arrival_index):
+        heapq.heappush(events, (t, EVENT_ARRIVAL))
+    if station.grid_interaction_timeStamp is not None:
+        heapq.heappush(events, (station.grid_interaction_timeStamp, EVENT_GRID_INTERACTION))
+        heapq.heappush(events, (station.grid_interaction_time_upper_limit + 1, EVENT_GRID_INTERACTION))
+    if sim_state["temperature"] is not None:
+        for t in sim_state["temperature"].get_change_ticks(start_tick, start_tick + sim_ticks):
+            heapq.heappush(events, (t, EVENT_TEMPERATURE))
+    swap_ticks = -(-station.swap_period // interval)            # number of ticks of one swap
+
+    end_tick = start_tick + sim_ticks
+    last_signature = None
+    i = start_tick
+    while i < end_tick:
+        simulation_step(param, station, sim_state, user_dist_lst, user_label, i, interval)
+        signature = station.get_plan_signature()
+        settled = signature == last_signature and is_station_idle(station, sim_state, i + 1)
+        last_signature = signature
+        while len(events) > 0 and events[0][0] <= i:
+            heapq.heappop(events)
+        if settled and station.status == "in_use":
+            heapq.heappush(events, (i + swap_ticks - station.swap_timer, EVENT_SWAP_COMPLETE))
+        i += 1
+        if not settled:
+            continue
+
+        # fast forward until the next scheduled event or until a battery crosses a threshold
+        horizon = end_tick
+        if len(events) > 0:
+            horizon = min(events[0][0], end_tick)
+        if i < horizon and not station.is_charging():          # nothing changes until the next event
+            n_ticks = horizon - i
+            sim_state["queue_length_swap"].extend([sim_state["swap_queue"].qsize()] * n_ticks)
+            sim_state["queue_length_charge"].extend([sim_state["charge_queue"].qsize()] * n_ticks)
+            station.skip_ticks(i, horizon)
+            if sim_state["trace"] is not None:
+                for t in range(i, horizon):
+                    log_data(station, t, sim_state["trace"])
+            if sim_state["state_trace"] is not None:
+                for t in range(i, horizon):
+                    sim_state["state_trace"].record(station, t, sim_state["queue_length_swap"][-1], sim_state["queue_length_charge"][-1])
+            i = horizon
+            continue
+        charging_signature = station.get_charging_signature()
+        while i < horizon:
+            fast_forward_step(station, sim_state, i, interval)
+            i += 1
+            new_charging_signature = station.get_charging_signature()
+            if new_charging_signature != charging_signature:
+                if [sr[1] for sr in new_charging_signature] != [sr[1] for sr in charging_signature]:
+                    heapq.heappush(events, (i, EVENT_PILE_DEPARTURE))
+                else:
+                    heapq.heappush(events, (i, EVENT_SOC_THRESHOLD))
+                last_signature = station.get_plan_signature()
+                break
+
     ###################################################################################
-    ##################### Part 1: Simualtion parameters setting #######################
+    ############################## Simulation Loop ####################################
     ###################################################################################
-    sim_days = param["sim_days"]                                # define simulation days in int (by dafult 1)
-    sim_interval = param["sim_interval"]                        # define the simulation step in int, unit 1 sec
-    sim_ticks = param["sim_ticks"]                              # define the total simulation bins    
-    station1 = SwapStation(param)                               # setup Swap station instance 
+def create_station(param : dict):
+    '''
+    set up the swap station of param with its batteries loaded and the charge modules initialized
+    '''
+    station = SwapStation(param)                                # setup Swap station instance 
 
     # battery_actual_num = sum(list(param["battery_config"].values()))
-    # if battery_actual_num != station1.max_battery_number:       # check the battery num configuration
+    # if battery_actual_num != station.max_battery_number:        # check the battery num configuration
     #     logger.error("battery num not identical, check battery_config")
     #     return
     
     # load the batteries into the swap rack
     for i in param["battery_config"].items():
         for num in range(i[1]):                                 # i[1] = num of each battery type
-            station1.load_battery_auto(Battery(soc=param["init_battery_soc_in_PSS"], batterytype=i[0])) # i[0] = battery type
+            station.load_battery_auto(Battery(soc=param["init_battery_soc_in_PSS"], batterytype=i[0])) # i[0] = battery type
 
-    station1.init_charge()                                      # init the PSS charge modules, set select soc
-    station1.set_temperature(rack_temperature=25, env_temperature=25)
-    
+    station.init_charge()                                       # init the PSS charge modules, set select soc
+    station.set_temperature(rack_temperature=25, env_temperature=25)
+    return station
+
+def create_user_queue(param : dict, rng_streams : dict, file_index = None):
+    '''
+    generate the user queue of one day (arrive timestamp in sec relative to 00:00:00, label list)
+    file_index: day file of the statistical mode, None -> random selection
+    '''
     if param["user_sequence_mode"] == "random":
         # queue generation mode "random"
         nio_user_num = param["nio_user_num"]                    # define the number of daily nio clients
         non_nio_user_num = param["non_nio_user_num"]            # define the number of daily non nio clients
-        user_dist_lst, user_label = users.create_user_queue_random(nio_user_num, non_nio_user_num)        # 根据user_distribtion.dat定义的分布规律，生成一个用户列表，user_dist_lst 记录用户到达的timestamp
+        return users.create_user_queue_random(nio_user_num, non_nio_user_num, rng=get_stream(rng_streams, "arrival")) # 根据user_distribtion.dat定义的分布规律，生成一个用户列表，user_dist_lst 记录用户到达的timestamp
+    # queue generation mode "statistical"
+    area = param["user_area"]
+    non_nio_user_num = param["non_nio_user_num"] 
+    return users.create_user_queue_statistical(area=area, non_nio_user_num=non_nio_user_num, rng=get_stream(rng_streams, "arrival"), file_index=file_index) # 根据GC中的user_dist_file_list列表中的文件(data文件夹下)，随机选取一个定义的一天内到达时间生成用户序列
+
+def init_simulation(param : dict):
+    '''
+    set up the station with loaded batteries, the user queue of the day and the simulation state of param
+    return (station, sim_state, user_dist_lst, user_label)
+    '''
+    if param.get("warm_start"):
+        import warmup                                           # warmup imports main
+        station1, sim_state = warmup.get_warm_state(param)      # steady state station and waiting users of the configuration
+    else:
+        station1 = create_station(param)                        # setup Swap station instance with loaded batteries
+        sim_state = init_sim_state()                            # queues, serviced user lists and KPI records
+    rng_streams = users.create_rng_streams(param.get("seed"))   # independent random streams, None -> global random state
+    user_dist_lst, user_label = create_user_queue(param, rng_streams)
+
+    sim_state["arrival_index"] = users.create_arrival_index(user_dist_lst, user_label, param["sim_ticks"], param["sim_interval"])
+    sim_state["rng_streams"] = rng_streams
+    sim_state["trace"] = sim_trace.create_trace(param)          # decided once per run, None -> no logging in the loop
+    sim_state["state_trace"] = sim_trace.create_state_recorder(param, station1)
+    sim_state["temperature"] = temperature.create_profile(param)  # None -> constant swap_rack_temperature
+    return station1, sim_state, user_dist_lst, user_label
+
+def do_simulation_loop(param : dict, station : swap.SwapStation, sim_state : dict, user_dist_lst : list, user_label : list, sim_ticks : int, interval : int, start_tick = 0):
+    '''
+    simulate the ticks [start_tick, start_tick + sim_ticks) with the loop of param["sim_engine"]
+    '''
+    if param.get("sim_engine", "tick") == "event":
+        do_event_loop(param, station, sim_state, user_dist_lst, user_label, sim_ticks, interval, start_tick)
     else:
-        # queue generation mode "statistical"
-        area = param["user_area"]
-        non_nio_user_num = param["non_nio_user_num"] 
-        user_dist_lst, user_label = users.create_user_queue_statistical(area=area, non_nio_user_num=non_nio_user_num) # 根据GC中的user_dist_file_list列表中的文件(data文件夹下)，随机选取一个定义的一天内到达时间生成用户序列
-
-    # change and modify the charge list into queue object
-    swap_queue = queue.Queue()                                  # define a FIFO queue object used for manage waiting clients, command: ".put()", ".get()"
-    charge_queue = queue.Queue()                                # define a FIFO queue for charging service
-    nio_charge_list = []                                        # save for nio charged clients (PSC)
-    non_nio_charge_list = []                                    # save for non_nio charged clients (PSC)
-    swap_list = []                                              # save for swap serviced clients (PSS)
-    swap_user = None                                            # save for swap user object in the queue
-    charge_user = None                                          # save for charge user object
-    queue_length_swap = []                                      # save for queue length notation of swap
-    queue_length_charge = []                                    # save for queue length notation of charge
-    swap_user_wait_time = []
-    charge_user_wait_time = []
+        do_tick_loop(param, station, sim_state, user_dist_lst, user_label, sim_ticks, interval, start_tick)
+
+def do_simulation(param):
+    '''
+    excute the simulation loop of the PSS
+    param["sim_engine"]: "tick" (default) simulates every tick, "event" uses the event driven loop
+    param["seed"]: int or list of int, seeds independent random streams for arrival, SOC and preference
+                   (bit reproducible), None or missing -> global random state
+    param["grid_power_cap"]: list of time of day power limits [[start_hour, end_hour, kW], ...], the module output
+                   above the limit (and above max_power) is curtailed, power_history records [timer, power, curtailed power]
+    param["trace_file"]: binary trace file of the simulation events (see sim_trace), without it the events are only
+                   traced if the 'data' logger is enabled for DEBUG
+    param["state_trace_file"]: columnar file of the full station state per tick (see sim_trace.State_Recorder)
+    param["temperature_profile"]: seasonal & diurnal rack and ambient temperature (see temperature.create_profile),
+                   missing -> constant swap_rack_temperature
+    param["warm_start"]: True -> the day starts from the steady state of the configuration (see warmup) instead of
+                   the rack batteries at init_battery_soc_in_PSS, warmup.Warmup_Error if the configuration has no steady state
+    the arrivals of one day are simulated over sim_ticks, consecutive days are simulated by horizon.do_horizon_simulation
+    '''
+    ###################################################################################
+    ##################### Part 1: Simualtion parameters setting #######################
+    ###################################################################################
+    sim_interval = param["sim_interval"]                        # define the simulation step in int, unit 1 sec
+    sim_ticks = param["sim_ticks"]                              # define the total simulation bins    
+    station1, sim_state, user_dist_lst, user_label = init_simulation(param)
     
     ###################################################################################
     ########################### Part 2: Simualtion Loop ###############################
     ###################################################################################
     logger.info('start_simulatin')
     
-    # interation every 10 sec for 24hrs (8640 interation steps)
-    for i in range(sim_ticks):
-        
-        #检查在当前仿真周期内是否有用户到达，如果有，将用户添加到service_queue里面去
-        add_users(param, station1, user_dist_lst, user_label, swap_queue, charge_queue, nio_charge_list, non_nio_charge_list, i, sim_interval) 
-        # calculate the queue length for two group
-        queue_length_swap.append(swap_queue.qsize())
-        queue_length_charge.append(charge_queue.qsize())     
-
-        # process 1: No current servicing client, but there exists clients in the waiting queue
-        if swap_user is None and swap_queue.qsize() > 0: 
-            swap_user = swap_queue.get()
-            logger.debug('timer<%d>: Set Swap User No. (%d), total %d users remains in waitlist', i, swap_user.user_id, swap_queue.qsize())
-        
-        if charge_user is None and charge_queue.qsize()> 0:
-            charge_user = charge_queue.get()
-        
-        # process 2: there exists client in the service
-        if swap_user is not None:
-            if station1.start_swap(swap_user.battery, swap_targetsoc = param["select_soc"]):
-                logger.debug('timer<%d>: User #%d start swap',i, swap_user.user_id)
-                swap_user.swap_start_time = i
-                swap_user_wait_time.append(swap_user.swap_waiting_time())
-        
-        if charge_user is not None:
-            charge_user.battery.target_max_soc = param["target_soc"]   #定义了用户希望达到的最大SOC
-            pile_id = station1.vehicle_charge(charge_user.battery)      #试图将该用户连接到某一个充电桩   
-            # case 1: successful connect to a charge pile
-            if pile_id >= 0: 
-                charge_user.charge_connect_time = i
-                charge_user.connect_pile = pile_id
-                charge_user_wait_time.append(charge_user.charge_waiting_time())
-                # devide the charge list into nio and non_nio user list
-                if charge_user.user_type == "nio":
-                    nio_charge_list.append(charge_user)
-                else:
-                    non_nio_charge_list.append(charge_user)
-                logger.debug('timer<%d>: Connect user %d to charge pile %d', i , charge_user.user_id, pile_id)
-                charge_user = None
-            # case 2: failed to connect to a charge pile
-            else:
-                # charge user waiting for a place
-                pass
-                # logger.info('timer<%d>: User %d can not find free charger,user left', i , user.id)
-        
-        # process 3: clients who select swap
-        swaptrigger = simulation_action_callback(station1, i, sim_interval, swap_user) # user -> do_swap & batteries in hotel charge
-        if swaptrigger == True: #执行仿真周期内需要完成的动作 do_swap, do_charge
-            logger.debug('timer<%d>: User #%d complete swap', i, swap_user.user_id)
-            swap_user.swap_complete_time = i
-            swap_user.swap_service_time = i - swap_user.sequence
-            swap_list.append(swap_user)
-            swap_user = None
-        
+    do_simulation_loop(param, station1, sim_state, user_dist_lst, user_label, sim_ticks, sim_interval)
+    if sim_state["trace"] is not None:
+        sim_state["trace"].close()
+    if sim_state["state_trace"] is not None:
+        sim_state["state_trace"].close()
+    return get_results(param, station1, sim_state, user_dist_lst)
 
+def get_results(param : dict, station1 : swap.SwapStation, sim_state : dict, user_dist_lst : list):
+    '''
+    evaluate the finished simulation day, return the result tuple of do_simulation
+    '''
+    sim_interval = param["sim_interval"]
+    sim_ticks = param["sim_ticks"]
+    swap_list = sim_state["swap_list"]
+    nio_charge_list = sim_state["nio_charge_list"]
+    non_nio_charge_list = sim_state["non_nio_charge_list"]
+    queue_length_swap = sim_state["queue_length_swap"]
+    queue_length_charge = sim_state["queue_length_charge"]
+    swap_user_wait_time = sim_state["swap_user_wait_time"]
+    charge_user_wait_time = sim_state["charge_user_wait_time"]
         
     ###################################################################################
     ##################### Part 3: Data Analysis & Plot ################################
@@ -316,3 +558,98 @@ def do_simulation(param):
     return swap_user_wait_time, charge_user_wait_time, queue_length_swap, queue_length_charge, user_dist_lst, station1.max_power, station1.power_history, residual_power, swap_list, nio_charge_list, \
         non_nio_charge_list, average_time_swap, nio_average_time_charge, non_nio_average_time_charge, swap_ratio_in_15_min
 
+def get_kpis(result : tuple, sim_interval : int):
+    '''
+    extract the scalar key characteristics of one do_simulation() result
+    return dict with keys:
+    swap_num, nio_charge_num, non_nio_charge_num:   number of serviced users
+    average_time_swap, nio_average_time_charge,
+    non_nio_average_time_charge:                    average service time [minutes]
+    swap_ratio_in_15_min:                           ratio of swap users serviced within 15 minutes
+    average_swap_wait_time:                         average waiting time of swap users [minutes]
+    queue_overflow:                                 number of users still waiting at the end of the simulation
+    energy, grid_energy:                            charge energy and grid interaction energy [kWh]
+    peak_power:                                     maximal station power [kW]
+    curtailed_energy:                               charge energy curtailed by the station power cap [kWh]
+    '''
+    swap_user_wait_time, charge_user_wait_time, queue_length_swap, queue_length_charge, user_dist_lst, max_power, power_history, residual_power, swap_list, \
+    nio_charge_list, non_nio_charge_list, average_time_swap, nio_average_time_charge, non_nio_average_time_charge, swap_ratio_in_15_min = result
+    energy = 0
+    grid_energy = 0
+    peak_power = 0
+    curtailed_energy = 0
+    for pw in power_history:
+        if pw[1] >= 0:
+            energy += sim_interval * pw[1] / 3600
+        else:
+            grid_energy += sim_interval * abs(pw[1]) / 3600
+        peak_power = max(peak_power, pw[1])
+        if len(pw) > 2:
+            curtailed_energy += sim_interval * pw[2] / 3600
+    kpis = {
+        "swap_num": len(swap_list),
+        "nio_charge_num": len(nio_charge_list),
+        "non_nio_charge_num": len(non_nio_charge_list),
+        "average_time_swap": average_time_swap,
+        "nio_average_time_charge": nio_average_time_charge,
+        "non_nio_average_time_charge": non_nio_average_time_charge,
+        "swap_ratio_in_15_min": swap_ratio_in_15_min,
+        "average_swap_wait_time": sum(swap_user_wait_time) / len(swap_user_wait_time) if len(swap_user_wait_time) > 0 else 0,
+        "queue_overflow": queue_length_swap[-1] + queue_length_charge[-1] if len(queue_length_swap) > 0 else 0,
+        "energy": energy,
+        "grid_energy": grid_energy,
+        "peak_power": peak_power,
+        "curtailed_energy": curtailed_energy,
+    }
+    return kpis
+
+    ###################################################################################
+    ######################## Multiple Station Simulation ##############################
+    ###################################################################################
+def run_simulation_worker(index : int, param : dict):
+    '''
+    run one station simulation in a worker process
+    return (index, result of do_simulation)
+    '''
+    return index, do_simulation(param)
+
+def do_multi_simulation(param_list : list, max_workers = None, seed = None, cache = None, first_index = 0):
+    '''
+    simulate several stations in parallel with a process pool
+    param_list:     list of param dicts, one per station (see do_simulation)
+    max_workers:    number of worker processes, None -> number of cpu cores, 1 -> run in this process
+    seed:           base seed, station i is simulated with param["seed"] = [seed, first_index + i] (independent random
+                    streams, see users.create_rng_streams), None -> random base seed
+    cache:          result cache (see result_cache.Result_Cache), cached stations are not simulated again,
+                    only used with a given seed
+    generator, yields (index in param_list, result of do_simulation) in completion order, so the caller
+    can update its progress while the remaining stations are still running
+    '''
+    if seed is None:
+        seed = random.randrange(2**32)
+        cache = None                                            # a random base seed is never requested again
+    param_list = [dict(param, seed=[seed, first_index + index]) for index, param in enumerate(param_list)]
+
+    pending = []
+    for index, param in enumerate(param_list):
+        result = cache.get(param) if cache is not None else None
+        if result is not None:
+            yield index, result
+        else:
+            pending.append(index)
+
+    if max_workers == 1 or len(pending) <= 1:
+        for index in pending:
+            index, result = run_simulation_worker(index, param_list[index])
+            if cache is not None:
+                cache.put(param_list[index], result)
+            yield index, result
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_simulation_worker, index, param_list[index]) for index in pending]
+        for future in as_completed(futures):
+            index, result = future.result()
+            if cache is not None:
+                cache.put(param_list[index], result)
+            yield index, result
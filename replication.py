@@ -0,0 +1,164 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# Monte Carlo replication of do_simulation
+# one simulation run is a single random sample (arrivals, SOC, preferences), the
+# replication runner executes independently seeded replicas in parallel workers and
+# aggregates the KPIs into mean, percentiles and confidence interval
+###################################################################################
+import os
+import copy
+import math
+import random
+import logging
+from statistics import NormalDist
+import numpy as np
+import main
+
+logger = logging.getLogger('main.replication')
+
+def t_cdf(t : float, dof : int):
+    '''
+    cumulative distribution function of the student t distribution for integer degree of freedom
+    finite series of Abramowitz & Stegun 26.7.3 / 26.7.4 with theta = atan(t / sqrt(dof))
+    '''
+    theta = math.atan(abs(t) / math.sqrt(dof))
+    cos2 = math.cos(theta) ** 2
+    if dof % 2 == 1:
+        term = math.cos(theta)
+        series = term if dof > 1 else 0.0
+        for k in range(3, dof - 1, 2):
+            term = term * cos2 * (k - 1) / k
+            series += term
+        prob = 2 / math.pi * (theta + math.sin(theta) * series)
+    else:
+        term = 1.0
+        series = term
+        for k in range(2, dof - 1, 2):
+            term = term * cos2 * (k - 1) / k
+            series += term
+        prob = math.sin(theta) * series
+    if t >= 0:
+        return 0.5 + prob / 2
+    return 0.5 - prob / 2
+
+def t_quantile(p : float, dof : int):
+    '''
+    quantile of the student t distribution (no scipy dependency)
+    dof <= 200: bisection of t_cdf, dof > 200: Cornish-Fisher expansion around the normal quantile (Abramowitz & Stegun 26.7.5)
+    '''
+    if dof < 1:
+        logger.error('t_quantile: degree of freedom must be >= 1 (%d)', dof)
+        return float("nan")
+    if p < 0.5:
+        return -1 * t_quantile(1 - p, dof)
+    if dof <= 200:
+        low = 0.0
+        high = 1.0
+        while t_cdf(high, dof) < p:
+            high *= 2
+        for i in range(100):
+            mid = (low + high) / 2
+            if t_cdf(mid, dof) < p:
+                low = mid
+            else:
+                high = mid
+        return (low + high) / 2
+    z = NormalDist().inv_cdf(p)
+    g1 = (z ** 3 + z) / 4
+    g2 = (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96
+    g3 = (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384
+    g4 = (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160
+    return z + g1 / dof + g2 / dof ** 2 + g3 / dof ** 3 + g4 / dof ** 4
+
+def summarize_kpis(kpi_list : list, confidence = 0.95, percentiles = (5, 50, 95)):
+    '''
+    aggregate the KPI dicts of all replicas (see main.get_kpis)
+    return dict: KPI name -> {"n", "mean", "std", "p5", "p50", "p95", "ci_low", "ci_high", "half_width"}
+    the confidence interval is the student t interval of the mean
+    '''
+    summary = {}
+    if len(kpi_list) == 0:
+        return summary
+    for name in kpi_list[0].keys():
+        values = np.array([kpi[name] for kpi in kpi_list], dtype=np.float64)
+        n = len(values)
+        mean = float(values.mean())
+        if n > 1:
+            std = float(values.std(ddof=1))
+            half_width = t_quantile(0.5 + confidence / 2, n - 1) * std / math.sqrt(n)
+        else:
+            std = 0.0
+            half_width = float("inf")
+        item = {"n": n, "mean": mean, "std": std}
+        for q in percentiles:
+            item["p%d" % q] = float(np.percentile(values, q))
+        item["ci_low"] = mean - half_width
+        item["ci_high"] = mean + half_width
+        item["half_width"] = half_width
+        summary[name] = item
+    return summary
+
+def is_converged(summary : dict, target_half_width : dict):
+    '''
+    check whether the confidence interval half width of every target KPI is reached
+    '''
+    for name, width in target_half_width.items():
+        if name not in summary:
+            logger.error('is_converged: KPI %s not available', name)
+            return False
+        if summary[name]["half_width"] > width:
+            return False
+    return True
+
+def run_replications(param : dict, target_half_width = None, confidence = 0.95, min_replicas = 5, max_replicas = 50,
+                     max_workers = None, batch_size = None, seed = None, callback = None):
+    '''
+    execute independently seeded replicas of do_simulation(param) until the requested confidence interval is reached
+    param:              simulation param dict (see main.do_simulation)
+    target_half_width:  dict KPI name -> requested CI half width, e.g. {"swap_ratio_in_15_min": 0.02},
+                        None -> run max_replicas replicas
+    confidence:         confidence level of the interval
+    min_replicas:       minimal number of replicas before the stop criterion is checked
+    max_replicas:       upper limit of replicas
+    max_workers:        number of worker processes (see main.do_multi_simulation)
+    batch_size:         number of replicas started together, None -> number of workers (cpu count)
+    seed:               base seed, replica i is simulated with the seed [seed, i] and the stop criterion is checked
+                        replica by replica in this order (replicas of the last batch after the stop are dropped),
+                        so the result only depends on the seed, not on batch_size or the workers, None -> random
+    callback:           function(number of finished replicas, summary) called after every batch, e.g. for a progress bar
+    return dict {"replicas": number of replicas, "converged": bool, "kpis": KPI dict per replica, "summary": summarize_kpis()}
+    '''
+    if target_half_width is None:
+        target_half_width = {}
+    if batch_size is None:
+        batch_size = max_workers if max_workers is not None else (os.cpu_count() or 1)
+    batch_size = max(1, batch_size)
+    if seed is None:
+        seed = random.randrange(2**32)
+
+    kpi_list = []
+    summary = {}
+    converged = False
+    while len(kpi_list) < max_replicas:
+        n_batch = min(batch_size, max_replicas - len(kpi_list))
+        if len(kpi_list) < min_replicas:
+            n_batch = max(n_batch, min(min_replicas, max_replicas) - len(kpi_list))
+        param_list = [copy.deepcopy(param) for i in range(n_batch)]
+        results = [None] * n_batch
+        for index, result in main.do_multi_simulation(param_list, max_workers=max_workers, seed=seed, first_index=len(kpi_list)):
+            results[index] = main.get_kpis(result, param["sim_interval"])
+
+        for kpis in results:                                                    # replica order, independent of completion order
+            kpi_list.append(kpis)
+            if len(kpi_list) >= min_replicas and len(target_half_width) > 0 and is_converged(summarize_kpis(kpi_list, confidence), target_half_width):
+                converged = True
+                break
+        summary = summarize_kpis(kpi_list, confidence)
+        if callback is not None:
+            callback(len(kpi_list), summary)
+        if converged:
+            break
+
+    logger.info('replication finished after %d replicas, converged = %s', len(kpi_list), converged)
+    return {"replicas": len(kpi_list), "converged": converged, "kpis": kpi_list, "summary": summary}
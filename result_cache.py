@@ -0,0 +1,255 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# content addressed result cache of do_simulation
+# the key is the sha256 of the canonical (sorted) json of the param dict and the
+# model version (digest of the model sources and the data files), the outputs are
+# saved column wise in a compressed npz file. The cache is limited by its size on
+# disk, the least recently used entries are removed first.
+# Only seeded runs (param["seed"] is not None) without trace files are cached, an
+# unseeded run is a new random sample every time.
+###################################################################################
+import os
+import glob
+import json
+import hashlib
+import logging
+import numpy as np
+import main
+
+logger = logging.getLogger('main.result_cache')
+
+MODEL_VERSION = 1                                               # increase to invalidate all cached results
+MODEL_FILES = ["main.py", "swap.py", "users.py", "arrival_store.py", "temperature.py", "warmup.py", "global_param.py", "data/*.dat"]
+USER_LISTS = ["swap_list", "nio_charge_list", "non_nio_charge_list"]
+USER_COLUMNS = ["user_id", "sequence", "swap_start_time", "swap_complete_time", "swap_service_time", "charge_connect_time",
+                "connect_pile", "charge_start_time", "charge_length"]
+
+model_digest = None
+
+def get_model_version():
+    '''
+    return the model version: MODEL_VERSION and the sha256 of the model sources and data files,
+    every change of the simulation model creates new cache keys
+    '''
+    global model_digest
+    if model_digest is None:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for pattern in MODEL_FILES:
+            for file_name in sorted(glob.glob(os.path.join(base_dir, pattern))):
+                digest.update(os.path.relpath(file_name, base_dir).encode())
+                with open(file_name, "rb") as f:
+                    digest.update(f.read())
+        model_digest = digest.hexdigest()
+    return "%d-%s" % (MODEL_VERSION, model_digest)
+
+def json_default(obj):
+    '''
+    convert the numpy and set types of the param dict into json types
+    '''
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError("param value of type %s can not be hashed" % type(obj).__name__)
+
+def get_key(param : dict):
+    '''
+    canonical hash of the param dict (incl. seed) and the model version
+    '''
+    content = {"param": param, "model_version": get_model_version()}
+    text = json.dumps(content, sort_keys=True, separators=(",", ":"), default=json_default)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class Cached_User():
+    '''
+    service record of a user restored from the cache,
+    same attributes and service time methods as users.User but without battery object
+    '''
+    def __init__(self, user_type, **columns):
+        self.user_type = user_type
+        self.battery = None
+        for name in USER_COLUMNS:
+            setattr(self, name, int(columns[name]))
+        self.id = self.user_id
+        if self.connect_pile < 0:
+            self.connect_pile = None
+        self.charge_preference = "charge" if self.charge_connect_time != -1 else "swap"
+
+    def charge_service_time(self, mode = 1):   # mode = 1 返回充电加排队时间; mode = 0 只返回充电时间
+        if mode == 1:
+            return abs(self.charge_start_time + self.charge_length - self.sequence)
+        return self.charge_length
+
+    def swap_waiting_time(self):
+        if self.sequence != -1 and self.swap_start_time != -1:
+            return self.swap_start_time - self.sequence
+        return None
+
+    def charge_waiting_time(self):
+        if self.sequence != -1 and self.charge_connect_time != -1:
+            return self.charge_connect_time - self.sequence
+        return None
+
+def pack_users(user_list : list, prefix : str, columns : dict):
+    '''
+    save the service records of the users column wise into columns[prefix + "." + column]
+    '''
+    records = {name: [] for name in USER_COLUMNS}
+    user_type = []
+    for user in user_list:
+        records["user_id"].append(user.user_id)
+        records["sequence"].append(user.sequence)
+        records["swap_start_time"].append(user.swap_start_time)
+        records["swap_complete_time"].append(user.swap_complete_time)
+        records["swap_service_time"].append(user.swap_service_time)
+        records["charge_connect_time"].append(user.charge_connect_time)
+        records["connect_pile"].append(-1 if user.connect_pile is None else user.connect_pile)
+        if user.battery is not None:
+            records["charge_start_time"].append(user.battery.charge_start_time)
+            records["charge_length"].append(len(user.battery.charge_history))
+        else:
+            records["charge_start_time"].append(-1)
+            records["charge_length"].append(0)
+        user_type.append(user.user_type)
+    for name in USER_COLUMNS:
+        columns[prefix + "." + name] = np.array(records[name], dtype=np.int64)
+    columns[prefix + ".user_type"] = np.array(user_type, dtype=np.str_)
+
+def unpack_users(prefix : str, columns):
+    user_type = columns[prefix + ".user_type"]
+    records = {name: columns[prefix + "." + name] for name in USER_COLUMNS}
+    return [Cached_User(str(user_type[i]), **{name: records[name][i] for name in USER_COLUMNS}) for i in range(len(user_type))]
+
+def pack_result(result : tuple):
+    '''
+    convert one do_simulation() result into a dict of numpy columns
+    '''
+    swap_user_wait_time, charge_user_wait_time, queue_length_swap, queue_length_charge, user_dist_lst, max_power, power_history, residual_power, swap_list, \
+    nio_charge_list, non_nio_charge_list, average_time_swap, nio_average_time_charge, non_nio_average_time_charge, swap_ratio_in_15_min = result
+    columns = {
+        "swap_user_wait_time": np.array(swap_user_wait_time, dtype=np.float64),
+        "charge_user_wait_time": np.array(charge_user_wait_time, dtype=np.float64),
+        "queue_length_swap": np.array(queue_length_swap, dtype=np.int64),
+        "queue_length_charge": np.array(queue_length_charge, dtype=np.int64),
+        "user_dist_lst": np.array(user_dist_lst, dtype=np.int64),
+        "power_timer": np.array([pw[0] for pw in power_history], dtype=np.int64),
+        "power": np.array([pw[1] for pw in power_history], dtype=np.float64),
+        "curtailed_power": np.array([pw[2] for pw in power_history], dtype=np.float64),
+        "residual_power": np.array(residual_power, dtype=np.float64),
+        "scalars": np.array([max_power, average_time_swap, nio_average_time_charge, non_nio_average_time_charge, swap_ratio_in_15_min], dtype=np.float64),
+    }
+    for name, user_list in zip(USER_LISTS, [swap_list, nio_charge_list, non_nio_charge_list]):
+        pack_users(user_list, name, columns)
+    return columns
+
+def unpack_result(columns):
+    '''
+    restore the do_simulation() result tuple from the numpy columns
+    '''
+    max_power, average_time_swap, nio_average_time_charge, non_nio_average_time_charge, swap_ratio_in_15_min = columns["scalars"].tolist()
+    power_history = [[t, p, c] for t, p, c in zip(columns["power_timer"].tolist(), columns["power"].tolist(), columns["curtailed_power"].tolist())]
+    swap_list, nio_charge_list, non_nio_charge_list = [unpack_users(name, columns) for name in USER_LISTS]
+    return columns["swap_user_wait_time"].tolist(), columns["charge_user_wait_time"].tolist(), columns["queue_length_swap"].tolist(), \
+           columns["queue_length_charge"].tolist(), columns["user_dist_lst"].tolist(), max_power, power_history, columns["residual_power"].tolist(), \
+           swap_list, nio_charge_list, non_nio_charge_list, average_time_swap, nio_average_time_charge, non_nio_average_time_charge, swap_ratio_in_15_min
+
+class Result_Cache():
+    '''
+    on disk cache of simulation results, one compressed npz file per key
+    cache_dir:  folder of the cache files, None -> ".result_cache" beside this file
+    max_size:   maximal total size of the cache files [byte], least recently used files are removed first
+    '''
+    def __init__(self, cache_dir = None, max_size = 512 * 1024 * 1024):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".result_cache")
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get_path(self, key : str):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def is_cacheable(self, param : dict):
+        # a traced run has to be simulated to write its trace files
+        return param.get("seed") is not None and param.get("trace_file") is None and param.get("state_trace_file") is None
+
+    def get(self, param : dict):
+        '''
+        return the cached result of param, None if not available
+        '''
+        if not self.is_cacheable(param):
+            return None
+        path = self.get_path(get_key(param))
+        try:
+            with np.load(path, allow_pickle=False) as columns:
+                result = unpack_result(columns)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.error('result cache: can not read %s (%s), entry removed', path, e)
+            self.remove(path)
+            self.misses += 1
+            return None
+        os.utime(path)                                          # modification time = last access for the LRU eviction
+        self.hits += 1
+        return result
+
+    def put(self, param : dict, result : tuple):
+        '''
+        save the result of param, the file is written atomically
+        '''
+        if not self.is_cacheable(param):
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.get_path(get_key(param))
+        temp_path = path + ".%d.tmp" % os.getpid()
+        with open(temp_path, "wb") as f:
+            np.savez_compressed(f, **pack_result(result))
+        os.replace(temp_path, path)
+        self.evict()
+
+    def run(self, param : dict):
+        '''
+        return the cached result of param or run do_simulation(param) and save the result
+        '''
+        result = self.get(param)
+        if result is None:
+            result = main.do_simulation(param)
+            self.put(param, result)
+        return result
+
+    def evict(self):
+        '''
+        remove the least recently used files until the cache size is below max_size
+        '''
+        entries = []
+        total_size = 0
+        for path in glob.glob(os.path.join(self.cache_dir, "*.npz")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            self.remove(path)
+            total_size -= size
+
+    def remove(self, path : str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.cache_dir, "*.npz")):
+            self.remove(path)
@@ -0,0 +1,365 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# structured binary trace of the simulation events
+# the per tick logging of the simulation loop (user arrival, swap, pile connection,
+# station power) is written as fixed size binary records instead of formatted log
+# strings. Whether a run is traced is decided once per run (create_trace), a run
+# without trace does not spend any time on logging in the simulation loop.
+# The full station state of every tick (module output, connection_map, rack SOC,
+# pile status, queue length) is recorded by State_Recorder into a chunked, zlib
+# compressed columnar file, which State_Reader reads chunk by chunk from a memory map.
+###################################################################################
+import json
+import mmap
+import zlib
+import queue
+import struct
+import logging
+import threading
+import numpy as np
+
+data_logger = logging.getLogger('data')
+
+# event types of the trace records
+TRACE_POWER = 0                     # station power of the tick, value = power [kW]
+TRACE_PUSH_SWAP = 1                 # user pushed into the swap queue, id = user id
+TRACE_LEAVE = 2                     # user abandons the service, id = user id
+TRACE_SWAP_USER = 3                 # user taken from the swap queue, id = user id, value = remaining queue length
+TRACE_SWAP_START = 4                # swap started, id = user id
+TRACE_SWAP_COMPLETE = 5             # swap completed, id = user id
+TRACE_CONNECT_PILE = 6              # user connected to a charge pile, id = user id, value = pile id
+EVENT_NAMES = {
+    TRACE_POWER: "power",
+    TRACE_PUSH_SWAP: "push user into swap queue",
+    TRACE_LEAVE: "user abandons the service",
+    TRACE_SWAP_USER: "set swap user",
+    TRACE_SWAP_START: "start swap",
+    TRACE_SWAP_COMPLETE: "complete swap",
+    TRACE_CONNECT_PILE: "connect user to charge pile",
+}
+RECORD_DTYPE = np.dtype([("tick", "<i4"), ("event", "<i2"), ("id", "<i4"), ("value", "<f8")])
+
+class Trace_Sink():
+    '''
+    buffered writer of trace records
+    path:           binary trace file (records of RECORD_DTYPE, little endian, no header), the file is overwritten,
+                    None -> records are kept in memory and written to the 'data' logger as text by close()
+    buffer_size:    number of records buffered before they are appended to the file
+    '''
+    def __init__(self, path = None, buffer_size = 65536):
+        self.path = path
+        self.buffer = np.zeros(buffer_size, dtype=RECORD_DTYPE)
+        self.count = 0
+        self.chunks = []                                        # filled buffers of an in memory trace
+        self.file = open(path, "wb") if path is not None else None
+
+    def record(self, tick : int, event : int, id = -1, value = 0.0):
+        '''
+        append one record
+        '''
+        self.buffer[self.count] = (tick, event, id, value)
+        self.count += 1
+        if self.count == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.count == 0:
+            return
+        if self.file is not None:
+            self.buffer[:self.count].tofile(self.file)
+        else:
+            self.chunks.append(self.buffer[:self.count].copy())
+        self.count = 0
+
+    def close(self):
+        '''
+        write the remaining records, an in memory trace is written to the 'data' logger
+        '''
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            return
+        for chunk in self.chunks:
+            for record in chunk:
+                data_logger.debug(format_record(record))
+        self.chunks = []
+
+def format_record(record):
+    '''
+    text of one trace record, e.g. for the debug log
+    '''
+    event = int(record["event"])
+    if event == TRACE_POWER:
+        return 'timer<%d>, %d' % (record["tick"], record["value"])
+    text = 'timer<%d>: %s %d' % (record["tick"], EVENT_NAMES.get(event, "event %d" % event), record["id"])
+    if event in (TRACE_SWAP_USER, TRACE_CONNECT_PILE):
+        text += ' (%d)' % record["value"]
+    return text
+
+def read_trace(path : str):
+    '''
+    read a trace file, return structured numpy array of RECORD_DTYPE
+    '''
+    return np.fromfile(path, dtype=RECORD_DTYPE)
+
+def create_trace(param : dict):
+    '''
+    decide once per run whether the simulation is traced
+    param["trace_file"] given -> binary trace file, 'data' logger enabled for DEBUG -> in memory trace written
+    to the log at the end of the run, otherwise None (no logging in the simulation loop)
+    '''
+    path = param.get("trace_file")
+    if path is not None:
+        return Trace_Sink(path)
+    if data_logger.isEnabledFor(logging.DEBUG):
+        return Trace_Sink()
+    return None
+
+
+######################################################################
+##################### Columnar state trace ###########################
+######################################################################
+# file layout: MAGIC | chunk blobs (one blob per column and chunk, raw or zlib) | json index | index length (uint64) | MAGIC
+MAGIC = b"PSSTRACE"
+STATE_VERSION = 1
+SWAP_STATUS = {"free": 0, "in_use": 1, "switch": 2}
+PILE_STATUS = {"free": 0, "connected": 1, "charging": 2}
+
+def get_state_columns(station):
+    '''
+    return the layout of the station (number of modules, battery racks and charge piles per swap rack)
+    and the columns of the state trace: name -> (dtype, width), width None for one value per tick
+    '''
+    layout = {"modules": [], "racks": [], "piles": []}
+    for sr in station.swap_rack_list:
+        layout["modules"].append(len(sr.power_cabinet.module_list) if sr.power_cabinet is not None else 0)
+        layout["racks"].append(len(sr.battery_rack_list))
+        layout["piles"].append(len(sr.charge_pile_list) if sr.charge_pile_list is not None else 0)
+    module_num = sum(layout["modules"])
+    rack_num = sum(layout["racks"])
+    pile_num = sum(layout["piles"])
+    columns = {
+        "tick": ("<i4", None),
+        "power": ("<f8", None),                                 # station power [kW]
+        "curtailed_power": ("<f8", None),                       # power curtailed by the station power cap [kW]
+        "queue_swap": ("<i4", None),
+        "queue_charge": ("<i4", None),
+        "swap_status": ("<i1", None),                           # SWAP_STATUS
+        "module_power": ("<f4", module_num),                    # output of the linked modules [kW], 0 for free modules
+        "module_current": ("<f4", module_num),
+        "module_link": ("<i2", module_num),                     # connection_map: > 0 battery rack, < 0 charge pile, 0 free
+        "rack_soc": ("<f4", rack_num),                          # NaN for empty racks
+        "pile_status": ("<i1", pile_num),                       # PILE_STATUS
+        "pile_soc": ("<f4", pile_num),                          # NaN without vehicle
+    }
+    return layout, columns
+
+class State_Recorder():
+    '''
+    opt-in recorder of the full station state per tick
+    the ticks are collected in preallocated column buffers of chunk_ticks rows, full chunks are compressed
+    and written by a writer thread, so the simulation loop only copies the state into the buffers
+    path:           trace file, overwritten
+    station:        SwapStation, its layout (number of modules, racks, piles) defines the column width
+    chunk_ticks:    number of ticks per chunk (unit of compression and of reading)
+    compress:       zlib compress the chunks, False -> the reader returns zero copy views of the memory map
+    '''
+    def __init__(self, path : str, station, chunk_ticks = 8640, compress = True):
+        self.path = path
+        self.chunk_ticks = chunk_ticks
+        self.compress = compress
+        self.layout, self.columns = get_state_columns(station)
+        self.modules = [m for sr in station.swap_rack_list if sr.power_cabinet is not None for m in sr.power_cabinet.module_list]
+        self.racks = [br for sr in station.swap_rack_list for br in sr.battery_rack_list]
+        self.piles = [pile for sr in station.swap_rack_list if sr.charge_pile_list is not None for pile in sr.charge_pile_list]
+        self.index = []                                         # per chunk: number of ticks, column -> (offset, nbytes)
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.chunks = queue.Queue(maxsize=2)                    # bounded: the loop waits instead of piling up chunks
+        self.error = None
+        self.writer = threading.Thread(target=self.write_chunks, daemon=True)
+        self.writer.start()
+        self.buffer = self.create_buffer()
+        self.count = 0
+
+    def create_buffer(self):
+        buffer = {}
+        for name, (dtype, width) in self.columns.items():
+            shape = (self.chunk_ticks,) if width is None else (self.chunk_ticks, width)
+            buffer[name] = np.zeros(shape, dtype=dtype)
+        return buffer
+
+    def record(self, station, tick : int, queue_swap : int, queue_charge : int):
+        '''
+        copy the state of the station after the tick into the buffers
+        '''
+        i = self.count
+        buffer = self.buffer
+        buffer["tick"][i] = tick
+        buffer["power"][i] = station.power
+        buffer["curtailed_power"][i] = station.power_history[-1][2] if len(station.power_history) > 0 else 0
+        buffer["queue_swap"][i] = queue_swap
+        buffer["queue_charge"][i] = queue_charge
+        buffer["swap_status"][i] = SWAP_STATUS.get(station.status, -1)
+        if len(self.modules) > 0:
+            buffer["module_power"][i] = [m.power if m.link_to != 0 else 0 for m in self.modules]
+            buffer["module_current"][i] = [m.output_current if m.link_to != 0 else 0 for m in self.modules]
+            buffer["module_link"][i] = [m.link_to for m in self.modules]
+        if len(self.racks) > 0:
+            buffer["rack_soc"][i] = [br.battery.soc if br.battery is not None else np.nan for br in self.racks]
+        if len(self.piles) > 0:
+            buffer["pile_status"][i] = [PILE_STATUS.get(pile.status, -1) for pile in self.piles]
+            buffer["pile_soc"][i] = [pile.vehicle_battery.soc if pile.vehicle_battery is not None else np.nan for pile in self.piles]
+        self.count += 1
+        if self.count == self.chunk_ticks:
+            self.flush()
+
+    def flush(self):
+        '''
+        hand the buffered ticks over to the writer thread
+        '''
+        if self.count == 0:
+            return
+        if self.error is not None:
+            raise self.error
+        chunk = {name: column[:self.count] for name, column in self.buffer.items()}
+        self.chunks.put(chunk)
+        self.buffer = self.create_buffer()
+        self.count = 0
+
+    def write_chunks(self):
+        '''
+        writer thread: compress and append the chunks (zlib releases the GIL), None ends the thread
+        '''
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                entry = {"ticks": len(chunk["tick"]), "columns": {}}
+                for name, column in chunk.items():
+                    data = np.ascontiguousarray(column).tobytes()
+                    if self.compress:
+                        data = zlib.compress(data, 1)
+                    self.file.write(data)
+                    entry["columns"][name] = [self.offset, len(data)]
+                    self.offset += len(data)
+                self.index.append(entry)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        '''
+        write the remaining ticks and the index, wait for the writer thread
+        '''
+        self.flush()
+        self.chunks.put(None)
+        self.writer.join()
+        if self.error is not None:
+            self.file.close()
+            raise self.error
+        header = {
+            "version": STATE_VERSION,
+            "compression": "zlib" if self.compress else "none",
+            "layout": self.layout,
+            "columns": {name: [dtype, width] for name, (dtype, width) in self.columns.items()},
+            "chunks": self.index,
+        }
+        data = json.dumps(header).encode("utf-8")
+        self.file.write(data)
+        self.file.write(struct.pack("<Q", len(data)))
+        self.file.write(MAGIC)
+        self.file.close()
+
+class State_Reader():
+    '''
+    reader of a state trace file, the file is memory mapped and only the requested columns of the
+    requested chunks are decompressed, long traces can be analyzed chunk by chunk
+    '''
+    def __init__(self, path : str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        tail = len(MAGIC) + 8
+        if self.map[:len(MAGIC)] != MAGIC or self.map[-len(MAGIC):] != MAGIC:
+            self.close()
+            raise ValueError("%s is not a complete state trace file" % path)
+        length = struct.unpack("<Q", self.map[-tail:-len(MAGIC)])[0]
+        header = json.loads(self.map[-tail - length:-tail].decode("utf-8"))
+        self.compression = header["compression"]
+        self.layout = header["layout"]
+        self.columns = {name: (dtype, width) for name, (dtype, width) in header["columns"].items()}
+        self.chunks = header["chunks"]
+        self.chunk_start = np.cumsum([0] + [chunk["ticks"] for chunk in self.chunks])
+
+    def __len__(self):
+        return int(self.chunk_start[-1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def get_chunk(self, index : int, name : str):
+        '''
+        return the column name of chunk index as numpy array (read only view of the map for uncompressed files)
+        '''
+        dtype, width = self.columns[name]
+        offset, nbytes = self.chunks[index]["columns"][name]
+        if self.compression == "zlib":
+            data = np.frombuffer(zlib.decompress(self.map[offset:offset + nbytes]), dtype=dtype)
+        else:
+            data = np.frombuffer(self.map, dtype=dtype, count=nbytes // np.dtype(dtype).itemsize, offset=offset)
+        if width is not None:
+            data = data.reshape(-1, width)
+        return data
+
+    def iter_chunks(self, names = None):
+        '''
+        generator of dicts column name -> array, one per chunk
+        '''
+        if names is None:
+            names = list(self.columns.keys())
+        for index in range(len(self.chunks)):
+            yield {name: self.get_chunk(index, name) for name in names}
+
+    def read(self, name : str, start = 0, stop = None):
+        '''
+        return the column name of the ticks [start, stop) (index of the recorded ticks),
+        only the chunks overlapping the range are read
+        '''
+        if stop is None or stop > len(self):
+            stop = len(self)
+        parts = []
+        for index in range(len(self.chunks)):
+            chunk_start = int(self.chunk_start[index])
+            chunk_stop = int(self.chunk_start[index + 1])
+            if chunk_stop <= start or chunk_start >= stop:
+                continue
+            data = self.get_chunk(index, name)
+            parts.append(data[max(start - chunk_start, 0):min(stop, chunk_stop) - chunk_start])
+        if len(parts) == 0:
+            dtype, width = self.columns[name]
+            return np.zeros((0,) if width is None else (0, width), dtype=dtype)
+        return np.concatenate(parts)
+
+def create_state_recorder(param : dict, station):
+    '''
+    param["state_trace_file"] given -> State_Recorder of the station, otherwise None
+    '''
+    path = param.get("state_trace_file")
+    if path is None:
+        return None
+    return State_Recorder(path, station)
@@ -0,0 +1,142 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# snapshot of a running simulation for checkpointing and forking
+# the station (racks, batteries, connection_maps, piles, swap timer, grid interaction
+# counters), the waiting queues, the serviced users and the random streams are
+# pickled into one zlib compressed binary blob. Objects shared between the station
+# and the users (e.g. the battery of a vehicle at a charge pile) stay shared, the
+# tables of Global_Constant are not part of the snapshot (see swap.Battery).
+# Every restore creates an independent copy of the state, so one snapshot (e.g. the
+# station at 6 AM) is the common start of any number of what-if branches.
+# Trace files are not continued by a restored run.
+###################################################################################
+import os
+import zlib
+import queue
+import pickle
+import random
+import logging
+import numpy as np
+import main
+import users
+
+logger = logging.getLogger('main.snapshot')
+
+SNAPSHOT_VERSION = 3
+COMPRESS_LEVEL = 1                                              # fast compression, the pickle is mainly repeated object structure
+
+class Snapshot_Error(Exception):
+    '''
+    snapshot file of another version or not readable
+    '''
+    pass
+
+class Sim_Snapshot():
+    '''
+    compressed state of a simulation run
+    data: zlib compressed pickle of {"version", "param", "tick", "station", "sim_state", "user_dist_lst", "user_label",
+          "random_state", "extra"}
+    tick: next tick to be simulated
+    '''
+    def __init__(self, data : bytes, tick : int):
+        self.data = data
+        self.tick = tick
+
+    def save(self, path : str):
+        '''
+        write the snapshot file atomically (a crash while writing keeps the previous snapshot)
+        '''
+        temp_path = path + ".%d.tmp" % os.getpid()
+        with open(temp_path, "wb") as f:
+            pickle.dump({"version": SNAPSHOT_VERSION, "tick": self.tick, "data": self.data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    def restore(self):
+        '''
+        return a new independent copy of the run: dict {"param", "tick", "station", "sim_state", "user_dist_lst",
+        "user_label", "extra"}, the global random state of a run without seed is set back to the snapshot
+        '''
+        try:
+            content = pickle.loads(zlib.decompress(self.data))
+        except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+            raise Snapshot_Error("snapshot can not be read: %s" % e)
+        if content.get("version") != SNAPSHOT_VERSION:
+            raise Snapshot_Error("snapshot version %s is not supported" % content.get("version"))
+        sim_state = content["sim_state"]
+        for name in ["swap_queue", "charge_queue"]:
+            waiting = queue.Queue()
+            for user in sim_state[name]:
+                waiting.put(user)
+            sim_state[name] = waiting
+        if content["random_state"] is not None:
+            random.setstate(content["random_state"][0])
+            np.random.set_state(content["random_state"][1])
+        run = {name: content[name] for name in ["param", "tick", "station", "sim_state", "user_dist_lst", "user_label", "extra"]}
+        return run
+
+    def fork(self, seed = None):
+        '''
+        restore a branch of the run
+        seed: new seed of the SOC and preference sampling of the users arriving after the snapshot
+              (the arrivals of the day are kept), None -> same random streams as the original run
+        '''
+        run = self.restore()
+        if seed is not None:
+            run["sim_state"]["rng_streams"] = users.create_rng_streams(seed)
+            run["param"]["seed"] = seed
+        return run
+
+def take_snapshot(param : dict, station, sim_state : dict, user_dist_lst : list, user_label : list, tick : int, extra = None):
+    '''
+    snapshot of the run before tick (see main.do_simulation for the arguments)
+    extra: additional picklable state of the caller, e.g. the day KPIs of horizon
+    '''
+    state = dict(sim_state)
+    state["swap_queue"] = list(sim_state["swap_queue"].queue)   # queue.Queue holds locks and can not be pickled
+    state["charge_queue"] = list(sim_state["charge_queue"].queue)
+    state["trace"] = None
+    state["state_trace"] = None
+    random_state = None
+    if sim_state["rng_streams"] is None:                        # run without seed uses the global random state
+        random_state = (random.getstate(), np.random.get_state())
+    content = {"version": SNAPSHOT_VERSION, "param": param, "tick": tick, "station": station, "sim_state": state,
+               "user_dist_lst": user_dist_lst, "user_label": user_label, "random_state": random_state, "extra": extra}
+    data = zlib.compress(pickle.dumps(content, protocol=pickle.HIGHEST_PROTOCOL), COMPRESS_LEVEL)
+    return Sim_Snapshot(data, tick)
+
+def load_snapshot(path : str):
+    '''
+    read a snapshot file written by Sim_Snapshot.save
+    '''
+    try:
+        with open(path, "rb") as f:
+            content = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError) as e:
+        raise Snapshot_Error("snapshot file %s can not be read: %s" % (path, e))
+    if not isinstance(content, dict) or content.get("version") != SNAPSHOT_VERSION:
+        raise Snapshot_Error("snapshot file %s is not supported" % path)
+    return Sim_Snapshot(content["data"], content["tick"])
+
+def simulate_until(param : dict, tick : int):
+    '''
+    simulate the day of param (see main.do_simulation) until tick, return the snapshot before tick
+    e.g. simulate_until(param, int(6 * 3600 / param["sim_interval"])) -> station at 6 AM
+    '''
+    station, sim_state, user_dist_lst, user_label = main.init_simulation(param)
+    main.do_simulation_loop(param, station, sim_state, user_dist_lst, user_label, tick, param["sim_interval"])
+    if sim_state["trace"] is not None:
+        sim_state["trace"].close()
+    if sim_state["state_trace"] is not None:
+        sim_state["state_trace"].close()
+    return take_snapshot(param, station, sim_state, user_dist_lst, user_label, tick)
+
+def resume_simulation(run : dict):
+    '''
+    simulate a restored run (Sim_Snapshot.restore / fork) until the end of the day
+    return the result tuple of main.do_simulation, identical to the uninterrupted run
+    '''
+    param = run["param"]
+    main.do_simulation_loop(param, run["station"], run["sim_state"], run["user_dist_lst"], run["user_label"],
+                            param["sim_ticks"] - run["tick"], param["sim_interval"], run["tick"])
+    return main.get_results(param, run["station"], run["sim_state"], run["user_dist_lst"])
@@ -14,6 +14,8 @@
 ###########################
 
 ### 外部库调用 ###
+import bisect
+import functools
 import numpy as np
 import math
 import logging
@@ -27,6 +29,66 @@ GC = global_param.Global_Constant()
 logger = logging.getLogger('main.swap')
 data_logger = logging.getLogger('data.swap')
 
+######################################################################
+####################### Class: Charge_History ########################
+######################################################################
+
+class Charge_History:
+
+    dtype = np.dtype([("soc", np.float64), ("voltage", np.float32), ("current", np.float64),
+                      ("temperature", np.int16), ("timer", np.int32)])
+
+    def __init__(self, capacity = 64):
+        '''
+        Columnar charge/discharge record of one battery, replaces the list of dicts per tick
+        the records are saved in a growable structured numpy buffer (capacity doubled when full),
+        the buffer is allocated at the first record, so batteries that never get charged cost nothing
+        len() returns the number of records -> same semantic as the former list (User.charge_service_time)
+        '''
+        self.init_capacity = capacity
+        self.buffer = None
+        self.length = 0
+
+    def append(self, soc, voltage, current, temperature, timer):
+        '''
+        add one record at the end of the history
+        '''
+        if self.buffer is None:
+            self.buffer = np.empty(self.init_capacity, dtype=self.dtype)
+        elif self.length == len(self.buffer):
+            new_buffer = np.empty(2 * len(self.buffer), dtype=self.dtype)
+            new_buffer[:self.length] = self.buffer
+            self.buffer = new_buffer
+        self.buffer[self.length] = (soc, voltage, current, temperature, timer)
+        self.length += 1
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        '''
+        int index -> record as dict {soc, voltage, current, temperature, timer} (format of the former list)
+        column name -> numpy array of this column, slice -> structured numpy array
+        '''
+        if isinstance(key, str):
+            return self.to_array()[key]
+        if isinstance(key, slice):
+            return self.to_array()[key]
+        record = self.to_array()[key]
+        return {name: record[name].item() for name in self.dtype.names}
+
+    def __iter__(self):
+        for k in range(self.length):
+            yield self[k]
+
+    def to_array(self):
+        '''
+        return the valid part of the buffer as structured numpy array (view, no copy)
+        '''
+        if self.buffer is None:
+            return np.empty(0, dtype=self.dtype)
+        return self.buffer[:self.length]
+
 ######################################################################
 ####################### Class: Battery ###############################
 ######################################################################
@@ -48,31 +110,10 @@ class Battery:
         Note:   1-3 cannot combine with 4,5 -> not swapable
                 if No Data avaiable, by default we use data from 100kWh
         '''
-        self.charge_limit_100 = GC.charge_limit_100
-        self.charge_limit_75 = GC.charge_limit_75
-        self.charge_limit_70 = GC.charge_limit_70
-        self.ocv_100 = GC.ocv_100
-        self.ocv_70 = GC.ocv_70
-        battery_charge_limit={  
-            "70kWh": self.charge_limit_70,
-            "75kWh": self.charge_limit_75,
-            "100kWh": self.charge_limit_100,
-            "FY41kWh": self.charge_limit_100,
-            "FY62kWh": self.charge_limit_100
-                            }
-        self.battery_capacity = GC.battery_capacity                     # battery capacity [Ah]
         self.batterytype = batterytype                                  # string -> 70kWh, 100kWh, 75kWh..
-        
-        if batterytype in self.battery_capacity:
-            self.capacity = self.battery_capacity[batterytype]          # 返回电池Ah数 return int
-            self.charge_limit = battery_charge_limit[batterytype]       # 返回充电限制 dict
-        else:
-            '''
-            if No batteries type are found, return default setup (100kWh Batteries)
-            '''
+        if batterytype not in GC.battery_capacity:
             print("No such battery type, using default type 100kWh")
-            self.capacity = self.battery_capacity["100kWh"]
-            self.charge_limit = battery_charge_limit["100kWh"]
+        self.link_tables()
         
         self.soc = soc
         self.set_temperature(temperature)                               # 缺省电池温度为25度
@@ -86,10 +127,53 @@ class Battery:
         self.power = 0
         self.current = 0
 
-        self.charge_history = []                                        #按照{soc:???,voltage:???,current:???,temperature:???,timer:} 组成一个列表，记录这块电池在仿真周期中被充电的过程
+        self.charge_history = Charge_History()                          #按照soc,voltage,current,temperature,timer 组成的列式记录，记录这块电池在仿真周期中被充电的过程
         self.charge_start_time = -1                                     #记录t_timer的时间，表明这块电池从什么时候开始被充电 -1 表明还没有被充电
         self.charge_end_time = -1                                       #记录t_timer的时间，表明这块电池从什么时候开始停止充电
 
+    def link_tables(self):
+        '''
+        link the battery data of Global_Constant, the tables are shared by all batteries of the process
+        if No batteries type are found, return default setup (100kWh Batteries)
+        '''
+        self.charge_limit_100 = GC.charge_limit_100
+        self.charge_limit_75 = GC.charge_limit_75
+        self.charge_limit_70 = GC.charge_limit_70
+        self.ocv_100 = GC.ocv_100
+        self.ocv_70 = GC.ocv_70
+        battery_charge_limit={  
+            "70kWh": self.charge_limit_70,
+            "75kWh": self.charge_limit_75,
+            "100kWh": self.charge_limit_100,
+            "FY41kWh": self.charge_limit_100,
+            "FY62kWh": self.charge_limit_100
+                            }
+        battery_charge_limit_lut={  
+            "70kWh": GC.charge_limit_lut_70,
+            "75kWh": GC.charge_limit_lut_75,
+            "100kWh": GC.charge_limit_lut_100,
+            "FY41kWh": GC.charge_limit_lut_100,
+            "FY62kWh": GC.charge_limit_lut_100
+                            }
+        self.battery_capacity = GC.battery_capacity                     # battery capacity [Ah]
+        batterytype = self.batterytype if self.batterytype in self.battery_capacity else "100kWh"
+        self.capacity = self.battery_capacity[batterytype]              # 返回电池Ah数 return int
+        self.charge_limit = battery_charge_limit[batterytype]           # 返回充电限制 dict
+        self.charge_limit_lut = battery_charge_limit_lut[batterytype]   # 充电限制查找表 dict, see global_param.compile_charge_limit
+
+    def __getstate__(self):
+        # the tables of Global_Constant are not pickled, they are linked again when the battery is unpickled
+        state = self.__dict__.copy()
+        for name in ["charge_limit_100", "charge_limit_75", "charge_limit_70", "ocv_100", "ocv_70", "battery_capacity", "charge_limit", "charge_limit_lut"]:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.link_tables()
+        if self.temperature not in self.charge_limit_lut:      # interpolated temperature bucket of another process
+            global_param.add_charge_limit_bucket(self.charge_limit, self.charge_limit_lut, self.temperature, GC.limit_axis, GC.limit_resolution)
+
     def battery_charge(self, current, timer, interval):
         # current is the charging current within small period of time, the time period defined as interval
         if self.charge_start_time == -1:
@@ -108,8 +192,7 @@ class Battery:
         self.set_battery_voltage()
 
         self.power = self.battery_voltage * current / 1000.0 # return kWh
-        temp = {"soc": self.soc, "voltage": self.battery_voltage, "current": current, "temperature": self.temperature, "timer": timer}
-        self.charge_history.append(temp)
+        self.charge_history.append(self.soc, self.battery_voltage, current, self.temperature, timer)
         self.current = current
         return
 
@@ -135,8 +218,7 @@ class Battery:
         # process 4: calculate the power (negative value means give the power out of the battery)
         self.power = (-1) * self.battery_voltage * current / 1000.0 # return kWh
         # process 5: log the data
-        temp = {"soc": self.soc, "voltage": self.battery_voltage, "current": current, "temperature": self.temperature, "timer": timer}
-        self.charge_history.append(temp)
+        self.charge_history.append(self.soc, self.battery_voltage, current, self.temperature, timer)
         self.current = current
 
     def set_battery_voltage(self):
@@ -160,10 +242,18 @@ class Battery:
             self.battery_voltage = self.ocv_100[cal_soc]
             return
 
-    def set_temperature(self, real_temperature):
+    def set_temperature(self, real_temperature, interpolate = False):
         '''
         set the simulation temperature (closest to real temperature)
-        '''
+        interpolate: True -> temperature rounded to 1 degree, the charge limit of a not measured temperature is
+                     interpolated between the measured rows (global_param.add_charge_limit_bucket)
+        '''
+        if interpolate:
+            temp = int(round(real_temperature))
+            if temp not in self.charge_limit_lut:
+                global_param.add_charge_limit_bucket(self.charge_limit, self.charge_limit_lut, temp, GC.limit_axis, GC.limit_resolution)
+            self.temperature = temp
+            return
         test_temperature = [-20, -10, 0, 10, 20, 25, 30, 40]
         diff_min = abs(test_temperature[0] - real_temperature)
         temp = test_temperature[0]
@@ -180,33 +270,27 @@ class Battery:
     def calc_current_limit(self): 
         '''
         calculate the maximal current under the given SOC
+        constant time lookup in the compiled charge limit table: the SOC cell gives the segment of limit_axis,
+        at a breakpoint the table value is returned, in between linear interpolation
         '''
         check_soc = self.soc
         if check_soc < 0.05:
             check_soc = 0.05
         if check_soc > 0.95:
             check_soc = 0.95
-        if self.limit_axis.count(check_soc) > 0:
-                   
-            self.current_command = self.charge_limit[self.temperature][self.limit_axis.index(check_soc)]
+        cell, value, delta_c, delta_soc = self.charge_limit_lut[self.temperature]
+        axis = self.limit_axis
+        k = cell[int(check_soc * GC.limit_resolution)]
+        # correct the segment if check_soc * resolution was rounded across a breakpoint
+        if check_soc < axis[k]:
+            k -= 1
+        elif k + 1 < len(axis) and check_soc >= axis[k + 1]:
+            k += 1
+        if check_soc == axis[k]:
+            self.current_command = value[k]
             return
-
-        for lim in self.limit_axis:
-            if lim > check_soc:
-                lim_index2 = self.limit_axis.index(lim)
-                lim_index1 = lim_index2 - 1
-                lim_num1 = self.limit_axis[lim_index1]
-                lim_num2 = self.limit_axis[lim_index2]               
-                # print("index1 = ",lim_index1,"index2 = ",lim_index2)
-                # print("lim_current1 = ",self.charge_limit[temperature][lim_index1])
-                # print("lim_current2 = ",self.charge_limit[temperature][lim_index2])
-                # print("lim_soc1 = ",lim_num1)
-                # print("lim_soc2 = ",lim_num2)
-                cur_limit =(check_soc - lim_num1) * (self.charge_limit[self.temperature][lim_index2] - self.charge_limit[self.temperature][lim_index1]) / (lim_num2 - lim_num1)
-                cur_limit = cur_limit + self.charge_limit[self.temperature][lim_index1]
-                # print("Cur_limit = ",cur_limit)
-                self.current_command = cur_limit 
-                return
+        self.current_command = (check_soc - axis[k]) * delta_c[k] / delta_soc[k] + value[k]
+        return
 
     def request_power(self, current_limit = -1):
         '''
@@ -259,7 +343,21 @@ class Power_Module:
             self.output_voltage = 1000.0 * self.power / self.output_current
             self.status = "in_use"
         return
-    
+
+    def curtail_power(self, power, battery_voltage):
+        '''
+        reduce the output of the module to power [kW] (station power cap), the output current is recalculated
+        from power = (battery_voltage + current * line_resistance) * current
+        '''
+        self.output_current = -1 * battery_voltage + math.sqrt(battery_voltage **2 + 4 * self.line_resistance * power * 1000)
+        self.output_current = self.output_current / 2 / self.line_resistance
+        self.power = power
+        if self.output_current > 0:
+            self.output_voltage = 1000.0 * self.power / self.output_current
+        else:
+            self.output_voltage = battery_voltage
+        return
+
     ################################################################################
     ######################## Modified by Y.Meng ####################################
     ################################################################################
@@ -565,6 +663,190 @@ class Charge_Pile:
             self.status = "charging"
             return
 
+######################################################################
+####################### Class: Connection_Map ########################
+######################################################################
+
+class Connection_Map(list):
+    '''
+    connection_map of a swap rack (see Swap_Rack) with a reverse index equipment id -> module indices
+    the forward list keeps the fast element access of a list, every assignment updates the reverse index,
+    therefore count() and get_modules() do not scan the map. The module number is fixed.
+    '''
+    def __init__(self, module_map = ()):
+        super().__init__(int(equipment_id) for equipment_id in module_map)
+        self.equipment_modules = {}                 # equipment id -> ascending list of module indices
+        for i, equipment_id in enumerate(self):
+            self.equipment_modules.setdefault(equipment_id, []).append(i)
+
+    def __setitem__(self, index, equipment_id):
+        if isinstance(index, slice):
+            values = list(self)
+            values[index] = equipment_id
+            if len(values) != len(self):
+                raise ValueError("connection_map: module number can not be changed")
+            for i, value in enumerate(values):
+                self[i] = value
+            return
+        if index < 0:
+            index += len(self)
+        old_id = list.__getitem__(self, index)
+        if old_id == equipment_id:
+            return
+        list.__setitem__(self, index, equipment_id)
+        modules = self.equipment_modules[old_id]
+        modules.remove(index)
+        if len(modules) == 0:
+            del self.equipment_modules[old_id]
+        modules = self.equipment_modules.get(equipment_id)
+        if modules is None:
+            self.equipment_modules[equipment_id] = [index]
+        else:
+            bisect.insort(modules, index)
+
+    def count(self, equipment_id):
+        modules = self.equipment_modules.get(equipment_id)
+        if modules is None:
+            return 0
+        return len(modules)
+
+    def get_modules(self, equipment_id):
+        '''
+        return the ascending indices of the modules connected to equipment_id
+        '''
+        return list(self.equipment_modules.get(equipment_id, ()))
+
+    def get_equipment_list(self):
+        '''
+        return the connected equipment ids (without 0) in the order of their first module
+        '''
+        return [equipment_id for first_module, equipment_id in
+                sorted((modules[0], equipment_id) for equipment_id, modules in self.equipment_modules.items() if equipment_id != 0)]
+
+    def __reduce__(self):
+        return (Connection_Map, (list(self),))
+
+    def fixed_size(self, *args, **kwargs):
+        raise TypeError("connection_map: module number can not be changed")
+
+    append = extend = insert = pop = remove = clear = sort = reverse = fixed_size
+    __delitem__ = __iadd__ = __imul__ = fixed_size
+
+######################################################################
+################ Optimal power module allocation #####################
+######################################################################
+PRIORITY_WEIGHT = 1e-3              # tie break of equal power: piles first, then the rack batteries closest to select_soc
+DEMAND_RESOLUTION = 5               # [kW] resolution of the power demand, coarser demand -> fewer re-plans and more memorized solutions
+
+def get_demand_level(power_command):
+    '''
+    power demand [kW] rounded down to DEMAND_RESOLUTION, input of the optimal allocation
+    '''
+    return int(power_command // DEMAND_RESOLUTION) * DEMAND_RESOLUTION
+
+def get_module_gain(demand, module_power, k):
+    '''
+    expected additional output [kW] of the k-th module connected to an equipment with power demand [kW]
+    '''
+    return min(demand, k * module_power) - min(demand, (k - 1) * module_power)
+
+@functools.lru_cache(maxsize=65536)
+def solve_module_allocation(pair_demand : tuple, pile_demand : tuple, module_power, power_cap = None):
+    '''
+    optimal allocation of the power modules of one power cabinet (power_dist_option "Optimal")
+    the racks of a module pair (even module 2k, odd module 2k+1) can only use the modules of their pair,
+    the charge piles can use every module. The allocation maximizes the expected output power
+    (= delivered charging energy of the tick), weighted with a small priority tie break.
+    Exact solution: dynamic programming over the module pairs with the number of modules released to the
+    piles as state, the piles share the released modules greedily by marginal gain (concave gains -> optimal).
+    pair_demand:    tuple per module pair (number of modules, tuple per rack of the pair (max modules, demand [kW], priority))
+    pile_demand:    tuple per pile (max modules, demand [kW], priority)
+    module_power:   max power of one module [kW]
+    power_cap:      upper limit of the expected output [kW], None -> no limit
+    return (tuple per pair of the module numbers of its racks, tuple of the module numbers per pile)
+    the solution is memorized, repeated states are solved once
+    '''
+    priority_num = 1 + max([rack[2] for pair in pair_demand for rack in pair[1]] + [pile[2] for pile in pile_demand] + [0])
+
+    def weight(priority):
+        return 1 + PRIORITY_WEIGHT * priority / priority_num
+
+    # marginal gains of the piles, shared greedily
+    pile_gains = []
+    for pile_idx, (max_modules, demand, priority) in enumerate(pile_demand):
+        for k in range(1, max_modules + 1):
+            gain = get_module_gain(demand, module_power, k)
+            if gain > 0:
+                pile_gains.append((-1 * gain * weight(priority), pile_idx, k, gain))
+    pile_gains.sort()
+    pile_value = [0.0]
+    for item in pile_gains:
+        pile_value.append(pile_value[-1] - item[0])
+
+    # dynamic programming over the module pairs, state: number of modules released to the piles
+    states = {0: (0.0, ())}
+    for module_num, racks in pair_demand:
+        # best option of the pair for every number of released modules
+        rack_value = []
+        for max_modules, demand, priority in racks:
+            cumulated = [0.0]
+            for k in range(1, min(max_modules, module_num) + 1):
+                cumulated.append(cumulated[-1] + get_module_gain(demand, module_power, k) * weight(priority))
+            rack_value.append(cumulated)
+        pair_options = {}
+        options = [()]
+        for cumulated in rack_value:
+            options = [option + (k,) for option in options for k in range(len(cumulated))]
+        for option in options:
+            used = sum(option)
+            if used > module_num:
+                continue
+            option_value = sum(cumulated[k] for cumulated, k in zip(rack_value, option))
+            if module_num - used not in pair_options or option_value > pair_options[module_num - used][0]:
+                pair_options[module_num - used] = (option_value, option)
+        new_states = {}
+        for released, (value, choice) in states.items():
+            for pair_released, (option_value, option) in pair_options.items():
+                key = released + pair_released
+                if key not in new_states or value + option_value > new_states[key][0]:
+                    new_states[key] = (value + option_value, choice + (option,))
+        states = new_states
+
+    best = None
+    for released in sorted(states.keys()):
+        value, choice = states[released]
+        value += pile_value[min(released, len(pile_gains))]
+        if best is None or value > best[0]:
+            best = (value, released, choice)
+    value, released, rack_allocation = best
+    pile_allocation = [0] * len(pile_demand)
+    for item in pile_gains[:released]:
+        pile_allocation[item[1]] += 1
+
+    # power cap: release the modules with the smallest weighted gain
+    if power_cap is not None:
+        rack_allocation = [list(option) for option in rack_allocation]
+        units = []                                                      # (weighted gain, -k, (pair, rack) or pile index, gain)
+        for pair_idx, ((module_num, racks), option) in enumerate(zip(pair_demand, rack_allocation)):
+            for rack_idx, ((max_modules, demand, priority), k) in enumerate(zip(racks, option)):
+                for j in range(1, k + 1):
+                    gain = get_module_gain(demand, module_power, j)
+                    units.append((gain * weight(priority), -1 * j, (pair_idx, rack_idx), gain))
+        for weighted_gain, pile_idx, k, gain in pile_gains[:released]:
+            units.append((-1 * weighted_gain, -1 * k, pile_idx, gain))
+        total_power = sum(unit[3] for unit in units)
+        units.sort(key=lambda unit: (unit[0], unit[1]))
+        for weighted_gain, order, index, gain in units:
+            if total_power <= power_cap:
+                break
+            if isinstance(index, tuple):
+                rack_allocation[index[0]][index[1]] -= 1
+            else:
+                pile_allocation[index] -= 1
+            total_power -= gain
+        rack_allocation = [tuple(option) for option in rack_allocation]
+    return tuple(rack_allocation), tuple(pile_allocation)
+
 ######################################################################
 ####################### Class: Swap_Rack #############################
 ######################################################################
@@ -587,6 +869,9 @@ class Swap_Rack:
         self.set_sr_temperature()                   # 缺省仓内温度和外部温度为25度
         self.charge_power_redist_trigger = param["charge_power_redist"] # bool
         self.power_dist_option = param["power_dist_option"] # "PSS prefered" or "PSC prefered"
+        self.equipment_state_memo = {}              # memorized plan relevant state of racks and piles, see get_equipment_state
+        self.plan_signature = None                  # plan signature of the last fixed point of the power distribution, see power_distribution
+        self.power_cap = None                       # upper limit of the cabinet output [kW] for power_dist_option "Optimal", None -> no limit
 
         # For PSS 2.0
         if station_type == "GEN2_530":
@@ -699,11 +984,22 @@ class Swap_Rack:
             cm = np.zeros(int(param["station_type"]["max_charger_number"]))
             self.connection_map = list([int(s) for s in cm])
 
+        self.connection_map = Connection_Map(self.connection_map)  # keep the reverse index equipment -> modules
+
+    def __getstate__(self):
+        # the memo is keyed by id(), the ids are not valid in the unpickled station
+        state = self.__dict__.copy()
+        state["equipment_state_memo"] = {}
+        return state
+
 
-    def set_temperature(self, real_temp):
+    def set_temperature(self, real_temp, interpolate = False):
         '''
         set simulation temperature (setup test temp that closest to the real temp)
+        interpolate: True -> real temp rounded to 1 degree (see Battery.set_temperature)
         '''
+        if interpolate:
+            return int(round(real_temp))
         test_list_dict = [-20,-10,0,10,20,25,30,40]
         diff_min = abs(test_list_dict[0] - real_temp)
         temp = test_list_dict[0]
@@ -715,22 +1011,23 @@ class Swap_Rack:
                     diff_min = diff
         return temp
 
-    def set_sr_temperature(self, rack_temperature = 25, external_temperature = 25):
+    def set_sr_temperature(self, rack_temperature = 25, external_temperature = 25, interpolate = False):
         '''
         set swap rack temp = 25 (real)
         set external temp = 25 (real)
         set batteries temp (in rack) = rack temp
         set batteries on vehicles temp = external temp
+        interpolate: see Battery.set_temperature
         '''
-        self.rack_temperature = self.set_temperature(rack_temperature)
-        self.external_temperature = self.set_temperature(external_temperature)
+        self.rack_temperature = self.set_temperature(rack_temperature, interpolate)
+        self.external_temperature = self.set_temperature(external_temperature, interpolate)
         for rack in self.battery_rack_list:
             if isinstance(rack.battery, Battery):
-                rack.battery.set_temperature(rack_temperature)
+                rack.battery.set_temperature(rack_temperature, interpolate)
         if self.charge_pile_list is not None:
             for pile in self.charge_pile_list:
                 if isinstance(pile.vehicle_battery, Battery): 
-                    pile.vehicle_battery.set_temperature(external_temperature)
+                    pile.vehicle_battery.set_temperature(external_temperature, interpolate)
         return
 
     def load_battery(self, battery : Battery, position = -1):
@@ -949,7 +1246,7 @@ class Swap_Rack:
                 # after arrangement if residual num still > 0 -> reconnect rack power module with min soc to the PSC
                 if module_num > 0:
                     rack_idx = self.get_min_soc_rack_index(rack_soc_list)
-                    map_idx = [x for x,y in list(enumerate(self.connection_map)) if y == rack_idx+1]
+                    map_idx = self.connection_map.get_modules(rack_idx + 1)
                     self.stop_charge(rack_idx)
                     for i in map_idx:
                         self.connection_map[i] = ((-1) * pile.id - 1)
@@ -1424,48 +1721,184 @@ class Swap_Rack:
         for equipment_id in self.connection_map:
             if equipment_id > 0:                                # 如果是电池内部的equipment
                 self.start_discharge(equipment_id - 1)
+        self.plan_signature = None
         return
 
+    def power_distribution_optimal(self):
+        '''
+        power_dist_option "Optimal": allocate the power modules with solve_module_allocation
+        规则 1: 换电站内电池SOC达到select_soc / 车辆电池达到target_soc就停止充电并释放充电模块
+        规则 2: 电池架只能使用本仓和相邻仓(偶数仓N与N+1)的模块，充电桩可以使用所有模块
+        规则 3: 在power_cap限制下使期望输出功率(本周期充电能量)最大，功率相同时优先充电桩，然后优先SOC最接近select_soc的电池
+        unlike the heuristics the modules of a charging pile are re-planned as well
+        '''
+        if self.power_cabinet is None: #如果这个电池仓没有功率柜
+            if(self.station_type != "GEN3_600"):
+                logger.debug('no power cabinet connected')
+            return
+
+        # ======================================================================================
+        # ================= Part 1: Release finished racks and piles ===========================
+        # ======================================================================================
+        for rack in self.battery_rack_list:
+            if rack.battery is None:
+                if rack.status != "free":
+                    rack.remove_battery()
+            elif rack.battery.soc >= self.select_soc and rack.plug == 1:
+                rack.plug_out()
+        if self.charge_pile_list is not None:
+            for pile in self.charge_pile_list:
+                if isinstance(pile.vehicle_battery, Battery) and pile.vehicle_battery.soc >= self.target_soc:
+                    self.vehicle_leave(pile.id)
+
+        # ======================================================================================
+        # ================= Part 2: Demand of racks and piles, solve the allocation ============
+        # ======================================================================================
+        module_number = len(self.connection_map)
+        rack_demand = []
+        for i, rack in enumerate(self.battery_rack_list):
+            demand = (0, 0, 0)
+            if i < module_number and isinstance(rack.battery, Battery) and rack.battery.soc < self.select_soc:
+                module_num = self.module_number_check(rack.battery, current_limit = 250)
+                if module_num > 0:
+                    demand = (module_num, get_demand_level(rack.battery.power_command), 0)
+            rack_demand.append(demand)
+        # priority: rank of the soc among the charging racks, piles above all racks
+        ranking = sorted([i for i, demand in enumerate(rack_demand) if demand[0] > 0], key=lambda i: (self.battery_rack_list[i].battery.soc, i))
+        for rank, i in enumerate(ranking):
+            rack_demand[i] = (rack_demand[i][0], rack_demand[i][1], rank)
+
+        pair_demand = []
+        for first in range(0, module_number, 2):
+            modules = [m for m in (first, first + 1) if m < module_number]
+            racks = tuple(rack_demand[m] for m in modules if m < len(rack_demand))
+            pair_demand.append((len(modules), racks))
+
+        pile_demand = []
+        if self.charge_pile_list is not None:
+            for pile in self.charge_pile_list:
+                demand = (0, 0, 0)
+                if isinstance(pile.vehicle_battery, Battery):
+                    module_num = self.module_number_check(pile.vehicle_battery, pile.max_current)
+                    if module_num > 0:
+                        demand = (module_num, get_demand_level(pile.vehicle_battery.power_command), len(ranking) + pile.id)
+                pile_demand.append(demand)
+
+        rack_allocation, pile_allocation = solve_module_allocation(tuple(pair_demand), tuple(pile_demand), self.power_cabinet.module_power, self.power_cap)
+
+        # ======================================================================================
+        # ================= Part 3: Build the connection_map ===================================
+        # ======================================================================================
+        new_map = [0] * module_number
+        pool = []                                                       # modules released to the piles
+        for pair_idx, option in enumerate(rack_allocation):
+            modules = [m for m in (2 * pair_idx, 2 * pair_idx + 1) if m < module_number]
+            free_modules = list(modules)
+            for m, k in zip(modules, option):                           # the own module first
+                if k > 0:
+                    new_map[m] = m + 1
+                    free_modules.remove(m)
+            for m, k in zip(modules, option):                           # the neighbour module for the second one
+                if k > 1:
+                    neighbour = free_modules.pop(0)
+                    new_map[neighbour] = m + 1
+            pool.extend(free_modules)
+        for pile_idx, k in enumerate(pile_allocation):                  # keep the modules already connected to the pile
+            pile_code = -1 * pile_idx - 1
+            for m in self.connection_map.get_modules(pile_code):
+                if k > 0 and m in pool:
+                    new_map[m] = pile_code
+                    pool.remove(m)
+                    k -= 1
+            for m in pool[:k]:
+                new_map[m] = pile_code
+            pool = pool[k:]
+        for i in range(module_number):
+            self.connection_map[i] = new_map[i]
+
+        # ======================================================================================
+        # ================= Part 4: Restart the power distribution and charging ================
+        # ======================================================================================
+        self.power_cabinet.config_module(self.connection_map)
+        self.stop_charge_all()
+        for equipment_id in self.connection_map:
+            if equipment_id > 0: #如果是电池内部的equipment
+                self.start_charge(equipment_id - 1)
+            if equipment_id < 0: #如果是外部充电桩的equipment
+                self.start_charge(equipment_id)
+
+    def power_distribution(self):
+        '''
+        incremental power distribution according to power_dist_option
+        the plan is a deterministic function of the plan signature (connection_map and the discrete state of
+        racks and piles, see get_plan_signature). If no rack or pile changed its state since the last plan and
+        the last plan reproduced its own input (fixed point), re-planning would give the identical connection_map,
+        therefore config_module and the stop/start cycle of all equipment are skipped.
+        '''
+        if self.power_cabinet is None:
+            return
+        signature = self.get_plan_signature()
+        if signature == self.plan_signature:
+            return
+        if self.power_dist_option == "PSS preferred":
+            self.power_distribution_pss_preferred()
+        elif self.power_dist_option == "Optimal":
+            self.power_distribution_optimal()
+        else:
+            self.power_distribution_psc_preferred()
+        new_signature = self.get_plan_signature()
+        if new_signature == signature:
+            self.plan_signature = signature
+        else:
+            self.plan_signature = None
+
     def do_charge(self, t_timer:int, interval = 1):
         '''
         excute the charging beheviours
         '''
-        charge_complete=[]
-        for i in range(len(self.connection_map)):
-            equipment_id = self.connection_map[i]
-            if charge_complete.count(equipment_id) == 0: # current equipment not counted in charge complet list
-                charger_array=[]
-                for j in range(len(self.connection_map)):
-                    if equipment_id == self.connection_map[j]:
-                        charger_array.append(j) # append connecting module index
-                
-                # for battery in PSS
-                if equipment_id > 0:
-                    rack_id = equipment_id - 1
-                    charge_battery = self.battery_rack_list[rack_id].battery
-                    module_num = len(charger_array)
-                    charge_battery.request_power(250)
-                    charger_current = charge_battery.current_command / module_num
-                    total_current = 0
-                    for t in charger_array:
-                        self.power_cabinet.module_list[t].output_power(charger_current, charge_battery.battery_voltage)
-                        total_current += self.power_cabinet.module_list[t].output_current
-                    charge_battery.battery_charge(total_current, t_timer, interval)                      
-                    charge_complete.append(equipment_id)
-
-                # for battery on charge piles
-                if equipment_id < 0:
-                    pile_id = equipment_id * -1 - 1
-                    charge_battery = self.charge_pile_list[pile_id].vehicle_battery
-                    module_num = len(charger_array)
-                    charge_battery.request_power(self.charge_pile_list[pile_id].max_current)
-                    charger_current = charge_battery.current_command / module_num
-                    total_current = 0
-                    for t in charger_array:
-                        self.power_cabinet.module_list[t].output_power(charger_current,charge_battery.battery_voltage)
-                        total_current = total_current + self.power_cabinet.module_list[t].output_current
-                    charge_battery.battery_charge(total_current,t_timer,interval)                      
-                    charge_complete.append(equipment_id)
+        for equipment_id in self.connection_map.get_equipment_list():
+            charger_array = self.connection_map.get_modules(equipment_id) # connecting module indices
+            self.charge_equipment(equipment_id, charger_array, t_timer, interval)
+
+    def charge_equipment(self, equipment_id, charger_array, t_timer:int, interval = 1):
+        '''
+        charge the battery of one rack (equipment_id > 0) or one charge pile (equipment_id < 0)
+        with the power modules in charger_array (module index list)
+        '''
+        charge_battery = self.output_equipment(equipment_id, charger_array)
+        self.charge_battery(charge_battery, charger_array, t_timer, interval)
+
+    def output_equipment(self, equipment_id, charger_array):
+        '''
+        request power of the battery of one rack / pile and set the output of its power modules,
+        return the battery in charge (first half of charge_equipment, the output can be curtailed before charge_battery)
+        '''
+        # for battery in PSS
+        if equipment_id > 0:
+            rack_id = equipment_id - 1
+            charge_battery = self.battery_rack_list[rack_id].battery
+            charge_battery.request_power(250)
+
+        # for battery on charge piles
+        if equipment_id < 0:
+            pile_id = equipment_id * -1 - 1
+            charge_battery = self.charge_pile_list[pile_id].vehicle_battery
+            charge_battery.request_power(self.charge_pile_list[pile_id].max_current)
+
+        module_num = len(charger_array)
+        charger_current = charge_battery.current_command / module_num
+        for t in charger_array:
+            self.power_cabinet.module_list[t].output_power(charger_current, charge_battery.battery_voltage)
+        return charge_battery
+
+    def charge_battery(self, charge_battery, charger_array, t_timer:int, interval = 1):
+        '''
+        charge the battery with the total output current of the power modules in charger_array
+        '''
+        total_current = 0
+        for t in charger_array:
+            total_current += self.power_cabinet.module_list[t].output_current
+        charge_battery.battery_charge(total_current, t_timer, interval)
     
     ################################################################################
     ######################## Modified by Y.Meng ####################################
@@ -1474,34 +1907,173 @@ class Swap_Rack:
         '''
         discharge the batteries from swap rack, send power back to grid
         '''
-        discharge_complete=[]
-        for i in range(len(self.connection_map)):
-            equipment_id = self.connection_map[i]
-            if discharge_complete.count(equipment_id) == 0:        # current equipment not counted in charge complet list
-                discharger_array=[]
-                for j in range(len(self.connection_map)):
-                    if equipment_id == self.connection_map[j]:
-                        discharger_array.append(j)                 # append connecting module index
-        
-                if equipment_id > 0:
-                    rack_id = equipment_id - 1
-                    if rack_id < len(self.battery_rack_list):
-                        discharge_battery = self.battery_rack_list[rack_id].battery
-                    module_num = len(discharger_array)
-                    discharge_battery.request_power(250)
-                    charger_current = discharge_battery.current_command / module_num
-                    total_current = 0
-                    for t in discharger_array:
-                        self.power_cabinet.module_list[t].grid_interactive_output_power(charger_current, discharge_battery.battery_voltage)
-                        total_current += self.power_cabinet.module_list[t].output_current
-                    discharge_battery.battery_discharge(total_current, t_timer, interval)                      
-                    discharge_complete.append(equipment_id)
+        for equipment_id in self.connection_map.get_equipment_list():
+            discharger_array = self.connection_map.get_modules(equipment_id) # connecting module indices
+            if equipment_id > 0:
+                rack_id = equipment_id - 1
+                if rack_id < len(self.battery_rack_list):
+                    discharge_battery = self.battery_rack_list[rack_id].battery
+                module_num = len(discharger_array)
+                discharge_battery.request_power(250)
+                charger_current = discharge_battery.current_command / module_num
+                total_current = 0
+                for t in discharger_array:
+                    self.power_cabinet.module_list[t].grid_interactive_output_power(charger_current, discharge_battery.battery_voltage)
+                    total_current += self.power_cabinet.module_list[t].output_current
+                discharge_battery.battery_discharge(total_current, t_timer, interval)                      
 
     def get_power_sr(self):
         if self.power_cabinet is None:
             return 0
         return self.power_cabinet.get_power_pc()
 
+    def get_equipment_state(self, equipment):
+        '''
+        return the discrete state of a battery rack or a charge pile, which the power distribution depends on
+        the battery SOC only enters through the stop threshold (select_soc / target_soc) and the allowable
+        number of power modules, the result is memorized and only recalculated once the battery SOC changes
+        '''
+        if isinstance(equipment, Battery_Rack):
+            battery = equipment.battery
+            threshold = self.select_soc
+            current_limit = 250
+            state = (equipment.status, equipment.plug)
+        else:
+            battery = equipment.vehicle_battery
+            threshold = self.target_soc
+            current_limit = equipment.max_current
+            state = (equipment.status,)
+        if battery is None:
+            return state
+
+        key = (battery.soc, battery.target_max_soc, battery.temperature)
+        memo = self.equipment_state_memo.get(id(equipment))
+        if memo is None or memo[0] is not battery or memo[1] != key:
+            if self.power_cabinet is not None:
+                module_num = self.module_number_check(battery, current_limit)
+            else:
+                module_num = 0
+            state_memo = (battery.soc >= threshold, module_num)
+            if self.power_dist_option == "Optimal":             # the optimal allocation also depends on the power demand
+                state_memo += (get_demand_level(battery.power_command) if module_num > 0 else 0,)
+            memo = (battery, key, state_memo)
+            self.equipment_state_memo[id(equipment)] = memo
+        return state + memo[2]
+
+    def get_plan_signature(self):
+        '''
+        return a hashable signature of all inputs of the power distribution, the distribution is a
+        deterministic function of this signature: same signature -> same connection_map
+        '''
+        rack_state = tuple(self.get_equipment_state(rack) for rack in self.battery_rack_list)
+        pile_state = ()
+        soc_order = None
+        if self.charge_pile_list is not None:
+            pile_state = tuple(self.get_equipment_state(pile) for pile in self.charge_pile_list)
+            # PSC preferred steals the modules of the rack battery with minimal soc -> soc ranking matters
+            if self.power_dist_option != "PSS preferred" and len(self.charge_pile_list) > 0:
+                rack_soc_list = self.get_rack_battery_soc()
+                soc_order = tuple(sorted(range(len(rack_soc_list)), key=rack_soc_list.__getitem__))
+        if self.power_dist_option == "Optimal":                 # priority of the optimal allocation
+            rack_soc_list = self.get_rack_battery_soc()
+            soc_order = tuple(sorted(range(len(rack_soc_list)), key=rack_soc_list.__getitem__))
+        return (tuple(self.connection_map), rack_state, pile_state, soc_order)
+
+    def get_charging_signature(self):
+        '''
+        return the part of the plan signature that can change while the connection_map is kept,
+        i.e. the state of the racks and piles in charge (see get_plan_signature)
+        '''
+        rack_state = []
+        pile_state = []
+        for equipment_id in set(self.connection_map):
+            if equipment_id > 0:
+                rack_state.append((equipment_id, self.get_equipment_state(self.battery_rack_list[equipment_id - 1])))
+            if equipment_id < 0:
+                pile_state.append((equipment_id, self.get_equipment_state(self.charge_pile_list[-1 * equipment_id - 1])))
+        soc_order = None
+        if (self.charge_pile_list is not None and self.power_dist_option != "PSS preferred" and len(self.charge_pile_list) > 0) \
+            or self.power_dist_option == "Optimal":
+            rack_soc_list = self.get_rack_battery_soc()
+            soc_order = tuple(sorted(range(len(rack_soc_list)), key=rack_soc_list.__getitem__))
+        return (sorted(rack_state), sorted(pile_state), soc_order)
+
+######################################################################
+######################## Class: Charge_Step ##########################
+######################################################################
+
+class Charge_Step:
+    '''
+    Charging step over all swap racks of one station
+    The charging equipment of all connection_maps is collected from the reverse index of the connection_map
+    (no scan per module) and cached until a connection_map changes. Every equipment, object by object, first
+    requests its power and sets the output of its power modules (Swap_Rack.output_equipment), the total module
+    output of the station is curtailed to the power cap (optional), then the batteries are charged with the
+    (curtailed) module current (Swap_Rack.charge_battery).
+    '''
+    def __init__(self):
+        self.structure_key = None                                           # connection_maps of the cached equipment list
+        self.equipment_list = []
+
+    def collect(self, swap_rack_list : list):
+        '''
+        gather the charging equipment of all swap racks (reverse index of the connection_map instead of a
+        scan per module), return the list of (swap_rack, equipment_id, charger_array)
+        '''
+        equipment_list = []
+        for swap_rack in swap_rack_list:
+            if swap_rack.power_cabinet is None:
+                continue
+            connection_map = swap_rack.connection_map
+            for equipment_id in connection_map.get_equipment_list():
+                equipment_list.append((swap_rack, equipment_id, connection_map.get_modules(equipment_id)))
+        return equipment_list
+
+    def curtail(self, outputs : list, power_cap):
+        '''
+        proportional curtailment: if the total module output of the station exceeds power_cap [kW],
+        the output of every module is scaled with power_cap / total output and its current recalculated
+        outputs:    list of (swap_rack, charger_array, battery) of the charging equipment
+        return the curtailed power [kW]
+        '''
+        total_power = 0
+        for swap_rack, charger_array, battery in outputs:
+            for t in charger_array:
+                if swap_rack.power_cabinet.module_list[t].link_to != 0:
+                    total_power += swap_rack.power_cabinet.module_list[t].power
+        if total_power <= power_cap:
+            return 0
+        factor = max(power_cap, 0) / total_power
+
+        for swap_rack, charger_array, battery in outputs:
+            for t in charger_array:
+                module = swap_rack.power_cabinet.module_list[t]
+                if module.link_to != 0:
+                    module.curtail_power(module.power * factor, battery.battery_voltage)
+        return total_power - total_power * factor
+
+    def run(self, swap_rack_list : list, t_timer : int, interval = 1, power_cap = None):
+        '''
+        one charging step for all swap racks: collect -> output -> curtail -> charge
+        the equipment list is rebuilt only when a connection_map changed
+        power_cap: upper limit of the total module output [kW], None -> no curtailment
+        return the curtailed power [kW]
+        '''
+        structure_key = tuple(tuple(swap_rack.connection_map) for swap_rack in swap_rack_list)
+        if structure_key != self.structure_key:
+            self.structure_key = structure_key
+            self.equipment_list = self.collect(swap_rack_list)
+        outputs = [(swap_rack, charger_array, swap_rack.output_equipment(equipment_id, charger_array))
+                   for swap_rack, equipment_id, charger_array in self.equipment_list]
+
+        curtailed_power = 0
+        if power_cap is not None:
+            curtailed_power = self.curtail(outputs, power_cap)
+
+        for swap_rack, charger_array, battery in outputs:
+            swap_rack.charge_battery(battery, charger_array, t_timer, interval)
+        return curtailed_power
+
 ######################################################################
 ####################### Class: SwapStation ###########################
 ######################################################################
@@ -1547,20 +2119,15 @@ class SwapStation:
         self.buff_rack = None
         self.battery_num = 0                                                            # !!! battery_num has calculation error !!!!
         self.enable_me_switch = param["enable_me_switch"]
-        self.power_history = []                                                         # 记录充电功率的历史，记录在power_history队列中，记录结构为[timer, power]
+        self.power_history = []                                                         # 记录充电功率的历史，记录在power_history队列中，记录结构为[timer, power, curtailed power]
+        self.grid_power_cap = param.get("grid_power_cap") or []                         # time-of-day grid caps [[start_hour, end_hour, cap kW], ...], the station power is also limited by max_power
         self.target_soc = param["target_soc"]                                           # for the PSC charge pile target soc
         self.select_soc = param["select_soc"]                                           # for the PSS battery charge target upper limit, will be select to swap when reaches this soc
         self.power_dist_option = param["power_dist_option"]                             # trigger of PSC or PSS power priority
-        if param["grid_interaction_idx"] != -1:                                         # define the grid interaction start time stamp (if idx != -1)
-            self.grid_interaction_timeStamp = int(param["grid_interaction_idx"] * 3600 / param["sim_interval"])
-            self.grid_interaction_counter = 0                                           # define the how many times the grid interaction will perform
-            self.grid_interaction_time_upper_limit = int((param["grid_interaction_idx"] + 1) * 3600 / param["sim_interval"]) # define the upper limit of grid interaction time interval
-        else:
-            self.grid_interaction_timeStamp = None
-            self.grid_interaction_counter = 1
-            self.grid_interaction_time_upper_limit = None
+        self.set_grid_interaction(param["grid_interaction_idx"], param["sim_interval"])
         self.trigger = []                                                               # trigger for grid interaction, once time for discharge, this will be 1 otherwise 0, same length as sim_ticks
         self.interaction_num = param["interaction_num"]                                 # number of interaction will be performed
+        self.charge_step = Charge_Step()                                                # charging step of all swap racks
         
         # Set up the station variations
         if self.station_type == "GEN2_530":
@@ -1609,13 +2176,36 @@ class SwapStation:
 
         self.set_temperature(rack_temperature = param["swap_rack_temperature"], env_temperature = param["swap_rack_temperature"]) #缺省温度25度
 
-    def set_temperature(self, rack_temperature = 25, env_temperature = 25):
+        # share of max_power of every power cabinet (upper limit of the optimal power distribution)
+        cabinet_module_num = sum(sr.power_cabinet.module_number for sr in self.swap_rack_list if sr.power_cabinet is not None)
+        for swap_rack in self.swap_rack_list:
+            if swap_rack.power_cabinet is not None and cabinet_module_num > 0:
+                swap_rack.power_cap = self.max_power * swap_rack.power_cabinet.module_number / cabinet_module_num
+        # sum of the module rated power, a power cap above it can never be reached
+        self.module_max_power = sum(m.max_power for sr in self.swap_rack_list if sr.power_cabinet is not None for m in sr.power_cabinet.module_list)
+
+    def set_grid_interaction(self, grid_interaction_idx, interval, start_tick = 0):
+        '''
+        arm the grid interaction of the day that begins at start_tick (multi day runs arm it again every day)
+        grid_interaction_idx: hour of the day of the interaction interval, -1 -> service deactivated
+        '''
+        if grid_interaction_idx != -1:                                                  # define the grid interaction start time stamp (if idx != -1)
+            self.grid_interaction_timeStamp = start_tick + int(grid_interaction_idx * 3600 / interval)
+            self.grid_interaction_counter = 0                                           # define the how many times the grid interaction will perform
+            self.grid_interaction_time_upper_limit = start_tick + int((grid_interaction_idx + 1) * 3600 / interval) # define the upper limit of grid interaction time interval
+        else:
+            self.grid_interaction_timeStamp = None
+            self.grid_interaction_counter = 1
+            self.grid_interaction_time_upper_limit = None
+
+    def set_temperature(self, rack_temperature = 25, env_temperature = 25, interpolate = False):
         '''
         set up environment temperature and rack temperature
+        interpolate: see Battery.set_temperature (temperature profile)
         '''
         for swap_rack in self.swap_rack_list:
            if isinstance(swap_rack, Swap_Rack):
-               swap_rack.set_sr_temperature(rack_temperature, env_temperature)
+               swap_rack.set_sr_temperature(rack_temperature, env_temperature, interpolate)
                self.rack_temperature = swap_rack.rack_temperature
                self.env_temperature = swap_rack.external_temperature
 
@@ -1760,7 +2350,7 @@ class SwapStation:
     ################################################################################
     ######################## Modified by Y.Meng ####################################
     ################################################################################
-    def do_swap(self, current_user, t_timer, interval=1):
+    def do_swap(self, current_user, t_timer, interval=1, rearrange=True):
         '''
         swapping process
         grid interaction trigger will be calculated in form of list, when the counter
@@ -1768,6 +2358,8 @@ class SwapStation:
         when the swap user utilizes the PSS, otherwise will this trigger == 0, we use trigger
         to detect whether we perform the grid interaction or not
         
+        rearrange: False skips the battery position adjustment (switch_in_rack), used by the event
+                   driven loop for ticks in which the rack status is known to be unchanged
         return value: True or False
         
         '''
@@ -1829,7 +2421,7 @@ class SwapStation:
         
         else: #当没有换电动作的时候，做一下电池仓电池位置的调整
             self.trigger.append(0)
-            if self.status != "switch":
+            if self.status != "switch" and rearrange:
                 if (self.enable_me_switch > 0):
                     self.switch_in_rack()
                     if len(self.swap_rack_list) > 1 and self.enable_me_switch > 1:
@@ -1842,19 +2434,92 @@ class SwapStation:
     ###################################################################################
     ############################ Modified by Y.Meng ###################################
     ###################################################################################
-    def do_charge(self, timer, interval=1):
+    def do_charge(self, timer, interval=1, redistribute=True):
+        '''
+        redistribute: False keeps the current connection_map, used by the event driven loop
+                      for ticks in which the power distribution is known to be unchanged
+        '''
         self.power = 0
+        if redistribute:
+            for swap_rack in self.swap_rack_list:
+                swap_rack.power_distribution()                          # skipped for racks at an unchanged fixed point
+        
+        power_cap = self.get_power_cap(timer, interval)
+        curtailed_power = self.charge_step.run(self.swap_rack_list, timer, interval, power_cap)    # charge all racks & piles in one step
         for swap_rack in self.swap_rack_list:
+            self.power += swap_rack.get_power_sr()
+        self.power_history.append([timer, self.power, curtailed_power])
 
-            if self.power_dist_option == "PSS preferred":        
-                swap_rack.power_distribution_pss_preferred()
+    def get_power_cap(self, timer, interval=1):
+        '''
+        return the station power cap [kW] of the time step: max_power and the grid caps of grid_power_cap
+        whose time window [start_hour, end_hour) contains the time of day (windows over midnight with start_hour > end_hour),
+        None if the cap can not be reached by the power modules
+        '''
+        power_cap = self.max_power
+        hour = (timer * interval / 3600) % 24
+        for start_hour, end_hour, cap in self.grid_power_cap:
+            if start_hour <= end_hour:
+                active = start_hour <= hour < end_hour
             else:
-                swap_rack.power_distribution_psc_preferred()  
-             
-            swap_rack.do_charge(timer, interval)
-            self.power += swap_rack.get_power_sr()
-        self.power_history.append([timer, self.power])
+                active = hour >= start_hour or hour < end_hour
+            if active:
+                power_cap = min(power_cap, cap)
+        if power_cap >= self.module_max_power:
+            return None
+        return power_cap
     
+    def get_plan_signature(self):
+        '''
+        return a hashable signature of the station state that swap, rearrangement and power distribution
+        depend on, two consecutive ticks with identical signature mean the station reached a fixed point
+        '''
+        return (self.status, tuple(swap_rack.get_plan_signature() for swap_rack in self.swap_rack_list))
+
+    def get_charging_signature(self):
+        '''
+        return the plan signature of the equipment in charge, see Swap_Rack.get_charging_signature
+        '''
+        return [swap_rack.get_charging_signature() for swap_rack in self.swap_rack_list]
+
+    def skip_ticks(self, t_start, t_end):
+        '''
+        fast forward the ticks [t_start, t_end) of an idle station without charging, without swap
+        completion and without grid interaction, gives the same result as do_swap & do_charge per tick
+        '''
+        n_ticks = t_end - t_start
+        if self.grid_interaction_timeStamp != None and self.grid_interaction_time_upper_limit != None:
+            if t_end - 1 > self.grid_interaction_time_upper_limit:
+                self.grid_interaction_counter = self.interaction_num
+        if self.status == "in_use":
+            self.swap_timer += n_ticks
+        self.trigger.extend([0] * n_ticks)
+        self.power = 0
+        self.power_history.extend([t, 0, 0] for t in range(t_start, t_end))
+
+    def has_free_pile(self):
+        '''
+        return True if a vehicle can be connected to a charge pile
+        '''
+        if self.max_charge_terminal == 0:
+            return False
+        for sr in self.swap_rack_list:
+            if sr.max_pile_number > 0:
+                for pile in sr.charge_pile_list:
+                    if pile.vehicle_battery is None:
+                        return True
+        return False
+
+    def is_charging(self):
+        '''
+        return True if any power module is connected to a battery or a charge pile
+        '''
+        for swap_rack in self.swap_rack_list:
+            for equipment_id in swap_rack.connection_map:
+                if equipment_id != 0:
+                    return True
+        return False
+
     ###################################################################################
     ############################ Modified by Y.Meng ###################################
     ###################################################################################
@@ -1867,7 +2532,7 @@ class SwapStation:
             swap_rack.power_distribution_grid_interaction()
             swap_rack.do_grid_discharge(timer, interval)
             self.power += swap_rack.get_power_sr()
-        self.power_history.append([timer, self.power])
+        self.power_history.append([timer, self.power, 0])
     
     ###################################################################################
     ############################ Modified by Y.Meng ###################################
@@ -1879,10 +2544,7 @@ class SwapStation:
             if swap_rack.power_cabinet is not None:
                 # logger.debug(swap_rack.power_cabinet)
                 swap_rack.start_charge_all()
-                if self.power_dist_option == "PSS preferred":        
-                    swap_rack.power_distribution_pss_preferred()
-                else:
-                    swap_rack.power_distribution_psc_preferred()    
+                swap_rack.power_distribution()
 
     def vehicle_charge(self, vb : Battery, pile_id = -1):
         # pile id = -1表明自动连接到空闲充电桩，
@@ -1895,6 +2557,8 @@ class SwapStation:
             for sr in self.swap_rack_list:
                 if sr.max_pile_number > 0:
                     for j in range(len(sr.charge_pile_list)):
+                        if sr.charge_pile_list[j].vehicle_battery is not None:     # occupied pile, skip instead of a failed connection per tick
+                            continue
                         if sr.connect_vehicle(vb, j) == j:
                             # logger.info('battery connected to pile number %d',j)
                             return j
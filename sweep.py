@@ -0,0 +1,158 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# parameter sweep of do_simulation
+# the design (full grid or latin hypercube) is expanded into one param dict per
+# point and replica. All points of a replica share the seed [seed, replica], so
+# points with the same demand see the identical arrival stream (common random
+# numbers, differences between points are not hidden by arrival noise).
+# The points are submitted longest job first (estimate_cost) to the worker pool,
+# a worker only returns the KPIs of its run instead of the full result tuple, and
+# the event driven loop is used unless the point sets its own sim_engine.
+###################################################################################
+import time
+import random
+import logging
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import main
+import horizon
+import replication
+
+logger = logging.getLogger('main.sweep')
+
+DAY_SECONDS = 24 * 60 * 60
+USER_COST = 80                                                  # simulation cost of one arriving user in ticks (measured)
+
+def grid_design(grid : dict):
+    '''
+    full factorial design, cartesian product of grid {param name: list of values}
+    return list of dicts {param name: value}
+    '''
+    names = list(grid.keys())
+    for name in names:
+        if not isinstance(grid[name], list) or len(grid[name]) == 0:
+            raise ValueError("sweep values of %s must be a non empty list" % name)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+def lhs_design(ranges : dict, samples : int, seed = None):
+    '''
+    latin hypercube design, every range is divided into samples strata and every stratum is used once
+    ranges:  {param name: [low, high]} numeric range (int values if low and high are int),
+             {param name: {"choices": [...]}} categorical values
+    samples: number of points
+    seed:    seed of the design, None -> random
+    return list of dicts {param name: value}
+    '''
+    rng = np.random.default_rng(seed)
+    points = [{} for i in range(samples)]
+    for name, value_range in ranges.items():
+        u = (rng.permutation(samples) + rng.random(samples)) / samples   # one uniform sample per stratum, strata shuffled
+        if isinstance(value_range, dict):
+            choices = value_range.get("choices")
+            if not isinstance(choices, list) or len(choices) == 0:
+                raise ValueError("choices of %s must be a non empty list" % name)
+            values = [choices[int(k)] for k in np.floor(u * len(choices))]
+        elif isinstance(value_range, list) and len(value_range) == 2:
+            low, high = value_range
+            if isinstance(low, int) and isinstance(high, int):
+                values = [int(k) for k in low + np.floor(u * (high - low + 1))]
+            else:
+                values = [float(k) for k in low + u * (high - low)]
+        else:
+            raise ValueError("range of %s must be [low, high] or {\"choices\": [...]}" % name)
+        for point, value in zip(points, values):
+            point[name] = value
+    return points
+
+def estimate_cost(param : dict):
+    '''
+    relative run time of a simulation: simulated ticks + USER_COST per arriving user,
+    only used to start the longest jobs first
+    '''
+    sim_days = param.get("sim_days", 1)
+    sim_ticks = param["sim_ticks"] if sim_days <= 1 else sim_days * int(DAY_SECONDS / param["sim_interval"])
+    user_num = param.get("nio_user_num", 0) + param.get("non_nio_user_num", 0)
+    return sim_ticks + USER_COST * user_num * max(1, sim_days)
+
+def order_by_cost(param_list : list):
+    '''
+    return the indices of param_list, most expensive first (longest processing time first scheduling)
+    '''
+    return sorted(range(len(param_list)), key=lambda index: -estimate_cost(param_list[index]))
+
+def create_point_params(base_param : dict, points : list, replicas = 1, seed = None):
+    '''
+    one param dict per point and replica: base_param updated with the point, seed [seed, replica]
+    return list of (point index, replica, param)
+    '''
+    if seed is None:
+        seed = random.randrange(2**32)
+    param_list = []
+    for index, point in enumerate(points):
+        for replica in range(replicas):
+            param = dict(base_param)
+            param.update(point)
+            param.setdefault("sim_engine", "event")             # same results as the tick loop, faster on quiet hours
+            param["seed"] = [seed, replica]
+            param_list.append((index, replica, param))
+    return param_list
+
+def run_point(index : int, replica : int, param : dict, cache = None):
+    '''
+    simulate one point in a worker process, return only the KPIs (small result to transfer)
+    errors are returned instead of raised, so one failed point does not stop the sweep
+    '''
+    start = time.perf_counter()
+    try:
+        if param.get("sim_days", 1) > 1:
+            day_kpis, kpis = horizon.do_horizon_simulation(param)
+        else:
+            result = cache.run(param) if cache is not None else main.do_simulation(param)
+            kpis = main.get_kpis(result, param["sim_interval"])
+    except Exception as e:
+        logger.error('sweep point %d replica %d failed: %s', index, replica, e)
+        return {"index": index, "replica": replica, "kpis": None, "wall_time": time.perf_counter() - start, "error": "%s: %s" % (type(e).__name__, e)}
+    return {"index": index, "replica": replica, "kpis": kpis, "wall_time": time.perf_counter() - start, "error": None}
+
+def run_sweep(base_param : dict, points : list, replicas = 1, seed = None, max_workers = None, cache = None, callback = None):
+    '''
+    simulate all points of a design
+    base_param:     simulation param dict (see main.do_simulation), updated by every point
+    points:         list of dicts {param name: value}, see grid_design and lhs_design
+    replicas:       number of replicas per point, replica r of every point uses the seed [seed, r]
+    seed:           base seed, None -> random
+    max_workers:    number of worker processes, None -> number of cpu cores, 1 -> run in this process
+    cache:          result cache (see result_cache.Result_Cache) of the single day points
+    callback:       function(number of finished runs, total runs) e.g. for a progress bar
+    return list per point {"point", "kpis": KPI dicts of the replicas, "summary": replication.summarize_kpis()
+    of the successful replicas, "errors": error messages}
+    '''
+    param_list = create_point_params(base_param, points, replicas, seed)
+    records = [{"point": point, "kpis": [None] * replicas, "summary": {}, "errors": []} for point in points]
+    order = order_by_cost([param for index, replica, param in param_list])
+    logger.info('sweep of %d points x %d replicas', len(points), replicas)
+
+    def collect(outcome, done):
+        record = records[outcome["index"]]
+        if outcome["error"] is None:
+            record["kpis"][outcome["replica"]] = outcome["kpis"]
+        else:
+            record["errors"].append(outcome["error"])
+        if callback is not None:
+            callback(done, len(param_list))
+
+    if max_workers == 1 or len(param_list) <= 1:
+        for done, k in enumerate(order):
+            collect(run_point(*param_list[k], cache=cache), done + 1)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(run_point, *param_list[k], cache=cache) for k in order]
+            for done, future in enumerate(as_completed(futures)):
+                collect(future.result(), done + 1)
+
+    for record in records:
+        record["kpis"] = [kpis for kpis in record["kpis"] if kpis is not None]
+        record["summary"] = replication.summarize_kpis(record["kpis"])
+    return records
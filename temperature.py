@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# seasonal & diurnal temperature profile of the station
+# the ambient temperature of a tick is derived from the monthly max/min temperatures
+# of Global_Constant.temp: the monthly values are interpolated over the day of the
+# year (taken at the middle of each month), within a day the temperature follows a
+# cosine between the min (03:00) and the max (15:00). The battery rack is climate
+# controlled and follows the ambient temperature inside [rack_min, rack_max].
+# Temperatures are rounded to 1 degree (bucket), the station batteries are only
+# updated when a bucket changes, the charge limit row of a bucket is computed once
+# (global_param.add_charge_limit_bucket).
+###################################################################################
+import math
+import logging
+import numpy as np
+import global_param
+
+GC = global_param.Global_Constant()
+logger = logging.getLogger('main.temperature')
+
+DAY_SECONDS = 24 * 60 * 60
+MONTH_DAYS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+class Temperature_Profile():
+    '''
+    rack and ambient temperature per tick
+    interval:   sim_interval in sec
+    start_day:  day of the year of tick 0 (1 = 1st of January)
+    rack_min, rack_max: temperature range held by the rack climate control
+    temp:       monthly [max list, min list] (12 months), None -> Global_Constant.temp
+    '''
+    def __init__(self, interval : int, start_day = 1, rack_min = 15, rack_max = 30, temp = None):
+        self.interval = interval
+        self.start_day = start_day
+        self.rack_min = rack_min
+        self.rack_max = rack_max
+        self.temp = np.asarray(GC.temp if temp is None else temp, dtype=np.float64)
+        self.day_ticks = int(DAY_SECONDS / interval)
+        month_end = np.cumsum(MONTH_DAYS)
+        self.month_center = month_end - np.array(MONTH_DAYS) / 2       # day of the year in the middle of each month
+        self.day = None                                                 # simulated day of the cached arrays
+        self.rack = None
+        self.ambient = None
+        self.applied = None                                             # (rack, ambient) set at the station
+        self.swap_num = 0                                               # swaps at the last update, a swap loads a vehicle battery into the rack
+
+    def get_day_range(self, year_day : float):
+        '''
+        return (max, min) temperature of the day of the year, interpolated between the month centers (periodic)
+        '''
+        centers = np.concatenate([self.month_center - 365, self.month_center, self.month_center + 365])
+        t_max = np.interp(year_day, centers, np.tile(self.temp[0], 3))
+        t_min = np.interp(year_day, centers, np.tile(self.temp[1], 3))
+        return t_max, t_min
+
+    def load_day(self, day : int):
+        '''
+        compute the rounded rack and ambient temperature of all ticks of the simulated day
+        '''
+        year_day = (self.start_day - 1 + day) % 365 + 0.5
+        t_max, t_min = self.get_day_range(year_day)
+        hour = np.arange(self.day_ticks) * self.interval / 3600
+        ambient = (t_max + t_min) / 2 - (t_max - t_min) / 2 * np.cos(2 * math.pi * (hour - 3) / 24)
+        self.ambient = np.rint(ambient).astype(np.int64)
+        self.rack = np.clip(self.ambient, self.rack_min, self.rack_max)
+        self.day = day
+
+    def get_temperature(self, t_timer : int):
+        '''
+        return (rack temperature, ambient temperature) of the tick as int [degree]
+        '''
+        day, tick = divmod(t_timer, self.day_ticks)
+        if day != self.day:
+            self.load_day(day)
+        return int(self.rack[tick]), int(self.ambient[tick])
+
+    def get_change_ticks(self, start_tick : int, end_tick : int):
+        '''
+        return the ticks in (start_tick, end_tick) whose rack or ambient temperature differs from the tick before,
+        the event driven loop executes a complete simulation step at these ticks
+        '''
+        change_ticks = []
+        last = self.get_temperature(start_tick)
+        for day in range(start_tick // self.day_ticks, (end_tick - 1) // self.day_ticks + 1):
+            self.load_day(day)
+            first = max(start_tick, day * self.day_ticks) - day * self.day_ticks
+            last_tick = min(end_tick, (day + 1) * self.day_ticks) - day * self.day_ticks
+            rack = self.rack[first:last_tick]
+            ambient = self.ambient[first:last_tick]
+            changed = (rack != np.concatenate([[last[0]], rack[:-1]])) | (ambient != np.concatenate([[last[1]], ambient[:-1]]))
+            change_ticks.extend(int(k) + first + day * self.day_ticks for k in np.flatnonzero(changed))
+            if last_tick > first:
+                last = (int(rack[-1]), int(ambient[-1]))
+        return [t for t in change_ticks if t > start_tick]
+
+    def update(self, station, t_timer : int, swap_num = 0):
+        '''
+        set the temperature of the tick at the station, the batteries are only updated if a bucket changed
+        or a swap loaded a new vehicle battery into the rack
+        '''
+        temperature = self.get_temperature(t_timer)
+        if temperature == self.applied and swap_num == self.swap_num:
+            return temperature
+        station.set_temperature(rack_temperature=temperature[0], env_temperature=temperature[1], interpolate=True)
+        self.applied = temperature
+        self.swap_num = swap_num
+        return temperature
+
+def create_profile(param : dict):
+    '''
+    return the Temperature_Profile of param["temperature_profile"], None -> constant swap_rack_temperature
+    param["temperature_profile"]: dict {"start_day": day of the year, "rack_min", "rack_max": rack climate range}
+    '''
+    setup = param.get("temperature_profile")
+    if setup is None:
+        return None
+    return Temperature_Profile(param["sim_interval"], start_day=setup.get("start_day", 1), rack_min=setup.get("rack_min", 15),
+                               rack_max=setup.get("rack_max", 30))
@@ -0,0 +1,31 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# test of the headless batch runner (cli.py)
+# run: python -m pytest -q test_cli.py
+###################################################################################
+import os
+import json
+import pandas as pd
+import cli
+
+def test_single_scenario_in_process(tmp_path, monkeypatch, capsys):
+    '''
+    one scenario runs in this process with a relative output folder: the tables are written relative to the
+    working directory of the caller, which is kept, the progress is reported as json lines
+    '''
+    monkeypatch.chdir(tmp_path)
+    with open("scenario.json", "w") as f:
+        json.dump([{"name": "one", "nio_user_num": 20, "sim_ticks": 720, "seed": 1}], f)
+
+    exit_code = cli.main_cli(["scenario.json", "--out", "res", "--workers", "1"])
+
+    assert exit_code == cli.EXIT_OK
+    assert os.getcwd() == str(tmp_path)
+    kpis = pd.read_csv(tmp_path / "res" / "kpis.csv")
+    assert list(kpis["name"]) == ["one"]
+    assert list(kpis["status"]) == ["ok"]
+    assert (tmp_path / "res" / "series" / "one.csv").exists()
+    records = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert [record["event"] for record in records] == ["start", "progress", "finish"]
+    assert records[-1]["failed"] == 0
@@ -0,0 +1,34 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# test of the event driven simulation loop (main.do_event_loop)
+# the event loop has to reproduce the tick loop with tolerance 0 for the same seed
+# run: python -m pytest -q test_engine.py
+###################################################################################
+import pytest
+import cli
+import main
+
+CONFIGS = {
+    "pss_preferred": dict(station_name="GEN3_1200kW", nio_user_num=120, non_nio_user_num=20, seed=1),
+    "psc_preferred": dict(station_name="GEN3_600kW", nio_user_num=100, non_nio_user_num=30, power_dist_option="PSC preferred", seed=2),
+    "optimal": dict(station_name="GEN3_1200kW", nio_user_num=120, non_nio_user_num=20, power_dist_option="Optimal", seed=3),
+    "grid_interaction": dict(station_name="GEN3_600kW", nio_user_num=80, grid_interaction_idx=10, interaction_num=3, seed=4),
+    "power_cap": dict(station_name="GEN3_1200kW", nio_user_num=150, non_nio_user_num=20, init_battery_soc_in_PSS=0.1,
+                      grid_power_cap=[[0, 12, 300], [12, 24, 450]], seed=5),
+    "statistical_fy": dict(station_name="FY_TypeC", user_sequence_mode="statistical", user_area="highway", seed=6),
+}
+
+@pytest.mark.parametrize("name", sorted(CONFIGS))
+def test_event_loop_equals_tick_loop(name):
+    '''
+    same KPIs and same power history (power and curtailed power of every tick) for sim_engine "tick" and "event"
+    '''
+    results = {}
+    for sim_engine in ["tick", "event"]:
+        param = cli.create_param(sim_engine=sim_engine, **CONFIGS[name])
+        results[sim_engine] = main.do_simulation(param)
+    tick, event = results["tick"], results["event"]
+    assert main.get_kpis(event, 10) == main.get_kpis(tick, 10)
+    assert event[6] == tick[6]                                  # power_history [timer, power, curtailed]
+    assert event[2] == tick[2] and event[3] == tick[3]          # queue length per tick
@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# test of snapshot, restore and fork of a running simulation (snapshot.py)
+# a run resumed from a snapshot has to give the result of the uninterrupted run
+# run: python -m pytest -q test_snapshot.py
+###################################################################################
+import pickle
+import pytest
+import cli
+import main
+import snapshot
+
+RESUME_TICK = 2160                                              # 6 AM
+
+def get_param(**overrides):
+    return cli.create_param("GEN3_600kW", nio_user_num=100, non_nio_user_num=20, seed=7, **overrides)
+
+def check_identical(result, reference):
+    assert main.get_kpis(result, 10) == main.get_kpis(reference, 10)
+    assert result[6] == reference[6]                            # power_history [timer, power, curtailed]
+    assert result[2] == reference[2] and result[3] == reference[3]
+
+@pytest.mark.parametrize("sim_engine", ["tick", "event"])
+def test_resume_equals_uninterrupted_run(sim_engine):
+    param = get_param(sim_engine=sim_engine)
+    reference = main.do_simulation(param)
+    snap = snapshot.simulate_until(param, RESUME_TICK)
+    check_identical(snapshot.resume_simulation(snap.restore()), reference)
+    check_identical(snapshot.resume_simulation(snap.restore()), reference)     # every restore is an independent copy
+    check_identical(snapshot.resume_simulation(snap.fork()), reference)        # fork without seed keeps the random streams
+
+def test_resume_from_file(tmp_path):
+    param = get_param()
+    reference = main.do_simulation(param)
+    path = str(tmp_path / "run.snap")
+    snapshot.simulate_until(param, RESUME_TICK).save(path)
+    loaded = snapshot.load_snapshot(path)
+    assert loaded.tick == RESUME_TICK
+    check_identical(snapshot.resume_simulation(loaded.restore()), reference)
+
+def test_fork_with_seed():
+    param = get_param()
+    snap = snapshot.simulate_until(param, RESUME_TICK)
+    branch = snap.fork(seed=8)
+    assert branch["param"]["seed"] == 8
+    assert branch["user_dist_lst"] == snap.restore()["user_dist_lst"]         # the arrivals of the day are kept
+    result = snapshot.resume_simulation(branch)
+    assert result[6][:RESUME_TICK] == main.do_simulation(param)[6][:RESUME_TICK]
+
+def test_old_snapshot_version(tmp_path):
+    path = str(tmp_path / "old.snap")
+    data = snapshot.simulate_until(get_param(), 360).data
+    with open(path, "wb") as f:
+        pickle.dump({"version": snapshot.SNAPSHOT_VERSION - 1, "tick": 360, "data": data}, f)
+    with pytest.raises(snapshot.Snapshot_Error):
+        snapshot.load_snapshot(path)
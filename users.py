@@ -18,10 +18,10 @@ import random
 import string
 import time
 import numpy as np
-import pandas as pd
 import swap
 from swap import Battery
 import global_param
+import arrival_store
 
 # set up the global param
 GC = global_param.Global_Constant()
@@ -32,7 +32,7 @@ data_logger = logging.getLogger('data.users')
 
 class User():
 
-    def __init__(self, user_label) -> None:
+    def __init__(self, user_label, rng_streams = None) -> None:
 
         self.preference_distribution = {"charge":30,"swap":70,"leave":0} # by dafult setup of the user preference
         self.battery = None                 # save the battery instance object
@@ -54,6 +54,15 @@ class User():
         self.id = -1                        #这是用于记录用户在一天的仿真时序里到达的时间
         self.connect_pile = None
         self.temp = 25
+        self.rng_streams = rng_streams      #独立的随机数流 dict (see create_rng_streams)，None表示使用全局random
+
+    def get_rng(self, stream):
+        '''
+        return the numpy Generator of the given stream ("soc", "preference"), None if the user uses the global random state
+        '''
+        if self.rng_streams is None:
+            return None
+        return self.rng_streams[stream]
 
     def charge_service_time(self, mode = 1):   # mode = 1 返回充电加排队时间; mode = 0 只返回充电时间
         if mode == 1:
@@ -107,7 +116,7 @@ class User():
         x_1 = x_1 / sum(x_1)
         x_1 = [round(s,2) for s in x_1]                                 # estimate probability
         ulist = [1, 2, 3]
-        numb = get_number_by_pro(number_list = ulist, pro_list = x_1)
+        numb = get_number_by_pro(number_list = ulist, pro_list = x_1, rng = self.get_rng("preference"))
         
         self.charge_preference = x_state[int(numb)]                     # save as string
         return x_state[int(numb)]
@@ -186,7 +195,7 @@ class User():
         ulist = [1, 2, 3] # 1, 2, 3, 4
         plist = [self.preference_distribution["swap"] / 100, self.preference_distribution["charge"] / 100, 
                 self.preference_distribution["leave"] / 100]
-        numb = get_number_by_pro(number_list = ulist, pro_list = plist)
+        numb = get_number_by_pro(number_list = ulist, pro_list = plist, rng = self.get_rng("preference"))
         # data_logger.debug(int(numb))
         self.charge_preference = pref_c[int(numb)] # save as string
         return pref_c[int(numb)]
@@ -200,11 +209,12 @@ class User():
         Mode 2 (random_soc = 1): configurate the initial SOC based on real data distribution, but with gaussian distribution (centriod mu and sigma)
         Mode 3 (random_soc = 2): configurate the initial SOC based on uniform distribution
         '''
+        rng = self.get_rng("soc")
         # # set up the battery type by ratio in the battery_config dict
         if len(battery_config) ==2:
             ratio = list(battery_config.values())[0] / sum(list(battery_config.values()))
             # set up a flag value that compare with the ratio in order to confirm the battery type
-            flag = random.random()
+            flag = random.random() if rng is None else rng.random()
             # Here currently only allows 2 type of battery configuration -> 100 kWh and 75 kWh
             if flag <= ratio:
                 # first type of battery
@@ -215,7 +225,7 @@ class User():
         else:
             ratio1 = list(battery_config.values())[0] / sum(list(battery_config.values()))
             ratio2 = list(battery_config.values())[0] + list(battery_config.values())[1] / sum(list(battery_config.values()))
-            flag = random.random()
+            flag = random.random() if rng is None else rng.random()
             # Here currently only allows 2 type of battery configuration -> 100 kWh and 75 kWh
             if flag <= ratio1:
                 # first type of battery
@@ -240,16 +250,16 @@ class User():
         if random_soc == 0:
             # set up the clients initial soc based on real statistic data -> Gamma distribution
             shape, scale = 3.0, 12.0
-            input_soc = random.gammavariate(shape, scale)
+            input_soc = random.gammavariate(shape, scale) if rng is None else rng.gamma(shape, scale)
             input_soc = round(input_soc/100, 2)
 
         elif random_soc == 1:
             # set up the clients initial soc based on real statistic data -> Gaussian distribution
-            input_soc = random.normalvariate(mu=33.13, sigma=18.71)
+            input_soc = random.normalvariate(mu=33.13, sigma=18.71) if rng is None else rng.normal(33.13, 18.71)
             input_soc = round(input_soc/100, 2)
         else:
             # set up the clients initial soc based on Uniform distribution (Not recommend!!!)
-            input_soc = random.uniform(soc_low_limit, soc_up_limit)
+            input_soc = random.uniform(soc_low_limit, soc_up_limit) if rng is None else rng.uniform(soc_low_limit, soc_up_limit)
             input_soc = round(input_soc, 2)
         
         # check the validity of battery initial soc value
@@ -273,27 +283,20 @@ class User():
     ###################################################################################
     ############################ Modified by Y.Meng ###################################
     ###################################################################################
-def create_user_queue_random(nio_user_num : int, non_nio_user_num : int): 
+def create_user_queue_random(nio_user_num : int, non_nio_user_num : int, rng = None): 
     '''
     use the user_random_dist.dat file to generate the user arrive time distribution
+    rng: numpy Generator of the arrival stream, None -> global random state
     '''
     if nio_user_num <= 0:
         logger.error('should create a user queue larger than 0')
     
-    # read the dat file from data folder
-    abspath = os.getcwd()
-    abspath = os.path.join(abspath,"data")
-    file_list = os.listdir(abspath)
-    data_name = None
-    for item in file_list:
-        if item == "user_random_dist.dat":
-            data_name = item
-            break
-    data_file_path = os.path.join(abspath, data_name)
+    # the distribution file of the data folder (preparsed by arrival_store)
+    data_file_path = os.path.join(os.getcwd(), "data", "user_random_dist.dat")
 
     # pack and sort the nio & non nio user queue 
-    nio_user_list = get_user_distribution(data_file_path, nio_user_num)            # return timestamp list of nio user arrive time
-    non_nio_user_list = get_user_distribution(data_file_path, non_nio_user_num)    # return timestamp list of non nio user arrive time
+    nio_user_list = get_user_distribution(data_file_path, nio_user_num, rng)       # return timestamp list of nio user arrive time
+    non_nio_user_list = get_user_distribution(data_file_path, non_nio_user_num, rng) # return timestamp list of non nio user arrive time
 
     nio_queue, non_nio_queue = label_queue(nio_user_list, non_nio_user_list)
     sorted_queue, sorted_label = sort_queue(nio_queue, non_nio_queue)
@@ -302,42 +305,48 @@ def create_user_queue_random(nio_user_num : int, non_nio_user_num : int):
     ###################################################################################
     ############################ Modified by Y.Meng ###################################
     ###################################################################################
-def create_user_queue_statistical(area : string, non_nio_user_num : int): 
+def get_day_file_list(area : string):
+    '''
+    return the day file name list of the area (urban or suburb/highway)
+    '''
+    if area == "urban":
+        return GC.user_dist_urban_file_list                             # get the user distribution file name list for urban
+    return GC.user_dist_highway_file_list                               # get the user distribution file name list for highway
+
+def select_day_file(area : string, rng = None):
+    '''
+    draw the index of a random day file of the area
+    rng: numpy Generator of the arrival stream, None -> global random state
+    '''
+    file_list = get_day_file_list(area)
+    if rng is None:
+        return random.randint(0, len(file_list) - 1)                    # generate a random number for selection of file
+    return int(rng.integers(0, len(file_list)))
+
+def create_user_queue_statistical(area : string, non_nio_user_num : int, rng = None, file_index = None): 
     '''
     Queue generation mode "real data"
     Generate the user input distribution based on real data (saved under "data" folder)
     Input: 
         data file with ending "*.dat", data format: "2020-07-01 00:28:44", which recorded users arrive time within 24 hours
         area: string that indicates which area will be used for simulation, urban or suburb/highway
+        rng: numpy Generator of the arrival stream, None -> global random state
+        file_index: index of the day file (modulo the number of files), None -> random selection (select_day_file)
     Output:
         time stamp list (in sec) that refered to 00:00:00
     '''
     # Prepare the Non NIO user generation file, read the file path
-    abspath = os.getcwd()
-    abspath = os.path.join(abspath,"data")
-    file_list = os.listdir(abspath)
-    data_name = None
-    for item in file_list:
-        if item == "user_random_dist.dat":
-            data_name = item
-            break
-    data_file_path = os.path.join(abspath, data_name)
+    data_file_path = os.path.join(os.getcwd(), "data", "user_random_dist.dat")
 
     # use statistics to generate NIO user arrive time queue
-    if area == "urban":
-        file_list = GC.user_dist_urban_file_list                        # get the user distribution file name list for urban
+    file_list = get_day_file_list(area)
+    if file_index is None:
+        selection_flag = select_day_file(area, rng)
     else:
-        file_list = GC.user_dist_highway_file_list                      # get the user distribution file name list for highway
-    selection_flag = random.randint(0, len(file_list) - 1)              # generate a random number for selection of file
-    file_address = "data/" + file_list[selection_flag]                  # select file and save the reading address
-
-    seq = read_sequence(file_address)                                   # Read time sequence file "*.dat", return string list
-    basic = get_time_stamp(seq[0].split(" ")[0]+" 00:00:00")            # Read first line date + 00:00:00 -> return in sec as start point
-    for i, v in enumerate(seq):                                         # Calculate: all time stamp in queue - start point sec == sec after start point
-        seq[i] = get_time_stamp(v) - basic
-    
-    nio_user_list = [int(c) for c in seq]                                          # return int list of all queue input time (sec relative to start point)
-    non_nio_user_list = get_user_distribution(data_file_path, non_nio_user_num)    # return timestamp list of non nio user arrive time
+        selection_flag = file_index % len(file_list)
+    # time stamps of the selected file in sec relative to 00:00:00, preparsed once by arrival_store
+    nio_user_list = arrival_store.get_day_arrivals(file_list[selection_flag])      # return int list of all queue input time (sec relative to start point)
+    non_nio_user_list = get_user_distribution(data_file_path, non_nio_user_num, rng) # return timestamp list of non nio user arrive time
 
     nio_queue, non_nio_queue = label_queue(nio_user_list, non_nio_user_list)       # return two dicts with label nio and non_nio
     sorted_queue, sorted_label = sort_queue(nio_queue, non_nio_queue)              # sort the two dict by time
@@ -376,15 +385,13 @@ def sort_queue(queue1:dict, queue2:dict):
     sort the two queues dict with key name: "time", "label"
     sort by ["time"]
     '''
-    queue1 = pd.DataFrame(queue1)
-    queue2 = pd.DataFrame(queue2)
-    dt_total = [queue1, queue2]
-    dt_total = pd.concat(dt_total)
-    sorted_dt = dt_total.sort_values(by=["time"])
+    time_array = np.array(list(queue1["time"]) + list(queue2["time"]), dtype=np.int64)
+    label_array = np.array(list(queue1["label"]) + list(queue2["label"]), dtype=object)
+    order = np.argsort(time_array, kind="quicksort")                     # same sort as pandas sort_values(by=["time"])
     
     # get the sorted queue and label in format list
-    sorted_queue = list(sorted_dt["time"])
-    sorted_label = list(sorted_dt["label"])
+    sorted_queue = time_array[order].tolist()
+    sorted_label = label_array[order].tolist()
 
     return sorted_queue, sorted_label
 
@@ -436,15 +443,85 @@ def check_seq(tick, interval, user_dist_list, user_label):
     else:
         return service_list, service_label
 
-def get_number_by_pro(number_list, pro_list):
+def create_rng_streams(seed):
+    '''
+    create independent numpy Generator streams from one seed (SeedSequence.spawn), so that the arrival,
+    the SOC sampling, the preference sampling and the station splitting do not influence each other
+    return dict {"arrival", "soc", "preference", "station"}, None if seed is None (global random state is used)
+    '''
+    if seed is None:
+        return None
+    arrival, soc, preference, station = np.random.SeedSequence(seed).spawn(4)
+    rng_streams = {
+        "arrival" : np.random.default_rng(arrival),
+        "soc" : np.random.default_rng(soc),
+        "preference" : np.random.default_rng(preference),
+        "station" : np.random.default_rng(station)
+    }
+    return rng_streams
+
+def create_arrival_index(user_dist_list, user_label, sim_ticks, interval, start_tick = 0):
+    '''
+    build the arrival index once per simulation run, replaces the linear scan of check_seq()
+    Argumentation:
+    user_dist_list: user queue (arrive timestamp in sec), output of create_user_queue_random() / create_user_queue_statistical()
+    user_label: label list of the user queue
+    sim_ticks: number of iteration within sim_days
+    interval: sim_interval in sec
+    start_tick: first tick of the index (multi day runs index one day at a time)
+
+    return dict with keys:
+    "time": arrive timestamp list sorted by time (same order as check_seq() reports them)
+    "label": label list in the same order
+    "offset": int array with length sim_ticks + 1, arrivals of tick start_tick + k are located in [offset[k], offset[k+1])
+    "start": start_tick
+    '''
+    if len(user_dist_list) != len(user_label):
+        logger.error("the length of user list and label list not identical, check create_arrival_index() function")
+        return None
+
+    order = np.argsort(np.asarray(user_dist_list, dtype=np.int64), kind="stable")  # stable -> users with same timestamp keep their queue order
+    sorted_time = [user_dist_list[k] for k in order]
+    sorted_label = [user_label[k] for k in order]
+    boundary = np.arange(start_tick, start_tick + sim_ticks + 1, dtype=np.int64) * interval   # start second of every tick
+    offset = np.searchsorted(np.asarray(sorted_time, dtype=np.int64), boundary, side="left")
+
+    arrival_index = {
+        "time" : sorted_time,
+        "label" : sorted_label,
+        "offset" : offset,
+        "start" : start_tick
+    }
+    return arrival_index
+
+def get_arrivals(arrival_index, tick):
+    '''
+    return the arrive timestamp list and label list of the given tick in O(1), result is identical to check_seq()
+    '''
+    offset = arrival_index["offset"]
+    tick -= arrival_index["start"]
+    if tick < 0 or tick + 1 >= len(offset):
+        return [], []
+    start = offset[tick]
+    end = offset[tick + 1]
+    return arrival_index["time"][start:end], arrival_index["label"][start:end]
+
+def get_arrival_ticks(arrival_index):
+    '''
+    return the sorted list of ticks in which at least one user arrives
+    '''
+    return [int(t) + arrival_index["start"] for t in np.flatnonzero(np.diff(arrival_index["offset"]))]
+
+def get_number_by_pro(number_list, pro_list, rng = None):
     """
     定义从一个数字列表中以一定的概率取出对应区间中数字的函数
     param number_list:数字列表
     param pro_list:数字对应的概率列表
+    param rng:numpy Generator, None时使用全局random/np.random
     return:按概率从数字列表中抽取的数字
     """
     # 用均匀分布中的样本值来模拟概率
-    x = random.uniform(0, 1)
+    x = random.uniform(0, 1) if rng is None else rng.random()
     num = x
     # 累积概率
     sum_pro = 0.0
@@ -453,14 +530,18 @@ def get_number_by_pro(number_list, pro_list):
         sum_pro += number_pro
         if x < sum_pro:
      # 从区间[number. number - 1]上随机抽取一个值
-            num = np.random.uniform(number, number - 1)
+            if rng is None:
+                num = np.random.uniform(number, number - 1)
+            else:
+                num = number - rng.random()                     # uniform in (number - 1, number]
      # 返回值
             return num
     return num
     
-def get_user_distribution(file_name, daily_user):
+def get_user_distribution(file_name, daily_user, rng = None):
     """
     user distribution generation -> random mode
+    rng: numpy Generator of the arrival stream, None -> global random state
     """
 
     # case of No file
@@ -468,23 +549,65 @@ def get_user_distribution(file_name, daily_user):
         logger.error('file not specified')
         return None
     
-    with open(file_name) as f:
-        lines = f.read().splitlines()
-        if len(lines) != 48:
-            logger.error('this is not a correct distribution data format(should be 48 float)')
-            return None
-        ret_i = []
-        sum_i = 0
-        for i in lines:
-            b = float(i)
-            ret_i.append(b/100.0)
-            sum_i = sum_i + b
-
-        num_list = range(1,49)
-        final_list = []
-        for i in range(daily_user):
-            n = get_number_by_pro(number_list=num_list, pro_list=ret_i)
-            n = n / 2.0 * 60.0 * 60.0
-            final_list.append(int(n))
-        final_list.sort()
-        return final_list
+    # probabilities of the 48 bins, preparsed once by arrival_store
+    ret_i = arrival_store.get_distribution(os.path.basename(file_name), os.path.dirname(file_name))
+    if ret_i is None:
+        return None
+
+    # all users in one vectorized draw, bin k (1..48) is the half hour (k - 1, k]
+    n = sample_by_pro(np.cumsum(np.array(ret_i, dtype=np.float64)), daily_user, rng)
+    n = n / 2.0 * 60.0 * 60.0
+    final_list = np.sort(n.astype(np.int64))
+    return final_list.tolist()
+
+def sample_by_pro(cum_pro, size : int, rng = None):
+    """
+    vectorized get_number_by_pro() with number_list = 1..len(cum_pro), draws the same random numbers in the same
+    order as size calls of get_number_by_pro (the result is identical)
+    param cum_pro: cumulative probability of the numbers (np.cumsum of pro_list)
+    param size: number of samples
+    param rng: numpy Generator, None时使用全局random/np.random
+    return: float array of the samples
+    """
+    cum_pro = np.asarray(cum_pro, dtype=np.float64)
+    num = np.empty(size, dtype=np.float64)
+    if rng is None:
+        x = np.array([random.uniform(0, 1) for i in range(size)], dtype=np.float64)
+        index = np.searchsorted(cum_pro, x, side="right")           # first number with x < cumulative probability
+        inside = index < len(cum_pro)
+        num[~inside] = x[~inside]
+        number = index[inside] + 1
+        num[inside] = np.random.uniform(number, number - 1)
+        return num
+
+    # a sample takes 2 random numbers (x and the position in the bin), only 1 if x is above the cumulative probability:
+    # 2 * size numbers are drawn, the positions of x are found by walking from outlier to outlier (between two
+    # outliers every second number is an x), then the draw is repeated once with the exact number of random numbers
+    state = rng.bit_generator.state
+    u = rng.random(2 * size)
+    outside = np.searchsorted(cum_pro, u, side="right") >= len(cum_pro)
+    outlier_pos = [np.flatnonzero(outside[parity::2]) * 2 + parity for parity in (0, 1)]   # outlier positions by parity
+    x_pos = np.empty(size, dtype=np.int64)
+    done = 0
+    pos = 0
+    while done < size:
+        candidates = outlier_pos[pos % 2]
+        j = np.searchsorted(candidates, pos)
+        k = size - done                                             # samples in the bins before the next outlier
+        if j < len(candidates):
+            k = min(k, int(candidates[j] - pos) // 2)
+        x_pos[done:done + k] = pos + 2 * np.arange(k)
+        done += k
+        pos += 2 * k
+        if done < size:                                             # x at pos is the next outlier
+            x_pos[done] = pos
+            done += 1
+            pos += 1
+    x = u[x_pos]
+    index = np.searchsorted(cum_pro, x, side="right")
+    inside = index < len(cum_pro)
+    num[~inside] = x[~inside]
+    num[inside] = index[inside] + 1 - u[x_pos[inside] + 1]          # uniform in (number - 1, number]
+    rng.bit_generator.state = state
+    rng.random(pos)
+    return num
@@ -0,0 +1,211 @@
+# -*- coding: UTF-8 -*-
+
+###################################################################################
+# warm start of the station in steady state
+# instead of loading every rack battery at init_battery_soc_in_PSS, the station of a
+# configuration is run in (burn-in) day after day until the daily cycle repeats: the
+# hourly rack SOC and queue length of a day are compared with the same hours of the
+# day before (paired t-test), the burn-in ends when neither shows a significant
+# difference. The state at the last midnight (batteries, connected vehicles, waiting
+# users) is the warm start of the simulated day, it is cached per configuration in
+# memory and on disk (snapshot), so every replica and every later run of the same
+# configuration starts from it without a burn-in.
+# A configuration without steady state within MAX_DAYS (e.g. an overloaded station
+# whose queue grows day after day) has no warm start: Warmup_Error is raised and
+# nothing is cached, the caller reports it or starts cold.
+###################################################################################
+import os
+import math
+import logging
+import main
+import users
+import horizon
+import snapshot
+import temperature
+import replication
+import result_cache
+
+logger = logging.getLogger('main.warmup')
+
+WARMUP_VERSION = 2                                              # increase to invalidate all cached warm states
+WARMUP_SEED = 0                                                 # seed of the burn-in, the warm state does not depend on the run seed
+MIN_DAYS = 2                                                    # minimal number of burn-in days
+MAX_DAYS = 10                                                   # the burn-in ends after MAX_DAYS without steady state (logged)
+ALPHA = 0.05                                                    # significance level of the stationarity test
+RUN_KEYS = ["seed", "warm_start", "sim_days", "sim_ticks", "sim_engine", "trace_file", "state_trace_file", "checkpoint_file"]   # not part of the configuration
+
+warm_states = {}                                                # in process cache: configuration key -> Sim_Snapshot
+unsteady = {}                                                   # configuration key -> message of the failed burn-in
+
+class Warmup_Error(Exception):
+    '''
+    the burn-in of the configuration reached no steady state within MAX_DAYS
+    '''
+    pass
+
+def get_config_key(param : dict):
+    '''
+    key of the configuration: param without the keys of the single run (see RUN_KEYS)
+    '''
+    config = {name: value for name, value in param.items() if name not in RUN_KEYS}
+    config["warmup"] = [WARMUP_VERSION, WARMUP_SEED, MIN_DAYS, MAX_DAYS, ALPHA]
+    return result_cache.get_key(config)
+
+def paired_t_test(values : list, reference : list):
+    '''
+    two sided paired t-test of the hourly values of two days, return p-value of "no difference"
+    '''
+    differences = [a - b for a, b in zip(values, reference)]
+    n = len(differences)
+    mean = sum(differences) / n
+    variance = sum((d - mean) ** 2 for d in differences) / (n - 1)
+    if variance == 0:
+        return 1.0 if mean == 0 else 0.0
+    t = mean / math.sqrt(variance / n)
+    return 2 * (1 - replication.t_cdf(abs(t), n - 1))
+
+def get_rack_soc(station):
+    '''
+    mean SOC of the batteries in the racks of all swap racks
+    '''
+    soc_list = []
+    for swap_rack in station.swap_rack_list:
+        soc_list.extend(swap_rack.get_rack_battery_soc())
+    return sum(soc_list) / len(soc_list) if len(soc_list) > 0 else 0
+
+def simulate_day(param : dict, station, sim_state : dict, rng_streams : dict, start_tick : int):
+    '''
+    simulate one burn-in day hour by hour, return (hourly rack SOC at the end of the hour, hourly mean queue length)
+    '''
+    interval = param["sim_interval"]
+    day_ticks = int(horizon.DAY_SECONDS / interval)
+    hour_ticks = int(3600 / interval)
+    user_dist_lst, user_label = main.create_user_queue(param, rng_streams)
+    user_dist_lst = [t + start_tick * interval for t in user_dist_lst]
+    sim_state["arrival_index"] = users.create_arrival_index(user_dist_lst, user_label, day_ticks, interval, start_tick)
+    station.set_grid_interaction(param["grid_interaction_idx"], interval, start_tick)
+    rack_soc = []
+    queue_length = []
+    for hour in range(24):
+        ticks = min(hour_ticks, day_ticks - hour * hour_ticks)
+        main.do_simulation_loop(param, station, sim_state, user_dist_lst, user_label, ticks, interval, start_tick + hour * hour_ticks)
+        rack_soc.append(get_rack_soc(station))
+        queue_length.append(sum(s + c for s, c in zip(sim_state["queue_length_swap"][-ticks:], sim_state["queue_length_charge"][-ticks:])) / ticks)
+    return rack_soc, queue_length
+
+def rebase(station, sim_state : dict, offset : int):
+    '''
+    shift the ticks of the waiting and serviced users and of the batteries by -offset, tick 0 becomes the
+    midnight after the burn-in (users waiting since before midnight have negative arrival ticks)
+    '''
+    waiting = list(sim_state["swap_queue"].queue) + list(sim_state["charge_queue"].queue) + [sim_state["swap_user"], sim_state["charge_user"]]
+    batteries = []
+    for user in waiting:
+        if user is None:
+            continue
+        for name in ["sequence", "swap_start_time", "swap_complete_time", "charge_connect_time"]:
+            if getattr(user, name) != -1:
+                setattr(user, name, getattr(user, name) - offset)
+        batteries.append(user.battery)
+    for swap_rack in station.swap_rack_list:
+        batteries.extend(battery_rack.battery for battery_rack in swap_rack.battery_rack_list)
+        if swap_rack.charge_pile_list is not None:
+            batteries.extend(pile.vehicle_battery for pile in swap_rack.charge_pile_list)
+    for battery in set(batteries):
+        if battery is None:
+            continue
+        if battery.charge_start_time != -1:
+            battery.charge_start_time -= offset
+        if battery.charge_end_time != -1:
+            battery.charge_end_time -= offset
+
+def run_burn_in(param : dict):
+    '''
+    run the burn-in of the configuration of param until steady state (MIN_DAYS .. MAX_DAYS days)
+    return the snapshot of the warm state at tick 0, extra: {"days": burn-in days, "steady": bool}
+    without steady state the snapshot is the state after MAX_DAYS, it is no warm start (see get_warm_snapshot)
+    '''
+    interval = param["sim_interval"]
+    day_ticks = int(horizon.DAY_SECONDS / interval)
+    station = main.create_station(param)
+    rng_streams = users.create_rng_streams(WARMUP_SEED)
+    sim_state = main.init_sim_state()
+    sim_state["rng_streams"] = rng_streams
+    sim_state["temperature"] = temperature.create_profile(param)
+
+    reference = None
+    steady = False
+    day = 0
+    while day < MAX_DAYS and not steady:
+        rack_soc, queue_length = simulate_day(param, station, sim_state, rng_streams, day * day_ticks)
+        horizon.collect_day(station, sim_state, interval)       # release the records of the day
+        day += 1
+        if reference is not None and day >= MIN_DAYS:
+            p_soc = paired_t_test(rack_soc, reference[0])
+            p_queue = paired_t_test(queue_length, reference[1])
+            steady = p_soc > ALPHA and p_queue > ALPHA
+            logger.info('burn-in day %d: p-value rack soc %.3f, queue length %.3f', day, p_soc, p_queue)
+        reference = (rack_soc, queue_length)
+    if not steady:
+        logger.error('burn-in: no steady state after %d days', day)
+
+    # keep only the waiting users and the user in service, the serviced users belong to the burn-in
+    for name in ["nio_charge_list", "non_nio_charge_list", "swap_list", "queue_length_swap", "queue_length_charge", "swap_user_wait_time", "charge_user_wait_time"]:
+        sim_state[name] = []
+    sim_state["arrival_index"] = None
+    sim_state["temperature"] = None
+    rebase(station, sim_state, day * day_ticks)
+    station.set_grid_interaction(param["grid_interaction_idx"], interval)
+    return snapshot.take_snapshot(param, station, sim_state, [], [], 0, extra={"days": day, "steady": steady})
+
+def is_steady(warm):
+    '''
+    True if the snapshot of run_burn_in reached steady state
+    '''
+    extra = warm.restore()["extra"]
+    return extra is not None and extra.get("steady", False)
+
+def get_warm_snapshot(param : dict, cache_dir = None):
+    '''
+    return the warm state snapshot of the configuration of param, from memory, from disk or by a new burn-in
+    cache_dir: folder of the snapshot files, None -> ".warmup_cache" beside this file
+    raise Warmup_Error if the burn-in reaches no steady state (not cached, a later call of the same configuration
+    in this process raises without a new burn-in)
+    '''
+    key = get_config_key(param)
+    warm = warm_states.get(key)
+    if warm is not None:
+        return warm
+    if key in unsteady:
+        raise Warmup_Error(unsteady[key])
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".warmup_cache")
+    path = os.path.join(cache_dir, key + ".snap")
+    try:
+        warm = snapshot.load_snapshot(path)
+        if not is_steady(warm):
+            warm = None
+    except (OSError, snapshot.Snapshot_Error):
+        warm = None
+    if warm is None:
+        warm = run_burn_in(param)
+        if not is_steady(warm):
+            unsteady[key] = "no steady state within %d burn-in days, the queue of the configuration does not settle " \
+                            "(overloaded station?), no warm start" % MAX_DAYS
+            raise Warmup_Error(unsteady[key])
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            warm.save(path)
+        except OSError as e:
+            logger.info('warm state can not be saved in %s (%s), kept in memory', cache_dir, e)
+    warm_states[key] = warm
+    return warm
+
+def get_warm_state(param : dict):
+    '''
+    return (station, sim_state) of the warm start of param, a new independent copy for every call
+    raise Warmup_Error without steady state (see get_warm_snapshot)
+    the random streams, the arrivals and the temperature profile of the run are set by the caller
+    '''
+    run = get_warm_snapshot(param).restore()
+    return run["station"], run["sim_state"]
@@ -31,8 +31,15 @@ import random
 
 # import the model and global parameters
 import main
+import users
 import global_param
+import replication
+import result_cache
+import horizon
+import capacity
+import warmup
 GC = global_param.Global_Constant()
+simulation_cache = result_cache.Result_Cache()     # seeded scenarios are loaded from disk instead of simulated again
 
 ##################################
 ##### Function Declaration #######
@@ -48,7 +55,11 @@ def energy_calc(power, time_interval):
 
 # calculate the area user number, divide them randomly to the respective stations
 @st.cache
-def areaNumDivision(station_num, area_user_num):
+def areaNumDivision(station_num, area_user_num, rng_seed = None):
+    # rng_seed: seed of the station splitting stream (see users.create_rng_streams), None -> global random state
+    rng = None
+    if rng_seed is not None:
+        rng = users.create_rng_streams(rng_seed)["station"]
     result = []
     remain = station_num
     max_num = int((area_user_num / station_num) * 1.5) # upper limit of each slice
@@ -57,15 +68,67 @@ def areaNumDivision(station_num, area_user_num):
         remain -= 1
         if remain > 0:
             if remain <= area_user_num: # num of area user >= num of remaining station num
-                slice_num = random.randint(min_num, min(area_user_num - remain, max_num))
+                if rng is None:
+                    slice_num = random.randint(min_num, min(area_user_num - remain, max_num))
+                else:
+                    slice_num = int(rng.integers(min_num, min(area_user_num - remain, max_num) + 1))
             else:
-                slice_num = random.randint(0, area_user_num)
+                if rng is None:
+                    slice_num = random.randint(0, area_user_num)
+                else:
+                    slice_num = int(rng.integers(0, area_user_num + 1))
         else: # if all number of user divided, then rests are 0
             slice_num = area_user_num
         result.append(slice_num)
         area_user_num -= slice_num
     return result # return the sliced number list
 
+# simulate the recommended PSS of the power assistant under the different transformer power levels
+def check_transformer_power(pss_type_name, power_levels, swap_number, psc_required, seed = 1):
+    # every level is simulated with the same seed (same user arrivals), the station power is limited to the transformer power
+    # return list of (transformer power [kW], KPI dict of main.get_kpis)
+    if pss_type_name == "PSS 2.0":
+        station_type = GC.GEN2_530kW
+        swap_time = 6.5
+    elif pss_type_name == "PSS 3.0 PUS A":
+        station_type = GC.GEN3_600kW
+        swap_time = 4.5
+    else:
+        station_type = GC.GEN3_1200kW
+        swap_time = 4.5
+    psc_num = station_type["max_charge_terminal"] if psc_required or pss_type_name == "PSS 3.0 PUS B" else 0
+    levels = [level for level in power_levels if level < station_type["max_power"]] + [station_type["max_power"]]
+    kpi_list = []
+    for level in levels:
+        param = {
+            "station_type" : station_type,
+            "psc_num" : psc_num,
+            "battery_config" : {"100kWh": station_type["max_battery_number"], "75kWh": 0},
+            "init_battery_soc_in_PSS" : 0.95,
+            "target_soc" : 0.9,
+            "select_soc" : 0.95,
+            "nio_user_num" : swap_number,
+            "non_nio_user_num" : 0,
+            "sim_days" : 1,
+            "sim_interval" : 10,
+            "sim_ticks" : 8640,
+            "swap_rack_temperature" : 25,
+            "user_sequence_mode" : "statistical",
+            "user_area" : "urban",
+            "user_preference" : "full_swap",
+            "charge_power_redist" : False,
+            "enable_me_switch" : 1,
+            "power_dist_option" : "PSS preferred",
+            "service_ratio": 70,
+            "grid_interaction_idx" : -1,
+            "interaction_num" : 0,
+            "swap_time" : swap_time,
+            "grid_power_cap" : [[0, 24, level]],
+            "seed" : seed
+        }
+        kpi_list.append((level, main.get_kpis(simulation_cache.run(param), param["sim_interval"])))
+    return kpi_list
+
 # convert the dataframe into csv format
 @st.cache
 def convert_df(df):
@@ -110,6 +173,8 @@ with tab1:
     col_l5, col_r5 = st.columns(2)
     col_l6, col_r6 = st.columns(2)
     col_l7, col_r7 = st.columns(2)
+    col_l18, col_r18 = st.columns(2)
+    col_l19, col_r19 = st.columns(2)
     
     st.markdown("# Step 2: Simulation Initiation")
     st.write("Press the button to start the simulation")
@@ -348,12 +413,13 @@ with col_l6: # power distribution strategy
     st.write("")
     st.markdown("### Power Distribution")
     help_power_dist = "When select 'PSS prefered', the power modules will preferentially supply the battery in the station,\
-         and then the redundancy will be allocated to the PSC; otherwise the PSCs have the highest priority to use the power module."
+         and then the redundancy will be allocated to the PSC; 'PSC preferred' gives the PSCs the highest priority to use the power module; \
+         'Optimal' solves the module allocation that maximizes the charging power of every time step under the station max power."
     if type_pss == "PSS 2.0 - 500kW" or psc_num == 0:
         st.write("This type of PSS is not equipped with PSC, only swap service avaiable.")
         power_dist_option = "PSS preferred"
     else:
-        power_dist_option = st.selectbox("Select the Power distribution Strategy", ["PSS preferred", "PSC preferred"], help=help_power_dist)
+        power_dist_option = st.selectbox("Select the Power distribution Strategy", ["PSS preferred", "PSC preferred", "Optimal"], help=help_power_dist)
     st.write("")
 
 with col_r6: # non nio user num
@@ -429,10 +495,73 @@ with col_r7: # grid interactive time interval
             interaction_num = st.slider("Select the number of interactions that will be performed within the interval", 1, 6, help=numIntervalHelp)
     st.write("")
 
+with col_l18: # trigger of Monte Carlo replication
+    st.write("")
+    st.markdown("### Monte Carlo Replication")
+    replication_help = "One simulation run is a single random sample of user arrivals, SOC and preferences. \
+        If activated, the simulation is repeated with independent seeds until the confidence interval of the \
+        swap ratio in 15 minutes is narrow enough, the statistics of the key characteristics are displayed."
+    replication_trigger = st.radio("Request for Monte Carlo replication", [True, False], index=1, help=replication_help)
+    st.write("")
+
+with col_r18: # replication stop criterion
+    st.write("")
+    st.markdown("### Replication Stop Criterion")
+    if replication_trigger == False:
+        st.write("The Monte Carlo replication is deactivated")
+        max_replicas = 0
+        target_half_width = 0
+    else:
+        max_replicas = st.slider("Maximal number of replications", 5, 100, value=30)
+        target_half_width = st.number_input("95% confidence interval half width of swap ratio in 15 min [%]", min_value=0.1, max_value=20.0, value=2.0, step=0.1)
+    st.write("")
+
+with col_l19: # transformer power limit
+    st.write("")
+    st.markdown("### Transformer Power Limit")
+    transformer_help = "Upper limit of the station charging power. If the power modules request more, the output of all modules \
+        is curtailed proportionally. 0 means the station max power is the only limit."
+    transformer_power = st.number_input("Give the transformer power limit [kW]", min_value=0, max_value=2000, value=0, step=10, help=transformer_help)
+    st.write("")
+
+with col_r19: # time of day grid power limit
+    st.write("")
+    st.markdown("### Time of Day Power Limit")
+    peak_limit_help = "Additional power limit within a time window of the day, e.g. a grid peak load restriction. \
+        A window with start hour > end hour passes midnight."
+    peak_limit_trigger = st.checkbox("Activate the time of day power limit", help=peak_limit_help)
+    grid_power_cap = []
+    if transformer_power > 0:
+        grid_power_cap.append([0, 24, transformer_power])
+    if peak_limit_trigger:
+        peak_start, peak_end = st.select_slider("Select the time window [hour]", options=list(range(25)), value=(17, 21))
+        peak_power_limit = st.number_input("Give the power limit within the time window [kW]", min_value=0, max_value=2000, value=300, step=10)
+        grid_power_cap.append([peak_start, peak_end, peak_power_limit])
+    st.write("")
+
 with col_m1:
     ######################################################################
     ########### Excute the simulation if the button is pressed ###########
     ######################################################################
+    seed_help = "Simulations with the same seed and configuration give identical results. -1 means a random seed for every run."
+    single_seed = st.number_input("Random seed", min_value=-1, max_value=2**31 - 1, value=-1, step=1, help=seed_help, key="single_seed")
+    days_help = "More than one day simulates consecutive days with new arrivals every day, the batteries and queues carry over midnight. \
+        The results are shown as key characteristics per day."
+    sim_days_input = st.number_input("Simulation days", min_value=1, max_value=365, value=1, step=1, help=days_help, key="sim_days")
+    day_file_mode = "sample"
+    if sim_days_input > 1 and user_queue_mode == "statistical":
+        day_file_mode = st.selectbox("Day files of the statistical queue", ("sample", "cycle"), index=0, help="sample: random day file every day, cycle: run through the day files")
+    temperature_help = "The seasonal profile derives the ambient temperature of every time step from the monthly max/min temperatures, \
+        the climate controlled battery rack follows it between 15 and 30 degree. The temperature changes the charge current limits and the user preference."
+    temperature_mode = st.selectbox("Temperature", ("constant 25 degree", "seasonal profile"), index=0, help=temperature_help)
+    temperature_profile = None
+    if temperature_mode == "seasonal profile":
+        start_day = st.number_input("Start day of the year", min_value=1, max_value=365, value=1, step=1)
+        temperature_profile = {"start_day": int(start_day)}
+    warm_help = "The station starts in the steady state of the configuration instead of with all batteries at the initial soc: \
+        the configuration is simulated day after day until the daily cycle repeats (the first run of a configuration takes longer). \
+        An overloaded station never settles, it starts with the initial soc."
+    warm_start = st.checkbox("Warm start", value=False, help=warm_help)
     st.write("===========================")
     button_flag_1 = st.button("Start Single Station Simulation")
     st.write("===========================")
@@ -444,7 +573,7 @@ if button_flag_1 == True:
         # collect the setup congiuration into dict "param", prepare to transport into do_simulation(param) #
         ####################################################################################################
         sim_interval = 10
-        sim_days = 1
+        sim_days = int(sim_days_input)
         sim_ticks = int(sim_days * 24 * 60 * 60 / sim_interval)  
 
         param = {
@@ -471,110 +600,170 @@ if button_flag_1 == True:
             "service_ratio": user_selection_ratio,                              # when select fixed ratio of service, configure the specific value
             "grid_interaction_idx" : grid_interaction_interval_idx,             # the time interval of execution of grid interaction, -1 -> service deactivated
             "interaction_num" : interaction_num,                                # define the times that interaction will perform
-            "swap_time" : swap_time                                             # configure the swap time
+            "swap_time" : swap_time,                                            # configure the swap time
+            "grid_power_cap" : grid_power_cap,                                  # time of day power limits [[start_hour, end_hour, kW], ...], station max power always applies
+            "day_file_mode" : day_file_mode,                                    # day files of a multi day run in statistical mode: "sample" or "cycle"
+            "temperature_profile" : temperature_profile,                        # seasonal rack & ambient temperature, None -> constant swap_rack_temperature
+            "warm_start" : warm_start,                                          # start in the steady state of the configuration (burn-in, see warmup)
+            "seed" : int(single_seed) if single_seed >= 0 else None             # seed of the random streams, None -> random
         }
 
-        # container preparation
-        user_dist_lst = []
-        power_history = []
-        residual_power = []
-        swap_list = []
-        nio_charge_list = []
-        non_nio_charge_list = []
-        power_mean_list = []
-        max_power = 0
-        nio_average_time_charge = 0
-        non_nio_average_time_chagre = 0
-        average_time_swap = 0
-        swap_ratio_in_15_min = 0
-        queue_length_swap = []
-        queue_length_charge = []
-        queue_overflow_number = []
-        queue_overflow_ratio = 0
-
-        # perform simulation 
-        swap_user_wait_time, charge_user_wait_time, queue_length_swap, queue_length_charge, user_dist_lst, max_power, power_history, residual_power, swap_list, \
-        nio_charge_list, non_nio_charge_list, average_time_swap, nio_average_time_charge, non_nio_average_time_chagre, swap_ratio_in_15_min = main.do_simulation(param = param)
+        if warm_start:
+            try:
+                warmup.get_warm_snapshot(param)                         # burn-in of the configuration, cached
+            except warmup.Warmup_Error as e:
+                success_info_single_station.warning("Warm start not possible: %s. The simulation starts with the initial battery soc." % e)
+                param["warm_start"] = False
+
+        horizon_data = None
+        if sim_days > 1:
+            # multi day run: key characteristics per day, the batteries and queues carry over midnight
+            day_bar = success_info_single_station.progress(0)
+            def update_day_bar(day, kpis):
+                day_bar.progress((day + 1) / sim_days)
+            day_kpis, summary = horizon.do_horizon_simulation(param, day_callback=update_day_bar)
+            horizon_data = pd.DataFrame(day_kpis).set_index("day")
+            result_data = {
+                "Total Number of Arrived Clients" : summary["user_num"],
+                "Total Number of Serviced Swap Clients" : summary["swap_num"],
+                "Total Number of Serviced Charge Clients" : summary["nio_charge_num"] + summary["non_nio_charge_num"],
+                "Number of Serviced NIO Charge Clients" : summary["nio_charge_num"],
+                "Number of Serviced Non NIO Charge Clients" : summary["non_nio_charge_num"],
+                "Overflow Number at the End" : summary["queue_overflow"],
+                "Maximal Queue Length" : summary["max_queue_length"],
+                "Total Energy [kWh]" : summary["energy"],
+                "Average Daily Energy [kWh]" : summary["energy"] / sim_days,
+                "Grid Interaction Energy [kWh]" : summary["grid_energy"],
+                "Curtailed Energy by Power Limit [kWh]" : summary["curtailed_energy"],
+                "Peak Power [kW]" : summary["peak_power"],
+                "Swap Ratio in 15 Minutes [%]" : summary["swap_ratio_in_15_min"] * 100,
+                "Average Swap Time [minutes]" : summary["average_time_swap"],
+                "Average Swap Wait Time [minutes]" : summary["average_swap_wait_time"],
+                "Average Charge Time for NIO Group [minutes]" : summary["nio_average_time_charge"],
+                "Average Charge Time for Non NIO Group [minutes]" : summary["non_nio_average_time_charge"]
+            }
+        else:
+            # container preparation
+            user_dist_lst = []
+            power_history = []
+            residual_power = []
+            swap_list = []
+            nio_charge_list = []
+            non_nio_charge_list = []
+            power_mean_list = []
+            max_power = 0
+            nio_average_time_charge = 0
+            non_nio_average_time_chagre = 0
+            average_time_swap = 0
+            swap_ratio_in_15_min = 0
+            queue_length_swap = []
+            queue_length_charge = []
+            queue_overflow_number = []
+            queue_overflow_ratio = 0
+
+            # perform simulation 
+            swap_user_wait_time, charge_user_wait_time, queue_length_swap, queue_length_charge, user_dist_lst, max_power, power_history, residual_power, swap_list, \
+            nio_charge_list, non_nio_charge_list, average_time_swap, nio_average_time_charge, non_nio_average_time_chagre, swap_ratio_in_15_min = simulation_cache.run(param)
         
-        # 1. calculate time step
-        day_step = sim_days + 1
-        date1 = datetime.date(2022,1,1)
-        date2 = datetime.date(2022,1,day_step)
-        delta = datetime.timedelta(seconds = sim_interval)
-        dates = mdates.drange(date1, date2, delta)
+            # 1. calculate time step
+            day_step = sim_days + 1
+            date1 = datetime.date(2022,1,1)
+            date2 = datetime.date(2022,1,day_step)
+            delta = datetime.timedelta(seconds = sim_interval)
+            dates = mdates.drange(date1, date2, delta)
         
-        # 2. success ratio within 15 min
-        ratio_persentage = swap_ratio_in_15_min * 100
-
-        # 3. energy consumption
-        y_func = []
-        y_grid_func = []
-        for pw in power_history:
-            # collect the power distribution pro sim interval
-            if pw[1] >= 0:
-                y_func.append(pw[1])
-                y_grid_func.append(0)
-            else:
-                y_func.append(0)
-                y_grid_func.append(pw[1])
+            # 2. success ratio within 15 min
+            ratio_persentage = swap_ratio_in_15_min * 100
+
+            # 3. energy consumption
+            y_func = []
+            y_grid_func = []
+            for pw in power_history:
+                # collect the power distribution pro sim interval
+                if pw[1] >= 0:
+                    y_func.append(pw[1])
+                    y_grid_func.append(0)
+                else:
+                    y_func.append(0)
+                    y_grid_func.append(pw[1])
             
         
-        power_mean = np.mean(y_func)
-        for i in range(len(dates)):
-            # collect the mean value of the power distribution
-            power_mean_list.append(power_mean)      
-        total_energy = energy_calc(y_func, sim_interval)
-        grid_interaction_energy = abs(energy_calc(y_grid_func, sim_interval))
-
-        # 4. total average charge time and charge rate calculation
-        if nio_average_time_charge!=0 and non_nio_average_time_chagre!=0:
-            total_average_charge_time = (nio_average_time_charge * len(nio_charge_list) + non_nio_average_time_chagre * len(non_nio_charge_list)) / (len(nio_charge_list) + len(non_nio_charge_list))
-            total_charge_rate = 60 / total_average_charge_time
-            nio_charge_rate = 60 / nio_average_time_charge
-            non_nio_charge_rate = 60 / non_nio_average_time_chagre
-        else:
-            total_average_charge_time = 0
-            total_charge_rate = 0
-            nio_charge_rate = 0
-            non_nio_charge_rate = 0
+            power_mean = np.mean(y_func)
+            for i in range(len(dates)):
+                # collect the mean value of the power distribution
+                power_mean_list.append(power_mean)      
+            total_energy = energy_calc(y_func, sim_interval)
+            grid_interaction_energy = abs(energy_calc(y_grid_func, sim_interval))
+            curtailed_energy = energy_calc([pw[2] for pw in power_history], sim_interval)
+
+            # 4. total average charge time and charge rate calculation
+            if nio_average_time_charge!=0 and non_nio_average_time_chagre!=0:
+                total_average_charge_time = (nio_average_time_charge * len(nio_charge_list) + non_nio_average_time_chagre * len(non_nio_charge_list)) / (len(nio_charge_list) + len(non_nio_charge_list))
+                total_charge_rate = 60 / total_average_charge_time
+                nio_charge_rate = 60 / nio_average_time_charge
+                non_nio_charge_rate = 60 / non_nio_average_time_chagre
+            else:
+                total_average_charge_time = 0
+                total_charge_rate = 0
+                nio_charge_rate = 0
+                non_nio_charge_rate = 0
             
-        if average_time_swap != 0:
-            swap_rate = 60 / average_time_swap
-        else:
-            swap_rate = 0
+            if average_time_swap != 0:
+                swap_rate = 60 / average_time_swap
+            else:
+                swap_rate = 0
         
-        # 5. overflow of service user
-        queue_overflow_number.append(queue_length_swap[-1])
-        queue_overflow_number.append(queue_length_charge[-1])
-        if len(user_dist_lst) != 0:
-            queue_overflow_ratio = round((sum(queue_overflow_number) / len(user_dist_lst)) * 100, 2)
-        else:
-            queue_overflow_ratio = 0
-        # ====================== summary the result in a table =============================
-
-        result_data = {
-            "Total Number of Serviced Swap Clients" : len(swap_list),
-            "Total Number of Serviced Charge Clients" : len(nio_charge_list) + len(non_nio_charge_list),
-            "Number of Serviced NIO Charge Clients" : len(nio_charge_list),
-            "Number of Serviced Non NIO Charge Clients" : len(non_nio_charge_list),
-            "Overflow Number of Swap Queue" : queue_overflow_number[0],
-            "Overflow Number of Charge Queue" : queue_overflow_number[1],
-            "Total Overflow Ratio [%]" : queue_overflow_ratio,
-            "Total Energy [kWh]" : total_energy,
-            "Grid Interaction Energy [kWh]" : grid_interaction_energy,
-            "Swap Ratio in 15 Minutes [%]" : ratio_persentage,
-            "Average Swap Time [minutes]" : average_time_swap,
-            "Average Swap Rate [1/hours]" : swap_rate,
-            "Average Charge Time for All Clients Group [minutes]" : total_average_charge_time,
-            "Average Total Charge Rate [1/hours]" : total_charge_rate,
-            "Average Charge Time for NIO Group [minutes]" : nio_average_time_charge,
-            "Average Charge Rate for NIO Group [1/hours]" : nio_charge_rate,
-            "Average Charge Time for Non NIO Group [minutes]" : non_nio_average_time_chagre,
-            "Average Charge Time for Non NIO Group [1/hours]" : non_nio_charge_rate
-        }
+            # 5. overflow of service user
+            queue_overflow_number.append(queue_length_swap[-1])
+            queue_overflow_number.append(queue_length_charge[-1])
+            if len(user_dist_lst) != 0:
+                queue_overflow_ratio = round((sum(queue_overflow_number) / len(user_dist_lst)) * 100, 2)
+            else:
+                queue_overflow_ratio = 0
+            # ====================== summary the result in a table =============================
+
+            result_data = {
+                "Total Number of Serviced Swap Clients" : len(swap_list),
+                "Total Number of Serviced Charge Clients" : len(nio_charge_list) + len(non_nio_charge_list),
+                "Number of Serviced NIO Charge Clients" : len(nio_charge_list),
+                "Number of Serviced Non NIO Charge Clients" : len(non_nio_charge_list),
+                "Overflow Number of Swap Queue" : queue_overflow_number[0],
+                "Overflow Number of Charge Queue" : queue_overflow_number[1],
+                "Total Overflow Ratio [%]" : queue_overflow_ratio,
+                "Total Energy [kWh]" : total_energy,
+                "Grid Interaction Energy [kWh]" : grid_interaction_energy,
+                "Curtailed Energy by Power Limit [kWh]" : curtailed_energy,
+                "Swap Ratio in 15 Minutes [%]" : ratio_persentage,
+                "Average Swap Time [minutes]" : average_time_swap,
+                "Average Swap Rate [1/hours]" : swap_rate,
+                "Average Charge Time for All Clients Group [minutes]" : total_average_charge_time,
+                "Average Total Charge Rate [1/hours]" : total_charge_rate,
+                "Average Charge Time for NIO Group [minutes]" : nio_average_time_charge,
+                "Average Charge Rate for NIO Group [1/hours]" : nio_charge_rate,
+                "Average Charge Time for Non NIO Group [minutes]" : non_nio_average_time_chagre,
+                "Average Charge Time for Non NIO Group [1/hours]" : non_nio_charge_rate
+            }
 
         result_data = pd.DataFrame.from_dict(result_data, orient='index', columns=['Values'])
         result_data = result_data.reset_index().rename(columns={'index': 'Key Characteristics'})
+
+        # Monte Carlo replication of the same configuration
+        replication_data = None
+        if replication_trigger == True and sim_days > 1:
+            success_info_single_station.info("the Monte Carlo replication is only available for single day simulations")
+        elif replication_trigger == True:
+            replication_bar = success_info_single_station.progress(0)
+            def update_replication_bar(n_done, summary):
+                replication_bar.progress(min(n_done / max_replicas, 1.0))
+            replication_result = replication.run_replications(param, target_half_width={"swap_ratio_in_15_min": target_half_width / 100},
+                                                              max_replicas=max_replicas, seed=param["seed"], callback=update_replication_bar)
+            replication_bar.progress(1.0)
+            replication_data = pd.DataFrame.from_dict(replication_result["summary"], orient='index')
+            replication_data = replication_data.reset_index().rename(columns={'index': 'Key Characteristics'})
+            if replication_result["converged"]:
+                success_info_single_station.info("replication converged after %d runs" % replication_result["replicas"])
+            else:
+                success_info_single_station.warning("confidence interval not reached within %d runs" % replication_result["replicas"])
     success_info_single_station.success("simulation successfully excuted.")
 st.write("")
 st.write("")
@@ -898,24 +1087,26 @@ with col_l12: # urban power distribution
     st.write("")
     st.markdown("### Urban Power Distribution")
     help_power_dist = "When select 'PSS prefered', the power modules will preferentially supply the battery in the station,\
-         and then the redundancy will be allocated to the PSC; otherwise the PSCs have the highest priority to use the power module."
+         and then the redundancy will be allocated to the PSC; 'PSC preferred' gives the PSCs the highest priority to use the power module; \
+         'Optimal' solves the module allocation that maximizes the charging power of every time step under the station max power."
     if type_urban_pss == "PSS 2.0 - 500kW" or urban_psc_num == 0:
         st.write("This type of PSS is not equipped with PSC, only swap service avaiable.")
         urban_power_dist_option = "PSS preferred"
     else:
-        urban_power_dist_option = st.radio("Select the power distribution strategy for urban stations", ["PSS preferred", "PSC preferred"], help=help_power_dist)
+        urban_power_dist_option = st.radio("Select the power distribution strategy for urban stations", ["PSS preferred", "PSC preferred", "Optimal"], help=help_power_dist)
     st.write("")
 
 with col_r12: # suburb power distribution
     st.write("")
     st.markdown("### Suburb Power Distribution")
     help_power_dist = "When select 'PSS prefered', the power modules will preferentially supply the battery in the station,\
-         and then the redundancy will be allocated to the PSC; otherwise the PSCs have the highest priority to use the power module."
+         and then the redundancy will be allocated to the PSC; 'PSC preferred' gives the PSCs the highest priority to use the power module; \
+         'Optimal' solves the module allocation that maximizes the charging power of every time step under the station max power."
     if type_suburb_pss == "PSS 2.0 - 500kW" or suburb_psc_num == 0:
         st.write("This type of PSS is not equipped with PSC, only swap service avaiable.")
         suburb_power_dist_option = "PSS preferred"
     else:
-        suburb_power_dist_option = st.radio("Select the power distribution strategy for suburb stations", ["PSS preferred", "PSC preferred"], help=help_power_dist)
+        suburb_power_dist_option = st.radio("Select the power distribution strategy for suburb stations", ["PSS preferred", "PSC preferred", "Optimal"], help=help_power_dist)
     st.write("")
 
 with col_l13: # urban user preference
@@ -1035,6 +1226,8 @@ with col_r17: # suburb non nio user num
     st.write("")
 
 with col_m2:
+    seed_help = "Simulations with the same seed and configuration give identical results. -1 means a random seed for every run."
+    multi_seed = st.number_input("Random seed", min_value=-1, max_value=2**31 - 1, value=-1, step=1, help=seed_help, key="multi_seed")
     st.write("===========================")
     button_flag_2 = st.button("Start Multiple Station Simulation")
     st.write("===========================")
@@ -1055,26 +1248,32 @@ if button_flag_2 == True:
     delta = datetime.timedelta(seconds = sim_interval)
     dates = mdates.drange(date1, date2, delta)
 
+    # seed of the station splitting stream, one per division
+    def get_split_seed(division_idx):
+        if multi_seed < 0:
+            return None
+        return [int(multi_seed), division_idx]
+
     if urban_nio_user_num != 0:
-        urban_nio_user_num_list = areaNumDivision(num_urban_pss, urban_nio_user_num)
+        urban_nio_user_num_list = areaNumDivision(num_urban_pss, urban_nio_user_num, rng_seed=get_split_seed(0))
     else:
         urban_nio_user_num_list = list(np.zeros(num_urban_pss))
         urban_nio_user_num_list = [int(s) for s in urban_nio_user_num_list]
     
     if urban_non_nio_user_num != 0:
-        urban_non_nio_user_num_list = areaNumDivision(num_urban_pss, urban_non_nio_user_num)
+        urban_non_nio_user_num_list = areaNumDivision(num_urban_pss, urban_non_nio_user_num, rng_seed=get_split_seed(1))
     else:
         urban_non_nio_user_num_list = list(np.zeros(num_urban_pss))
         urban_non_nio_user_num_list = [int(s) for s in urban_non_nio_user_num_list]
 
     if suburb_nio_user_num != 0:
-        suburb_nio_user_num_list = areaNumDivision(num_suburb_pss, suburb_nio_user_num)
+        suburb_nio_user_num_list = areaNumDivision(num_suburb_pss, suburb_nio_user_num, rng_seed=get_split_seed(2))
     else:
         suburb_nio_user_num_list = list(np.zeros(num_suburb_pss))
         suburb_nio_user_num_list = [int(s) for s in suburb_nio_user_num_list]
     
     if suburb_non_nio_user_num != 0:
-        suburb_non_nio_user_num_list = areaNumDivision(num_suburb_pss, suburb_non_nio_user_num)
+        suburb_non_nio_user_num_list = areaNumDivision(num_suburb_pss, suburb_non_nio_user_num, rng_seed=get_split_seed(3))
     else:
         suburb_non_nio_user_num_list = list(np.zeros(num_suburb_pss))
         suburb_non_nio_user_num_list = [int(s) for s in suburb_non_nio_user_num_list]
@@ -1097,6 +1296,7 @@ if button_flag_2 == True:
     queue_length_charge = []
     queue_overflow_number = []
     queue_overflow_ratio = []
+    param_list = []                                                             # param of all stations, urban first then suburb
 
     # Simulation initiating...
     with st.spinner("simulation initiating..."):
@@ -1129,27 +1329,9 @@ if button_flag_2 == True:
                 "interaction_num" : urban_interaction_num,                          # define the times that interaction will perform
                 "swap_time" : urban_swap_time                                       # configure the swap time
             }
-            swap_user_wait_time_i, charge_user_wait_time_i, queue_length_swap_i, queue_length_charge_i, user_dist_lst_i, max_power_i, power_history_i, residual_power_i, swap_list_i, nio_charge_list_i, non_nio_charge_list_i,\
-            average_time_swap_i, nio_average_time_charge_i, non_nio_average_time_charge_i, swap_ratio_in_15_min_i = main.do_simulation(param = urban_param)
-            
-            swap_user_wait_time.append(swap_user_wait_time_i)
-            charge_user_wait_time.append(charge_user_wait_time_i)
-            queue_length_swap.append(queue_length_swap_i)
-            queue_length_charge.append(queue_length_charge_i)
-            user_dist_lst.append(user_dist_lst_i)
-            max_power.append(max_power_i)
-            power_history.append(power_history_i)
-            residual_power.append(residual_power_i)
-            swap_list.append(swap_list_i)
-            nio_charge_list.append(nio_charge_list_i)
-            non_nio_charge_list.append(non_nio_charge_list_i)
-            nio_average_time_charge.append(nio_average_time_charge_i)
-            non_nio_average_time_charge.append(non_nio_average_time_charge_i)
-            average_time_swap.append(average_time_swap_i)
-            swap_ratio_in_15_min.append(swap_ratio_in_15_min_i)
+            param_list.append(urban_param)
             # iteration
             urban_count -= 1
-            progress_bar.progress(1-(urban_count+suburb_count)/(num_urban_pss+num_suburb_pss))
         #####################################################################################################################################################################
         # Suburb stations
         while suburb_count > 0:
@@ -1179,8 +1361,29 @@ if button_flag_2 == True:
                 "interaction_num" : suburb_interaction_num,                         # define the times that interaction will perform
                 "swap_time" : suburb_swap_time                                      # configure the swap time
             }
+            param_list.append(suburb_param)
+            # iteration
+            suburb_count -= 1
+        #####################################################################################################################################################################
+        # Run all stations in parallel (process pool), results arrive in completion order
+        results = [None] * len(param_list)
+        live_rows = []
+        live_table = success_info_multiple_station.empty()
+        for station_idx, result in main.do_multi_simulation(param_list, seed=int(multi_seed) if multi_seed >= 0 else None, cache=simulation_cache):
+            results[station_idx] = result
+            live_rows.append({
+                "Station": station_idx,
+                "Area": param_list[station_idx]["user_area"],
+                "Swap number": len(result[8]),
+                "Swap ratio in 15min [%]": round(result[14] * 100, 2),
+            })
+            live_table.dataframe(pd.DataFrame(live_rows).sort_values(by=["Station"]))
+            progress_bar.progress(len(live_rows) / len(param_list))
+        live_table.empty()
+
+        for result in results:
             swap_user_wait_time_i, charge_user_wait_time_i, queue_length_swap_i, queue_length_charge_i, user_dist_lst_i, max_power_i, power_history_i, residual_power_i, swap_list_i, nio_charge_list_i, non_nio_charge_list_i,\
-            average_time_swap_i, nio_average_time_charge_i, non_nio_average_time_charge_i, swap_ratio_in_15_min_i = main.do_simulation(param = suburb_param)
+            average_time_swap_i, nio_average_time_charge_i, non_nio_average_time_charge_i, swap_ratio_in_15_min_i = result
 
             swap_user_wait_time.append(swap_user_wait_time_i)
             charge_user_wait_time.append(charge_user_wait_time_i)
@@ -1197,9 +1400,6 @@ if button_flag_2 == True:
             non_nio_average_time_charge.append(non_nio_average_time_charge_i)
             average_time_swap.append(average_time_swap_i)
             swap_ratio_in_15_min.append(swap_ratio_in_15_min_i)
-            # iteration
-            suburb_count -= 1
-            progress_bar.progress(1-(urban_count+suburb_count)/(num_urban_pss+num_suburb_pss))
 
         ################################################################################
         ########################## Results calculation #################################
@@ -1306,209 +1506,227 @@ with single_station_result:
         col_m3.table(result_data.style.format(precision=2, na_rep='MISSING', thousands=" ",formatter={("Values"):"{:.2f}"}))
         st.write("")
         st.write("")
+        if replication_data is not None:
+            st.markdown("### Monte Carlo Replication Statistics")
+            st.table(replication_data.style.format(precision=2, na_rep='MISSING', thousands=" "))
+            st.write("")
 
-        # devide the plots into 2 columns
-        col1, col2 = st.columns(2)
-        col3, col4 = st.columns(2)
-        col5, col6 = st.columns(2)
-        col7, col8 = st.columns(2) 
-        # Set the plot diagram into black background and white font
-        plt.style.use('dark_background')
-
-        with col1: # arrvie time dist
-            ################################################################
-            ############## 1. show the user distribution ###################
-            ################################################################
-            fig1, ax1 = plt.subplots(figsize=(7, 5))
-            time_dist = [dt.fromtimestamp(s) for s in user_dist_lst]
-            ax1.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
-            ax1.tick_params(axis="both",direction = "out", labelsize= 10)
-            ax1.hist(x = time_dist, bins = 48, color = "#005293", edgecolor = "black")
-            plt.xlim([dt(1969, 12, 31, 23),dt(1970, 1, 2, 1)]) # 日期上下限
-            plt.xlabel("Time ticks")
-            plt.ylabel("User number in half hour, user total number = " + '%d' %len(user_dist_lst))
-            plt.title("User vehicles reach time distribution")
-            plt.grid(True, linestyle=":")
-            # fig1.autofmt_xdate()
-            st.pyplot(fig1)
-
-        with col3: # charge service time dist
+        if horizon_data is not None:
             ################################################################
-            ############## 3. show the charge time in sim ticks ############
+            ############ show the key characteristics per day ##############
             ################################################################
-            fig3, ax3 = plt.subplots(figsize=(7, 5))
-            nio_charge_dist = []
-            non_nio_charge_dist = []
-            for i in range(sim_ticks):
-                for user in nio_charge_list:
-                    if user.sequence == i:
-                        # mode = 1 wait time + charge time; mode = 0 only charge time
-                        nio_charge_dist.append(user.charge_service_time() * sim_interval / 60.0)
-                        break
-                for user in non_nio_charge_list:
-                    if user.sequence == i:
-                        non_nio_charge_dist.append(user.charge_service_time() * sim_interval / 60.0)
+            st.markdown("### Key Characteristics per Day")
+            st.dataframe(horizon_data.style.format(precision=2))
+            col_d1, col_d2 = st.columns(2)
+            with col_d1:
+                st.markdown("Energy per day [kWh]")
+                st.line_chart(horizon_data[["energy", "grid_energy", "curtailed_energy"]])
+            with col_d2:
+                st.markdown("Serviced clients per day")
+                st.line_chart(horizon_data[["swap_num", "nio_charge_num", "non_nio_charge_num"]])
+        else:
+            # devide the plots into 2 columns
+            col1, col2 = st.columns(2)
+            col3, col4 = st.columns(2)
+            col5, col6 = st.columns(2)
+            col7, col8 = st.columns(2) 
+            # Set the plot diagram into black background and white font
+            plt.style.use('dark_background')
+
+            with col1: # arrvie time dist
+                ################################################################
+                ############## 1. show the user distribution ###################
+                ################################################################
+                fig1, ax1 = plt.subplots(figsize=(7, 5))
+                time_dist = [dt.fromtimestamp(s) for s in user_dist_lst]
+                ax1.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+                ax1.tick_params(axis="both",direction = "out", labelsize= 10)
+                ax1.hist(x = time_dist, bins = 48, color = "#005293", edgecolor = "black")
+                plt.xlim([dt(1969, 12, 31, 23),dt(1970, 1, 2, 1)]) # 日期上下限
+                plt.xlabel("Time ticks")
+                plt.ylabel("User number in half hour, user total number = " + '%d' %len(user_dist_lst))
+                plt.title("User vehicles reach time distribution")
+                plt.grid(True, linestyle=":")
+                # fig1.autofmt_xdate()
+                st.pyplot(fig1)
+
+            with col3: # charge service time dist
+                ################################################################
+                ############## 3. show the charge time in sim ticks ############
+                ################################################################
+                fig3, ax3 = plt.subplots(figsize=(7, 5))
+                nio_charge_dist = []
+                non_nio_charge_dist = []
+                for i in range(sim_ticks):
+                    for user in nio_charge_list:
+                        if user.sequence == i:
+                            # mode = 1 wait time + charge time; mode = 0 only charge time
+                            nio_charge_dist.append(user.charge_service_time() * sim_interval / 60.0)
+                            break
+                    for user in non_nio_charge_list:
+                        if user.sequence == i:
+                            non_nio_charge_dist.append(user.charge_service_time() * sim_interval / 60.0)
             
-            ax3.hist([nio_charge_dist, non_nio_charge_dist], bins=15, color = ["#005293", "#98C6EA"],\
-                edgecolor = "black", label=['NIO user', 'Non NIO user'])
-            plt.xlabel("Charge service time in [min]")
-            plt.ylabel("Counts")
-            plt.title("Charge service time (Charge + Wait) distribution in 24 hours")
-            plt.grid(True, linestyle=":")
-            plt.legend(loc='upper right')
-            st.pyplot(fig3)
-
-        with col5: # charge time (No wait time)
-            ################################################################
-            ############## 5. show the charge time in sim ticks ############
-            ################################################################
-            fig5, ax5 = plt.subplots(figsize=(7, 5))
-            nio_charge_dist = []
-            non_nio_charge_dist = []
-            for i in range(sim_ticks):
-                for user in nio_charge_list:
-                    if user.sequence == i:
-                        # mode = 1 wait time + charge time; mode = 0 only charge time
-                        nio_charge_dist.append(user.charge_service_time(mode=0) * sim_interval / 60.0)
-                        break
-                for user in non_nio_charge_list:
-                    if user.sequence == i:
-                        non_nio_charge_dist.append(user.charge_service_time(mode=0) * sim_interval / 60.0)
+                ax3.hist([nio_charge_dist, non_nio_charge_dist], bins=15, color = ["#005293", "#98C6EA"],\
+                    edgecolor = "black", label=['NIO user', 'Non NIO user'])
+                plt.xlabel("Charge service time in [min]")
+                plt.ylabel("Counts")
+                plt.title("Charge service time (Charge + Wait) distribution in 24 hours")
+                plt.grid(True, linestyle=":")
+                plt.legend(loc='upper right')
+                st.pyplot(fig3)
+
+            with col5: # charge time (No wait time)
+                ################################################################
+                ############## 5. show the charge time in sim ticks ############
+                ################################################################
+                fig5, ax5 = plt.subplots(figsize=(7, 5))
+                nio_charge_dist = []
+                non_nio_charge_dist = []
+                for i in range(sim_ticks):
+                    for user in nio_charge_list:
+                        if user.sequence == i:
+                            # mode = 1 wait time + charge time; mode = 0 only charge time
+                            nio_charge_dist.append(user.charge_service_time(mode=0) * sim_interval / 60.0)
+                            break
+                    for user in non_nio_charge_list:
+                        if user.sequence == i:
+                            non_nio_charge_dist.append(user.charge_service_time(mode=0) * sim_interval / 60.0)
             
-            ax5.hist([nio_charge_dist, non_nio_charge_dist], bins=15, color = ["#005293", "#98C6EA"],\
-                edgecolor = "black", label=['NIO user', 'Non NIO user'])
-            plt.xlabel("Charge time distribution in [min]")
-            plt.ylabel("Counts")
-            plt.title("Charge time (without Wait) distribution in 24 hours")
-            plt.grid(True, linestyle=":")
-            plt.legend(loc='upper right')
-            st.pyplot(fig5)
-
-        with col7: # user num ratio
-            # ################################################################
-            # ############## 5. show the clients ratio #######################
-            # ################################################################
-            fig7, ax7 = plt.subplots(figsize=(7, 5), subplot_kw=dict(aspect="equal"))
-            label = ["swap", "charge(NIO)", "charge(Non-NIO)"]
-            data = [len(swap_list), len(nio_charge_list), len(non_nio_charge_list)]
-            colors = ["#005293", "#64A0C8", "#98C6EA"]
-            wedges, texts, persent = ax7.pie(data, wedgeprops=dict(width=0.7), startangle=45, colors=colors, autopct="%.2f%%")
-            bbox_props = dict(boxstyle="square,pad=0.3", fc="k", ec="k", lw=0.72) # fc=facecolor, ec=edgecolor
-            kw = dict(arrowprops=dict(arrowstyle="-"), bbox=bbox_props, zorder=0, va="center")
-
-            for i, p in enumerate(wedges):
-                ang = (p.theta2 - p.theta1)/2. + p.theta1
-                y = np.sin(np.deg2rad(ang))
-                x = np.cos(np.deg2rad(ang))
-                horizontalalignment = {-1: "right", 1: "left"}[int(np.sign(x))]
-                connectionstyle = "angle,angleA=0,angleB={}".format(ang)
-                kw["arrowprops"].update({"connectionstyle": connectionstyle})
-                ax7.annotate(label[i], xy=(x, y), xytext=(1.35*np.sign(x), 1.4*y),
-                            horizontalalignment=horizontalalignment, **kw)
-            ax7.set_title("Clients Ratio")
-            st.pyplot(fig7)
-
-        with col2: # power dist
-            ################################################################
-            ############## 2. show the max power distribution ##############
-            ################################################################
-            fig2, ax2 = plt.subplots(figsize=(7, 5))
-            y_plot1 = y_func
-            y_plot2 = y_grid_func
-            ax2.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
-            ax2.tick_params(axis="both",direction = "out", labelsize= 10)
-            ax2.plot_date(dates, y_plot1, "#64A0C8", label="Power Distribution")
-            ax2.plot_date(dates, y_plot2, "red",":", alpha=0.5, label="Grid Interaction")
-            ax2.plot_date(dates, power_mean_list, '--', color="#98C6EA")
-            ax2.text(x=dates[0], y=power_mean+10, s="Mean %.2f [kW]"%round(power_mean,2))
-            plt.xlim([dt(2021, 12, 31, 23),dt(2022, 1, 2, 1)]) # 日期上下限
-            plt.xlabel("Time series")
-            plt.ylabel("PSS total power, max power = " + '%.0f kW' %max_power)
-            plt.title("PSS Power distribution")
-            plt.grid(True, linestyle=":")
-            plt.legend()
-            st.pyplot(fig2)
-
-        with col4: # swap time dist
-            ################################################################
-            ############## 4. show the swap time in sim ticks ##############
-            ################################################################
-            fig4, ax4 = plt.subplots(figsize=(7, 5))
-            y_plot = []
-            recorded = 0
-            for i in range(sim_ticks):
-                for user in swap_list:
-                    if user.sequence == i:
-                        y_plot.append(user.swap_service_time * sim_interval / 60.0)
-                        break
-            ax4.hist(y_plot, bins=30, color = "#005293", edgecolor = "black")
-            plt.xlabel("Swap service time in [min]")
-            plt.ylabel("Counts")
-            plt.title("Swap service time (Swap + Wait) distribution in 24 hours")
-            plt.grid(True, linestyle=":")
-            st.pyplot(fig4)
-
-        with col6: # wait time distribution
-
-            ################################################################
-            ############## 6. show the wait time distribution ##############
-            ################################################################
-            fig6, ax6 = plt.subplots(figsize=(7, 5))
-            ax6.hist([swap_user_wait_time, charge_user_wait_time], bins=15, color = ["#005293", "#64A0C8"],\
-                edgecolor = "black", label=["Swap Group Wait Time", "Charge Group Wait Time"])
-            plt.xlabel("Wait time distribution [min]")
-            # set the interval btw 2 ticks of y axis
-            x_major_locator = MultipleLocator(10)
-            y_major_locator = MultipleLocator(5)
-            ax6.yaxis.set_major_locator(y_major_locator)
-            ax6.xaxis.set_major_locator(x_major_locator)
-            plt.ylabel("Counts")
-            plt.title("Wait time distribution")
-            plt.grid(True, linestyle=":")
-            plt.legend()
-            st.pyplot(fig6)
+                ax5.hist([nio_charge_dist, non_nio_charge_dist], bins=15, color = ["#005293", "#98C6EA"],\
+                    edgecolor = "black", label=['NIO user', 'Non NIO user'])
+                plt.xlabel("Charge time distribution in [min]")
+                plt.ylabel("Counts")
+                plt.title("Charge time (without Wait) distribution in 24 hours")
+                plt.grid(True, linestyle=":")
+                plt.legend(loc='upper right')
+                st.pyplot(fig5)
+
+            with col7: # user num ratio
+                # ################################################################
+                # ############## 5. show the clients ratio #######################
+                # ################################################################
+                fig7, ax7 = plt.subplots(figsize=(7, 5), subplot_kw=dict(aspect="equal"))
+                label = ["swap", "charge(NIO)", "charge(Non-NIO)"]
+                data = [len(swap_list), len(nio_charge_list), len(non_nio_charge_list)]
+                colors = ["#005293", "#64A0C8", "#98C6EA"]
+                wedges, texts, persent = ax7.pie(data, wedgeprops=dict(width=0.7), startangle=45, colors=colors, autopct="%.2f%%")
+                bbox_props = dict(boxstyle="square,pad=0.3", fc="k", ec="k", lw=0.72) # fc=facecolor, ec=edgecolor
+                kw = dict(arrowprops=dict(arrowstyle="-"), bbox=bbox_props, zorder=0, va="center")
+
+                for i, p in enumerate(wedges):
+                    ang = (p.theta2 - p.theta1)/2. + p.theta1
+                    y = np.sin(np.deg2rad(ang))
+                    x = np.cos(np.deg2rad(ang))
+                    horizontalalignment = {-1: "right", 1: "left"}[int(np.sign(x))]
+                    connectionstyle = "angle,angleA=0,angleB={}".format(ang)
+                    kw["arrowprops"].update({"connectionstyle": connectionstyle})
+                    ax7.annotate(label[i], xy=(x, y), xytext=(1.35*np.sign(x), 1.4*y),
+                                horizontalalignment=horizontalalignment, **kw)
+                ax7.set_title("Clients Ratio")
+                st.pyplot(fig7)
+
+            with col2: # power dist
+                ################################################################
+                ############## 2. show the max power distribution ##############
+                ################################################################
+                fig2, ax2 = plt.subplots(figsize=(7, 5))
+                y_plot1 = y_func
+                y_plot2 = y_grid_func
+                ax2.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+                ax2.tick_params(axis="both",direction = "out", labelsize= 10)
+                ax2.plot_date(dates, y_plot1, "#64A0C8", label="Power Distribution")
+                ax2.plot_date(dates, y_plot2, "red",":", alpha=0.5, label="Grid Interaction")
+                ax2.plot_date(dates, power_mean_list, '--', color="#98C6EA")
+                ax2.text(x=dates[0], y=power_mean+10, s="Mean %.2f [kW]"%round(power_mean,2))
+                plt.xlim([dt(2021, 12, 31, 23),dt(2022, 1, 2, 1)]) # 日期上下限
+                plt.xlabel("Time series")
+                plt.ylabel("PSS total power, max power = " + '%.0f kW' %max_power)
+                plt.title("PSS Power distribution")
+                plt.grid(True, linestyle=":")
+                plt.legend()
+                st.pyplot(fig2)
+
+            with col4: # swap time dist
+                ################################################################
+                ############## 4. show the swap time in sim ticks ##############
+                ################################################################
+                fig4, ax4 = plt.subplots(figsize=(7, 5))
+                y_plot = []
+                recorded = 0
+                for i in range(sim_ticks):
+                    for user in swap_list:
+                        if user.sequence == i:
+                            y_plot.append(user.swap_service_time * sim_interval / 60.0)
+                            break
+                ax4.hist(y_plot, bins=30, color = "#005293", edgecolor = "black")
+                plt.xlabel("Swap service time in [min]")
+                plt.ylabel("Counts")
+                plt.title("Swap service time (Swap + Wait) distribution in 24 hours")
+                plt.grid(True, linestyle=":")
+                st.pyplot(fig4)
+
+            with col6: # wait time distribution
+
+                ################################################################
+                ############## 6. show the wait time distribution ##############
+                ################################################################
+                fig6, ax6 = plt.subplots(figsize=(7, 5))
+                ax6.hist([swap_user_wait_time, charge_user_wait_time], bins=15, color = ["#005293", "#64A0C8"],\
+                    edgecolor = "black", label=["Swap Group Wait Time", "Charge Group Wait Time"])
+                plt.xlabel("Wait time distribution [min]")
+                # set the interval btw 2 ticks of y axis
+                x_major_locator = MultipleLocator(10)
+                y_major_locator = MultipleLocator(5)
+                ax6.yaxis.set_major_locator(y_major_locator)
+                ax6.xaxis.set_major_locator(x_major_locator)
+                plt.ylabel("Counts")
+                plt.title("Wait time distribution")
+                plt.grid(True, linestyle=":")
+                plt.legend()
+                st.pyplot(fig6)
     
-        with col8: # queue length
-            ################################################################
-            ############## 8. show the Queue length distribution ###########
-            ################################################################
-            fig8, ax8 = plt.subplots(figsize=(7, 5))
-            ax8.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
-            ax8.tick_params(axis="both",direction = "out", labelsize= 10)
-            ax8.plot_date(dates, queue_length_swap, "#005293", label="Swap Queue")
-            ax8.plot_date(dates, queue_length_charge, "#64A0C8", label="Charge Queue")
-            plt.xlim([dt(2021, 12, 31, 23),dt(2022, 1, 2, 1)]) # 日期上下限
-            # set the interval btw 2 ticks of y axis
-            y_major_locator = MultipleLocator(2)
-            ax8.yaxis.set_major_locator(y_major_locator)
-            plt.xlabel("Time series")
-            plt.ylabel("Queue length")
-            plt.title("Queue length distribution")
-            plt.grid(True, linestyle=":")
-            plt.legend()
-            st.pyplot(fig8)
-            # ################################################################
-            # ############## 6. show the average time of service #############
-            # ################################################################
-            # fig8, ax8 = plt.subplots(figsize = (7, 5))
-            # bar_width = 0.4
-            # x_index = ["Swap", "Charge(NIO)", "Charge(Non-NIO)"]
-            # index = np.arange(len(x_index))
-            # y_layer1 = [average_time_swap, nio_average_time_charge, non_nio_average_time_chagre]
-            # colors = ["#005293", "#64A0C8", "#98C6EA"]
-            # ax8.bar(x_index, y_layer1, color = colors, width=bar_width)
+            with col8: # queue length
+                ################################################################
+                ############## 8. show the Queue length distribution ###########
+                ################################################################
+                fig8, ax8 = plt.subplots(figsize=(7, 5))
+                ax8.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+                ax8.tick_params(axis="both",direction = "out", labelsize= 10)
+                ax8.plot_date(dates, queue_length_swap, "#005293", label="Swap Queue")
+                ax8.plot_date(dates, queue_length_charge, "#64A0C8", label="Charge Queue")
+                plt.xlim([dt(2021, 12, 31, 23),dt(2022, 1, 2, 1)]) # 日期上下限
+                # set the interval btw 2 ticks of y axis
+                y_major_locator = MultipleLocator(2)
+                ax8.yaxis.set_major_locator(y_major_locator)
+                plt.xlabel("Time series")
+                plt.ylabel("Queue length")
+                plt.title("Queue length distribution")
+                plt.grid(True, linestyle=":")
+                plt.legend()
+                st.pyplot(fig8)
+                # ################################################################
+                # ############## 6. show the average time of service #############
+                # ################################################################
+                # fig8, ax8 = plt.subplots(figsize = (7, 5))
+                # bar_width = 0.4
+                # x_index = ["Swap", "Charge(NIO)", "Charge(Non-NIO)"]
+                # index = np.arange(len(x_index))
+                # y_layer1 = [average_time_swap, nio_average_time_charge, non_nio_average_time_chagre]
+                # colors = ["#005293", "#64A0C8", "#98C6EA"]
+                # ax8.bar(x_index, y_layer1, color = colors, width=bar_width)
             
-            # # set up function that add text at upper of the bar
-            # @st.cache
-            # def add_text(x, y, data):
-            #     for x0, y0, data0 in zip(x, y, data):
-            #         ax8.text(x0, y0+1, round(data0, 1))
+                # # set up function that add text at upper of the bar
+                # @st.cache
+                # def add_text(x, y, data):
+                #     for x0, y0, data0 in zip(x, y, data):
+                #         ax8.text(x0, y0+1, round(data0, 1))
             
-            # add_text(index-bar_width/8, y_layer1, y_layer1)
-            # plt.ylabel("Average service time in minute")
-            # plt.title("Average service time (including wait time & swap/charge time)")
-            # plt.grid(True, linestyle=":")
-            # st.pyplot(fig8)
+                # add_text(index-bar_width/8, y_layer1, y_layer1)
+                # plt.ylabel("Average service time in minute")
+                # plt.title("Average service time (including wait time & swap/charge time)")
+                # plt.grid(True, linestyle=":")
+                # st.pyplot(fig8)
 
             
 
@@ -1974,6 +2192,71 @@ else:
     col30.markdown("### %d" %pss_data["transformer_power"] + " [kVA]")
     st.write("")
 
+# check the transformer power by simulation
+st.sidebar.write("")
+st.sidebar.markdown("## Check by Simulation:")
+st.sidebar.write("Simulate the daily swapping capacity with the station power limited to each transformer power")
+_, col_m3, _ = st.sidebar.columns([1,2,1])
+simulation_btn = col_m3.button("Simulate")
+
+if simulation_btn == True:
+    with st.sidebar:
+        with st.spinner("simulation excuting..."):
+            transformer_kpis = check_transformer_power(pss_select, power_level, ans4, ans5)
+    # smallest transformer power whose swap ratio in 15 min is at most 1% below the unlimited station
+    reference_ratio = transformer_kpis[-1][1]["swap_ratio_in_15_min"]
+    simulated_power = transformer_kpis[-1][0]
+    for level, kpis in transformer_kpis:
+        if kpis["swap_ratio_in_15_min"] >= reference_ratio - 0.01:
+            simulated_power = level
+            break
+    transformer_data = pd.DataFrame({
+        "Transformer Power [kVA]": [level for level, kpis in transformer_kpis],
+        "Swap Ratio in 15 Minutes [%]": [round(kpis["swap_ratio_in_15_min"] * 100, 1) for level, kpis in transformer_kpis],
+        "Curtailed Energy [kWh]": [round(kpis["curtailed_energy"], 1) for level, kpis in transformer_kpis],
+    })
+    st.sidebar.dataframe(transformer_data)
+    col31, col32 = st.sidebar.columns([2,1])
+    col31.info("Simulated transformer power: ")
+    col32.markdown("### %d" %simulated_power + " [kVA]")
+    st.sidebar.write("")
+
+# search the cheapest station configuration by simulation
+st.sidebar.write("")
+st.sidebar.markdown("## Search by Simulation:")
+st.sidebar.write("Search the cheapest station type, battery number, transformer power and PSC number that serves the daily swapping capacity")
+target_ratio = st.sidebar.slider("Select the target swap ratio in 15 minutes [%]", min_value=50, max_value=100, value=90, step=1)
+_, col_m4, _ = st.sidebar.columns([1,2,1])
+search_btn = col_m4.button("Search")
+
+if search_btn == True:
+    demand = {"nio_user_num": ans4, "user_preference": "fixed_value" if ans5 else "full_swap"}
+    psc_options = [4, 8] if ans5 else [0]
+    with st.sidebar:
+        with st.spinner("capacity search excuting..."):
+            capacity_result = capacity.search_capacity(demand, [("swap_ratio_in_15_min", ">=", target_ratio / 100)], psc_options=psc_options,
+                                                       power_levels=power_level, cache=simulation_cache)
+    if capacity_result is None:
+        st.sidebar.warning("No station configuration reaches the target swap ratio")
+    else:
+        col41, col42 = st.sidebar.columns([2,1])
+        col43, col44 = st.sidebar.columns([2,1])
+        col45, col46 = st.sidebar.columns([2,1])
+        col47, col48 = st.sidebar.columns([2,1])
+        col49, col50 = st.sidebar.columns([2,1])
+        col41.info("Station type: ")
+        col42.markdown("### %s" %capacity_result["station_name"])
+        col43.info("Number of batteries: ")
+        col44.markdown("### %d" %capacity_result["battery_num"])
+        col45.info("Transformer power: ")
+        col46.markdown("### %d" %capacity_result["power"] + " [kVA]")
+        col47.info("Number of PSC: ")
+        col48.markdown("### %d" %capacity_result["psc_num"])
+        col49.info("Swap ratio in 15 minutes: ")
+        col50.markdown("### %.1f" %(capacity_result["summary"]["swap_ratio_in_15_min"]["mean"] * 100) + " %")
+        st.sidebar.write("%d simulations" %capacity_result["simulations"])
+    st.sidebar.write("")
+
 # set up the Notation and contact information
 st.sidebar.write("")
 st.sidebar.write("")